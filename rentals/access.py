@@ -0,0 +1,81 @@
+from django.utils.functional import cached_property
+
+from .models import UserProfile, Vehicle
+
+
+PROFILE_FLAGS = ('can_manage_users', 'can_manage_vehicles', 'can_import_data')
+
+
+def load_access(user_id):
+    """
+    Profile flags and partner vehicle ids of a user.
+
+    Read fresh for every request rather than cached: a revoked flag or
+    partnership has to take effect in every worker process at once.
+    """
+    flags = UserProfile.objects.filter(user_id=user_id).values(*PROFILE_FLAGS).first() or {}
+    data = {flag: bool(flags.get(flag)) for flag in PROFILE_FLAGS}
+    data['vehicle_ids'] = frozenset(
+        Vehicle.partners.through.objects.filter(user_id=user_id).values_list('vehicle_id', flat=True)
+    )
+    return data
+
+
+class AccessContext:
+    """
+    What the current user may see and do, available as ``request.access``.
+
+    Nothing is loaded until a permission is first asked for, and the
+    result is shared by every later check in the request.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def _data(self):
+        if not self.user.is_authenticated:
+            return {flag: False for flag in PROFILE_FLAGS} | {'vehicle_ids': frozenset()}
+        return load_access(self.user.pk)
+
+    @property
+    def is_superuser(self):
+        return self.user.is_superuser
+
+    @property
+    def can_manage_users(self):
+        return self.is_superuser or self._data['can_manage_users']
+
+    @property
+    def can_manage_vehicles(self):
+        return self.is_superuser or self._data['can_manage_vehicles']
+
+    @property
+    def can_import_data(self):
+        return self.is_superuser or self._data['can_import_data']
+
+    @property
+    def vehicle_ids(self):
+        """Ids of the vehicles the user is a partner on."""
+        return self._data['vehicle_ids']
+
+    @property
+    def visible_vehicle_ids(self):
+        """Vehicle ids the user may view, or None when there is no restriction."""
+        if self.is_superuser:
+            return None
+        return sorted(self.vehicle_ids)
+
+    def vehicles(self):
+        if self.is_superuser:
+            return Vehicle.objects.all()
+        return Vehicle.objects.filter(pk__in=self.vehicle_ids)
+
+    def can_view_vehicle(self, vehicle):
+        return self.is_superuser or vehicle.pk in self.vehicle_ids
+
+    def can_view_user(self, user):
+        return self.is_superuser or self.user == user or self.shares_vehicle_with(user)
+
+    def shares_vehicle_with(self, user):
+        return Vehicle.partners.through.objects.filter(vehicle_id__in=self.vehicle_ids, user_id=user.pk).exists()
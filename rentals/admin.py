@@ -1,8 +1,18 @@
 from django.contrib import admin
-from .models import Vehicle, Rental, Expense, UserProfile
+from .models import Vehicle, Rental, Expense, ExpenseCategory, ExpenseCategoryRule, UserProfile
 
 admin.site.register(Vehicle)
 admin.site.register(Rental)
 admin.site.register(Expense)
 admin.site.register(UserProfile)
 
+
+class ExpenseCategoryRuleInline(admin.TabularInline):
+    model = ExpenseCategoryRule
+    extra = 1
+
+
+@admin.register(ExpenseCategory)
+class ExpenseCategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'sort_order')
+    inlines = [ExpenseCategoryRuleInline]
@@ -0,0 +1,206 @@
+from datetime import date
+
+import numpy as np
+from django.db.models import Q
+
+from .models import Rental, VehicleUtilization
+
+
+DAY = np.timedelta64(1, 'D')
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(first, last):
+    """All month starts from ``first`` to ``last`` inclusive."""
+    months = []
+    current = month_start(first)
+    while current <= last:
+        months.append(current)
+        current = add_months(current, 1)
+    return months
+
+
+def _minutes(times):
+    """Minutes past midnight for each time, -1 where there is none."""
+    return np.fromiter(
+        (-1 if value is None else value.hour * 60 + value.minute for value in times),
+        dtype=np.int64, count=len(times),
+    ).astype('timedelta64[m]')
+
+
+def _rental_arrays(vehicle_ids, period_start, period_end, now):
+    rows = list(
+        Rental.objects.filter(vehicle_id__in=vehicle_ids, date_out__lt=period_end)
+        .filter(Q(date_in__isnull=True) | Q(date_in__gte=period_start))
+        .values_list('vehicle_id', 'date_out', 'time_out', 'date_in', 'time_in')
+    )
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[m]'), np.empty(0, dtype='datetime64[m]')
+
+    vehicle_col, date_out, time_out, date_in, time_in = zip(*rows)
+    vehicle_col = np.fromiter(vehicle_col, dtype=np.int64, count=len(rows))
+    starts = np.array(date_out, dtype='datetime64[D]').astype('datetime64[m]') + np.maximum(_minutes(time_out), 0)
+
+    # Unreturned rentals come through as NaT
+    returned = np.array(date_in, dtype='datetime64[D]').astype('datetime64[m]')
+    minutes_in = _minutes(time_in)
+    # No return time recorded, so count the whole return day
+    ends = np.where(minutes_in >= np.timedelta64(0, 'm'), returned + minutes_in, returned + DAY)
+    ends = np.where(np.isnat(returned), np.maximum(now, starts), ends)
+
+    ends = np.maximum(ends, starts)
+    return vehicle_col, starts, ends
+
+
+def compute_utilization(vehicle_ids, months, today=None):
+    """
+    Utilization figures for every (vehicle, month) pair.
+
+    Rental intervals are clipped against all month boundaries at once with
+    NumPy broadcasting, so the cost is one pass over the rentals regardless
+    of how many months are requested.
+    """
+    today = today or date.today()
+    vehicle_ids = list(vehicle_ids)
+    if not vehicle_ids or not months:
+        return {}
+
+    month_starts = np.array(months, dtype='datetime64[D]').astype('datetime64[m]')
+    month_ends = np.array([add_months(m, 1) for m in months], dtype='datetime64[D]').astype('datetime64[m]')
+    now = np.datetime64(today, 'm') + DAY
+
+    vehicle_col, starts, ends = _rental_arrays(vehicle_ids, months[0], add_months(months[-1], 1), now)
+    position = {vehicle_id: i for i, vehicle_id in enumerate(vehicle_ids)}
+    rows = np.array([position[v] for v in vehicle_col], dtype=np.int64)
+
+    shape = (len(vehicle_ids), len(months))
+    rented = np.zeros(shape)
+    trips = np.zeros(shape, dtype=np.int64)
+    trip_days = np.zeros(shape)
+
+    if len(starts):
+        overlap = (
+            np.minimum(ends[:, None], month_ends[None, :]) - np.maximum(starts[:, None], month_starts[None, :])
+        ) / DAY
+        np.add.at(rented, rows, np.clip(overlap, 0, None))
+
+        # Trips are attributed to the month they started in
+        trip_month = np.searchsorted(month_starts, starts, side='right') - 1
+        in_range = (trip_month >= 0) & (starts < month_ends[-1])
+        np.add.at(trips, (rows[in_range], trip_month[in_range]), 1)
+        np.add.at(trip_days, (rows[in_range], trip_month[in_range]), ((ends - starts) / DAY)[in_range])
+
+    # The running month only counts the days that have already happened
+    available = (np.minimum(month_ends, now) - month_starts) / DAY
+    available = np.clip(available, 0, None)
+    rented = np.minimum(rented, available[None, :])
+
+    result = {}
+    for i, vehicle_id in enumerate(vehicle_ids):
+        result[vehicle_id] = {}
+        for j, month in enumerate(months):
+            result[vehicle_id][month] = {
+                'rented_days': round(float(rented[i, j]), 2),
+                'available_days': round(float(available[j]), 2),
+                'trip_count': int(trips[i, j]),
+                'trip_days': round(float(trip_days[i, j]), 2),
+            }
+    return result
+
+
+def _with_ratios(month, data):
+    rented = data['rented_days']
+    available = data['available_days']
+    trips = data['trip_count']
+    return {
+        'month': month,
+        'rented_days': rented,
+        'idle_days': round(max(available - rented, 0), 2),
+        'available_days': available,
+        'occupancy': round(rented / available * 100, 1) if available else 0,
+        'trip_count': trips,
+        'avg_trip_days': round(data['trip_days'] / trips, 2) if trips else 0,
+    }
+
+
+def monthly_utilization(vehicle_ids, first_month, last_month, today=None):
+    """
+    Per-vehicle, per-month utilization rows between two months.
+
+    Closed months are read from VehicleUtilization and only computed (then
+    stored) the first time they are asked for; the running month is always
+    computed live.
+    """
+    today = today or date.today()
+    vehicle_ids = list(vehicle_ids)
+    current_month = month_start(today)
+    months = [m for m in month_range(first_month, last_month) if m <= current_month]
+
+    stats = {vehicle_id: {} for vehicle_id in vehicle_ids}
+    closed_months = [m for m in months if m < current_month]
+
+    if closed_months:
+        cached = VehicleUtilization.objects.filter(
+            vehicle_id__in=vehicle_ids, month__gte=closed_months[0], month__lte=closed_months[-1]
+        ).values('vehicle_id', 'month', 'rented_days', 'available_days', 'trip_count', 'trip_days')
+        for row in cached:
+            stats[row['vehicle_id']][row['month']] = {
+                'rented_days': float(row['rented_days']),
+                'available_days': float(row['available_days']),
+                'trip_count': row['trip_count'],
+                'trip_days': float(row['trip_days']),
+            }
+
+        missing = [v for v in vehicle_ids if len(stats[v]) < len(closed_months)]
+        if missing:
+            computed = compute_utilization(missing, closed_months, today)
+            new_rows = []
+            for vehicle_id in missing:
+                for month, data in computed[vehicle_id].items():
+                    if month in stats[vehicle_id]:
+                        continue
+                    stats[vehicle_id][month] = data
+                    new_rows.append(VehicleUtilization(vehicle_id=vehicle_id, month=month, **data))
+            VehicleUtilization.objects.bulk_create(new_rows, ignore_conflicts=True)
+
+    if months and months[-1] == current_month:
+        live = compute_utilization(vehicle_ids, [current_month], today)
+        for vehicle_id in vehicle_ids:
+            stats[vehicle_id][current_month] = live[vehicle_id][current_month]
+
+    return {
+        vehicle_id: [_with_ratios(m, stats[vehicle_id][m]) for m in months]
+        for vehicle_id in vehicle_ids
+    }
+
+
+def summarize_utilization(rows):
+    """Collapse a list of monthly rows into one total row."""
+    rented = sum(r['rented_days'] for r in rows)
+    available = sum(r['available_days'] for r in rows)
+    trips = sum(r['trip_count'] for r in rows)
+    trip_days = sum(r['avg_trip_days'] * r['trip_count'] for r in rows)
+    return {
+        'rented_days': round(rented, 2),
+        'idle_days': round(max(available - rented, 0), 2),
+        'available_days': round(available, 2),
+        'occupancy': round(rented / available * 100, 1) if available else 0,
+        'trip_count': trips,
+        'avg_trip_days': round(trip_days / trips, 2) if trips else 0,
+    }
+
+
+def invalidate_utilization(vehicle_id, *dates):
+    """Drop cached months from the earliest of ``dates`` onwards for a vehicle."""
+    dates = [d for d in dates if d]
+    if not vehicle_id or not dates:
+        return
+    VehicleUtilization.objects.filter(vehicle_id=vehicle_id, month__gte=month_start(min(dates))).delete()
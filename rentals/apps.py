@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RentalsConfig(AppConfig):
@@ -6,4 +7,7 @@ class RentalsConfig(AppConfig):
     name = 'rentals'
 
     def ready(self):
+        import rentals.checks
         import rentals.signals
+        from rentals.search import ensure_search_index
+        post_migrate.connect(ensure_search_index, sender=self)
@@ -0,0 +1,217 @@
+from datetime import date
+from itertools import chain
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncMonth
+
+from .analytics import add_months, monthly_utilization
+from .mileage import refresh_mileage
+from .models import (
+    HAS_BALANCE, TOTAL_RENT, ArchivedExpense, ArchivedRental, Expense, MonthlySummary, Rental, RentalMileage, Tombstone,
+)
+
+
+ARCHIVE_AFTER_YEARS = getattr(settings, 'RENTALS_ARCHIVE_AFTER_YEARS', 2)
+
+
+def archive_cutoff(years=None, today=None):
+    """
+    First date that stays live. Rows dated before it belong to years that
+    closed more than ``years`` years ago.
+    """
+    today = today or date.today()
+    years = ARCHIVE_AFTER_YEARS if years is None else years
+    return date(today.year - years, 1, 1)
+
+
+def _move_rows(source, target, date_column, before=None, since=None, vehicle_ids=None, only=None):
+    """
+    Copy matching rows, primary keys included, into ``target`` and delete
+    them from ``source``; ``only`` is a queryset of ``source`` narrowing the
+    rows further.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in source._meta.concrete_fields)
+
+    conditions = []
+    params = []
+    if before is not None:
+        conditions.append(f'{quote(date_column)} < %s')
+        params.append(before)
+    if since is not None:
+        conditions.append(f'{quote(date_column)} >= %s')
+        params.append(since)
+    if vehicle_ids is not None:
+        conditions.append(f"{quote('vehicle_id')} IN ({', '.join(['%s'] * len(vehicle_ids))})")
+        params.extend(vehicle_ids)
+    if only is not None:
+        sql, only_params = only.values('id').query.sql_with_params()
+        conditions.append(f"{quote('id')} IN ({sql})")
+        params.extend(only_params)
+    where = ' AND '.join(conditions) or '1 = 1'
+
+    source_table = quote(source._meta.db_table)
+    target_table = quote(target._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {target_table} ({columns}) SELECT {columns} FROM {source_table} WHERE {where}', params)
+        moved = cursor.rowcount
+        # Only delete what was copied, in case rows arrived between the statements
+        cursor.execute(
+            f"DELETE FROM {source_table} WHERE {where} AND {quote('id')} IN (SELECT {quote('id')} FROM {target_table})",
+            params,
+        )
+    return moved
+
+
+def rebuild_summaries(vehicle_ids=None):
+    """Recompute MonthlySummary from the archive tables so it always matches them."""
+    rentals = ArchivedRental.objects.all()
+    expenses = ArchivedExpense.objects.all()
+    summaries = MonthlySummary.objects.all()
+    if vehicle_ids is not None:
+        rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+        expenses = expenses.filter(vehicle_id__in=vehicle_ids)
+        summaries = summaries.filter(vehicle_id__in=vehicle_ids)
+
+    totals = {}
+    rental_rows = (
+        rentals.annotate(month=TruncMonth('date_out')).values('vehicle_id', 'month')
+        .annotate(count=Count('id'), income=Sum('total_amount_received'), rent_total=Sum(TOTAL_RENT))
+    )
+    for row in rental_rows:
+        summary = totals.setdefault((row['vehicle_id'], row['month']), MonthlySummary(vehicle_id=row['vehicle_id'], month=row['month']))
+        summary.rental_count = row['count']
+        summary.income = row['income'] or 0
+        summary.rent_total = row['rent_total'] or 0
+
+    expense_rows = (
+        expenses.annotate(month=TruncMonth('date')).values('vehicle_id', 'month')
+        .annotate(count=Count('id'), expense=Sum('amount'))
+    )
+    for row in expense_rows:
+        summary = totals.setdefault((row['vehicle_id'], row['month']), MonthlySummary(vehicle_id=row['vehicle_id'], month=row['month']))
+        summary.expense_count = row['count']
+        summary.expense = row['expense'] or 0
+
+    summaries.delete()
+    MonthlySummary.objects.bulk_create(totals.values(), batch_size=500)
+    return len(totals)
+
+
+def archive_before(cutoff, vehicle_ids=None):
+    """
+    Move rentals and expenses dated before ``cutoff`` into the archive
+    tables and refresh the monthly summaries of the vehicles involved.
+
+    Archived rows can't be edited, so rentals still out or still owing
+    money stay live until they are settled.
+
+    Rows are moved with set-based SQL, so model signals do not fire;
+    utilization of the archived months is stored first so it survives the
+    move, mileage records are kept on the archived rentals, and tombstones
+    for the sync feed are written in the same transaction. Returns the number of rentals, expenses and summaries, and how
+    many old rentals were kept live.
+    """
+    old_rentals = Rental.objects.filter(date_out__lt=cutoff)
+    expenses = Expense.objects.filter(date__lt=cutoff)
+    if vehicle_ids is not None:
+        old_rentals = old_rentals.filter(vehicle_id__in=vehicle_ids)
+        expenses = expenses.filter(vehicle_id__in=vehicle_ids)
+    rentals = old_rentals.filter(date_in__isnull=False).exclude(HAS_BALANCE)
+
+    with transaction.atomic():
+        touched = sorted(set(rentals.values_list('vehicle_id', flat=True)) | set(expenses.values_list('vehicle_id', flat=True)))
+        kept_open = old_rentals.count() - rentals.count()
+        if not touched:
+            return {'rentals': 0, 'expenses': 0, 'summaries': 0, 'kept_open': kept_open}
+
+        first = rentals.aggregate(first=Min('date_out'))['first']
+        if first:
+            monthly_utilization(touched, first.replace(day=1), add_months(cutoff.replace(day=1), -1))
+
+        # Sync clients drop archived records as if they had been deleted
+        tombstones = [
+            Tombstone(kind=kind, object_id=pk, vehicle_id=vehicle_id)
+            for kind, rows in (('rental', rentals), ('expense', expenses))
+            for pk, vehicle_id in rows.values_list('pk', 'vehicle_id')
+        ]
+
+        # Mileage records follow their rentals (same primary key) into the archive
+        RentalMileage.objects.filter(rental__in=rentals).update(archived_rental_id=F('rental_id'), rental=None)
+        moved_rentals = _move_rows(Rental, ArchivedRental, 'date_out', before=cutoff, vehicle_ids=vehicle_ids, only=rentals)
+        moved_expenses = _move_rows(Expense, ArchivedExpense, 'date', before=cutoff, vehicle_ids=vehicle_ids)
+        Tombstone.objects.bulk_create(tombstones, batch_size=500)
+        summaries = rebuild_summaries(touched)
+
+    return {'rentals': moved_rentals, 'expenses': moved_expenses, 'summaries': summaries, 'kept_open': kept_open}
+
+
+def restore_archive(since=None, vehicle_ids=None):
+    """Move archived rows dated on or after ``since`` (all of them if None) back into the live tables."""
+    rentals = ArchivedRental.objects.all()
+    expenses = ArchivedExpense.objects.all()
+    if since is not None:
+        rentals = rentals.filter(date_out__gte=since)
+        expenses = expenses.filter(date__gte=since)
+    if vehicle_ids is not None:
+        rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+        expenses = expenses.filter(vehicle_id__in=vehicle_ids)
+
+    with transaction.atomic():
+        touched = sorted(set(rentals.values_list('vehicle_id', flat=True)) | set(expenses.values_list('vehicle_id', flat=True)))
+        if not touched:
+            return {'rentals': 0, 'expenses': 0, 'summaries': 0}
+
+        RentalMileage.objects.filter(archived_rental__in=rentals).update(rental_id=F('archived_rental_id'), archived_rental=None)
+        moved_rentals = _move_rows(ArchivedRental, Rental, 'date_out', since=since, vehicle_ids=vehicle_ids)
+        moved_expenses = _move_rows(ArchivedExpense, Expense, 'date', since=since, vehicle_ids=vehicle_ids)
+        summaries = rebuild_summaries(touched)
+        for vehicle_id in touched:
+            refresh_mileage(vehicle_id)
+
+    return {'rentals': moved_rentals, 'expenses': moved_expenses, 'summaries': summaries}
+
+
+# Reading helpers: reports add these to their live-table queries
+
+def summaries_for(vehicles=None, vehicle_ids=None):
+    summaries = MonthlySummary.objects.all()
+    if vehicles is not None:
+        summaries = summaries.filter(vehicle__in=vehicles)
+    if vehicle_ids is not None:
+        summaries = summaries.filter(vehicle_id__in=vehicle_ids)
+    return summaries
+
+
+def archived_total(summaries, field):
+    return summaries.aggregate(total=Sum(field))['total'] or 0
+
+
+def archived_by_month(summaries, field):
+    """Monthly totals shaped like the live ``values('month').annotate(...)`` series."""
+    rows = summaries.values('month').annotate(total=Sum(field)).order_by('month')
+    return [{'month': row['month'], field: row['total']} for row in rows]
+
+
+def combine_monthly(live_rows, archived_rows, field):
+    """Merge two monthly series, adding up months present in both."""
+    merged = {}
+    for row in chain(live_rows, archived_rows):
+        if row['month'] in merged:
+            merged[row['month']][field] = (merged[row['month']][field] or 0) + (row[field] or 0)
+        else:
+            merged[row['month']] = dict(row)
+    return [merged[month] for month in sorted(merged)]
+
+
+def archive_month_bounds(summaries):
+    bounds = summaries.aggregate(first=Min('month'), last=Max('month'))
+    return bounds['first'], bounds['last']
+
+
+def with_archived(live, archived, date_field):
+    """Live and archived rows together, oldest first, for exports."""
+    return sorted(chain(live, archived), key=attrgetter(date_field))
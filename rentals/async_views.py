@@ -0,0 +1,61 @@
+"""
+Async variants of the heaviest pages, for deployments served through
+vehicle_manager/asgi.py. They build exactly the same context as the sync
+views but run the page's independent queries concurrently.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import get_object_or_404, redirect, render
+
+from .concurrency import gather_queries
+from .models import Vehicle
+from .views import (
+    USER_DETAIL_WRITES, VEHICLE_DETAIL_WRITES, dashboard_context, dashboard_queries, get_selected_year,
+    user_detail_context, user_detail_queries, vehicle_detail_context, vehicle_detail_queries,
+)
+
+
+def async_login_required(view):
+    """login_required for coroutine views; resolving request.user touches the database."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+async def dashboard(request):
+    vehicles = await sync_to_async(request.access.vehicles)()
+    results = await gather_queries(dashboard_queries(vehicles))
+    return await sync_to_async(render)(request, 'dashboard.html', dashboard_context(results))
+
+
+@async_login_required
+async def vehicle_detail(request, pk):
+    vehicle = await sync_to_async(get_object_or_404)(Vehicle, pk=pk)
+
+    if not await sync_to_async(request.access.can_view_vehicle)(vehicle):
+        messages.error(request, "You do not have permission to view this vehicle.")
+        return redirect('vehicle_list')
+
+    results = await gather_queries(vehicle_detail_queries(vehicle), writes=VEHICLE_DETAIL_WRITES)
+    return await sync_to_async(render)(request, 'vehicle_detail.html', vehicle_detail_context(vehicle, results))
+
+
+@async_login_required
+async def user_detail(request, pk):
+    user = await sync_to_async(get_object_or_404)(User, pk=pk)
+
+    if not await sync_to_async(request.access.can_view_user)(user):
+        messages.error(request, "You do not have permission to view this user.")
+        return redirect('user_list')
+
+    selected_year = get_selected_year(request)
+    results = await gather_queries(user_detail_queries(user, selected_year), writes=USER_DETAIL_WRITES)
+    return await sync_to_async(render)(request, 'user_detail.html', user_detail_context(user, selected_year, results))
@@ -0,0 +1,119 @@
+from bisect import bisect_left
+from datetime import datetime, time
+
+from django.db.models import Q
+
+from .models import Rental
+
+
+OPEN_END = datetime.max
+
+
+def rental_interval(date_out, time_out, date_in, time_in):
+    """Return the (start, end) datetimes a rental keeps the vehicle busy."""
+    start = datetime.combine(date_out, time_out or time.min)
+    if date_in is None:
+        # Vehicle has not come back yet, so it stays busy until it does
+        return start, OPEN_END
+    end = datetime.combine(date_in, time_in or time.max)
+    return start, max(start, end)
+
+
+class AvailabilityIndex:
+    """
+    Per-vehicle interval index over rentals.
+
+    Intervals are kept sorted by start time together with a running maximum
+    of their end times, so "is anything busy between start and end" is a
+    binary search plus one comparison instead of a scan over the history.
+    """
+
+    def __init__(self, rows):
+        self._starts = {}
+        self._max_ends = {}
+        self._rentals = {}
+
+        for vehicle_id, rental_id, customer_name, date_out, time_out, date_in, time_in in rows:
+            start, end = rental_interval(date_out, time_out, date_in, time_in)
+            self._rentals.setdefault(vehicle_id, []).append((start, end, rental_id, customer_name))
+
+        for vehicle_id, intervals in self._rentals.items():
+            intervals.sort(key=lambda item: item[0])
+            starts, max_ends = [], []
+            running_max = datetime.min
+            for start, end, _, _ in intervals:
+                running_max = max(running_max, end)
+                starts.append(start)
+                max_ends.append(running_max)
+            self._starts[vehicle_id] = starts
+            self._max_ends[vehicle_id] = max_ends
+
+    @classmethod
+    def for_window(cls, start, end, vehicle_ids=None, exclude_rental_id=None):
+        """Build an index from the rentals that can touch the [start, end) window."""
+        rentals = Rental.objects.filter(date_out__lte=end.date()).filter(
+            Q(date_in__isnull=True) | Q(date_in__gte=start.date())
+        )
+        if vehicle_ids is not None:
+            rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+        if exclude_rental_id is not None:
+            rentals = rentals.exclude(pk=exclude_rental_id)
+
+        rows = rentals.values_list(
+            'vehicle_id', 'id', 'customer_name', 'date_out', 'time_out', 'date_in', 'time_in'
+        )
+        return cls(rows)
+
+    def is_busy(self, vehicle_id, start, end):
+        starts = self._starts.get(vehicle_id)
+        if not starts:
+            return False
+        idx = bisect_left(starts, end)
+        return idx > 0 and self._max_ends[vehicle_id][idx - 1] > start
+
+    def conflicts(self, vehicle_id, start, end):
+        """Return the rentals of a vehicle that overlap the [start, end) window."""
+        if not self.is_busy(vehicle_id, start, end):
+            return []
+
+        idx = bisect_left(self._starts[vehicle_id], end)
+        max_ends = self._max_ends[vehicle_id]
+        intervals = self._rentals[vehicle_id]
+        found = []
+        while idx > 0 and max_ends[idx - 1] > start:
+            idx -= 1
+            rental_start, rental_end, rental_id, customer_name = intervals[idx]
+            if rental_end > start:
+                found.append({
+                    'rental_id': rental_id,
+                    'customer_name': customer_name,
+                    'start': rental_start,
+                    'end': None if rental_end == OPEN_END else rental_end,
+                })
+        found.reverse()
+        return found
+
+
+def fleet_availability(vehicles, start, end):
+    """Free/busy status of every vehicle in ``vehicles`` for the [start, end) window."""
+    vehicles = list(vehicles)
+    index = AvailabilityIndex.for_window(start, end, vehicle_ids=[v.pk for v in vehicles])
+
+    result = []
+    for vehicle in vehicles:
+        busy = index.conflicts(vehicle.pk, start, end)
+        result.append({
+            'vehicle': vehicle,
+            'available': not busy,
+            'busy': busy,
+        })
+    return result
+
+
+def find_conflicting_rentals(rental):
+    """Rentals of the same vehicle whose interval overlaps ``rental``."""
+    start, end = rental_interval(rental.date_out, rental.time_out, rental.date_in, rental.time_in)
+    index = AvailabilityIndex.for_window(
+        start, end, vehicle_ids=[rental.vehicle_id], exclude_rental_id=rental.pk
+    )
+    return index.conflicts(rental.vehicle_id, start, end)
@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import DateField, F, Func, Min, Value
+from django.utils import timezone
+
+from .analytics import invalidate_utilization
+from .availability import AvailabilityIndex, rental_interval
+from .choices import partner_choices
+from .mileage import refresh_mileage
+from .models import Expense, Rental, Tombstone
+from .signals import per_row_refresh_muted
+from .statements import mark_statements_stale
+
+
+# kind -> (model, date fields, the first one being what aggregates are keyed on)
+BULK_MODELS = {
+    'rental': (Rental, ['date_out', 'date_in']),
+    'expense': (Expense, ['date']),
+}
+
+BULK_ACTIONS = ('delete', 'reassign', 'move', 'shift')
+
+
+class BulkActionError(ValueError):
+    pass
+
+
+def _shifted(field, days):
+    # SQLite's date arithmetic through Django yields datetime strings, so use date() there
+    if connection.vendor == 'sqlite':
+        return Func(F(field), Value(f'{days:+d} days'), function='date', output_field=DateField())
+    return F(field) + timedelta(days=days)
+
+
+def refresh_derived(kind, vehicle_ids, since):
+    """Bring a vehicle's derived data up to date once for the whole batch."""
+    for vehicle_id in vehicle_ids:
+        if kind == 'rental':
+            invalidate_utilization(vehicle_id, since)
+            refresh_mileage(vehicle_id, since=since)
+        mark_statements_stale(vehicle_id, since)
+
+
+def _check_overlaps(pks, vehicle_id, days=0):
+    """
+    Raise BulkActionError if the rentals ``pks``, placed on ``vehicle_id``
+    and shifted by ``days``, would overlap any other booking there.
+    """
+    shift = timedelta(days=days)
+    rentals = []
+    for customer_name, date_out, time_out, date_in, time_in in (
+        Rental.objects.filter(pk__in=pks).values_list('customer_name', 'date_out', 'time_out', 'date_in', 'time_in')
+    ):
+        start, end = rental_interval(date_out + shift, time_out, date_in and date_in + shift, time_in)
+        rentals.append((customer_name, start, end))
+
+    index = AvailabilityIndex.for_window(
+        min(start for _, start, _ in rentals), max(end for _, _, end in rentals), vehicle_ids=[vehicle_id],
+    )
+    for customer_name, start, end in rentals:
+        # The selected rentals don't clash with each other, wherever they end up
+        clashes = [clash for clash in index.conflicts(vehicle_id, start, end) if clash['rental_id'] not in pks]
+        if clashes:
+            clash = clashes[0]
+            until = clash['end'].strftime('%d %b %Y %H:%M') if clash['end'] else 'not returned yet'
+            raise BulkActionError(
+                f"{customer_name}'s rental would overlap the booking by {clash['customer_name']} "
+                f"from {clash['start'].strftime('%d %b %Y %H:%M')} to {until}."
+            )
+
+
+def bulk_action(kind, vehicle, ids, action, user=None, target_vehicle=None, days=None):
+    """
+    Apply ``action`` to the given rentals or expenses of ``vehicle`` and
+    return how many rows it touched.
+
+    Deletes go through the ORM so cascades still happen, but with the
+    per-row derived-data receivers muted; the other actions are one
+    set-based UPDATE, so per-row signals never fire. Either way
+    utilization, mileage, statements and the sync feed are brought up to
+    date once for the batch, in the same transaction. The search index
+    follows along through its triggers.
+
+    Moves and date shifts are refused if a rental would overlap another
+    booking, and records can only be reassigned to the partners the
+    vehicle's forms offer.
+    """
+    if kind not in BULK_MODELS or action not in BULK_ACTIONS:
+        raise BulkActionError("Unknown bulk action.")
+    model, date_fields = BULK_MODELS[kind]
+    date_field = date_fields[0]
+
+    with transaction.atomic():
+        rows = model.objects.filter(vehicle=vehicle, pk__in=ids)
+        pks = list(rows.select_for_update().values_list('pk', flat=True))
+        if not pks:
+            return 0
+        rows = model.objects.filter(pk__in=pks)
+        since = rows.aggregate(first=Min(date_field))['first']
+        now = timezone.now()
+
+        if action == 'delete':
+            with per_row_refresh_muted():
+                count = rows.delete()[1].get(model._meta.label, 0)
+            Tombstone.objects.bulk_create([Tombstone(kind=kind, object_id=pk, vehicle_id=vehicle.pk) for pk in pks])
+            refresh_derived(kind, [vehicle.pk], since)
+
+        elif action == 'reassign':
+            if user is not None and user.pk not in {partner.pk for partner in partner_choices(vehicle)}:
+                raise BulkActionError(f"{user.username} is not a partner of {vehicle.name}.")
+            # The partner on a record doesn't feed any derived figures
+            count = rows.update(user=user, updated_at=now)
+
+        elif action == 'move':
+            if target_vehicle is None:
+                raise BulkActionError("Choose a vehicle to move to.")
+            if target_vehicle.pk == vehicle.pk:
+                return 0
+            if kind == 'rental':
+                _check_overlaps(set(pks), target_vehicle.pk)
+            count = rows.update(vehicle=target_vehicle, updated_at=now)
+            # Clients that only see the old vehicle must drop the records
+            Tombstone.objects.bulk_create([Tombstone(kind=kind, object_id=pk, vehicle_id=vehicle.pk) for pk in pks])
+            refresh_derived(kind, [vehicle.pk, target_vehicle.pk], since)
+
+        else:
+            if not days:
+                raise BulkActionError("Enter a non-zero number of days to shift by.")
+            if kind == 'rental':
+                _check_overlaps(set(pks), vehicle.pk, days)
+            count = rows.update(updated_at=now, **{field: _shifted(field, days) for field in date_fields})
+            refresh_derived(kind, [vehicle.pk], since + timedelta(days=min(days, 0)))
+
+    return count
@@ -0,0 +1,180 @@
+import re
+from collections import defaultdict
+from datetime import date
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .analytics import add_months
+from .models import ArchivedExpense, Expense, ExpenseCategory, ExpenseCategoryRule
+
+
+RULES_CACHE_KEY = 'expense_category_rules'
+RULES_CACHE_TIMEOUT = 60 * 60
+
+UNCATEGORIZED = 'Uncategorized'
+
+# Created by `classify_expenses --with-defaults`; edit them in the admin afterwards
+DEFAULT_CATEGORIES = [
+    ('Fuel', ['diesel', 'petrol', 'fuel', 'cng']),
+    ('Service & Repairs', ['service', 'servicing', 'repair', 'repairs', 'mechanic', 'spare', 'spares', 'oil change', 'battery', 'alignment']),
+    ('Tyres', ['tyre', 'tyres', 'tire', 'tires', 'puncture']),
+    ('EMI', ['emi', 'loan', 'instalment', 'installment']),
+    ('Insurance', ['insurance', 'policy']),
+    ('Tax & Permits', ['tax', 'permit', 'fitness', 'pollution', 'registration']),
+    ('Cleaning', ['wash', 'washing', 'cleaning', 'polish']),
+    ('Tolls & Parking', ['toll', 'fastag', 'parking']),
+    ('Fines', ['fine', 'challan', 'penalty']),
+    ('Driver', ['driver', 'bata', 'salary']),
+]
+
+
+def load_rules():
+    """Active rules as (regex, category id) pairs in priority order, cached until a rule changes."""
+    rules = cache.get(RULES_CACHE_KEY)
+    if rules is None:
+        rules = [
+            (rule.regex(), rule.category_id)
+            for rule in ExpenseCategoryRule.objects.filter(is_active=True).order_by('priority', 'id')
+        ]
+        cache.set(RULES_CACHE_KEY, rules, RULES_CACHE_TIMEOUT)
+    return rules
+
+
+def invalidate_rules():
+    cache.delete(RULES_CACHE_KEY)
+
+
+class ExpenseClassifier:
+    """Compiled category rules; build one per batch and call it for each expense."""
+
+    def __init__(self, rules=None):
+        self.rules = []
+        for pattern, category_id in load_rules() if rules is None else rules:
+            try:
+                self.rules.append((re.compile(pattern, re.IGNORECASE), category_id))
+            except re.error:
+                # Bad patterns are rejected in the admin; skip any that slipped in
+                continue
+
+    def __call__(self, particulars):
+        text = ' '.join(str(particulars or '').split())
+        for regex, category_id in self.rules:
+            if regex.search(text):
+                return category_id
+        return None
+
+    def classify(self, expenses):
+        """Set ``category_id`` on unsaved or loaded expenses in place; returns the ones that changed."""
+        changed = []
+        for expense in expenses:
+            category_id = self(expense.particulars)
+            if category_id != expense.category_id:
+                expense.category_id = category_id
+                changed.append(expense)
+        return changed
+
+
+def backfill_categories(batch_size=1000, reclassify=False):
+    """
+    Classify stored expenses in primary-key batches, writing each batch's
+    changes with one UPDATE per category. Returns (examined, changed).
+    """
+    classifier = ExpenseClassifier()
+    expenses = Expense.objects.only('id', 'particulars', 'category_id').order_by('pk')
+    if not reclassify:
+        expenses = expenses.filter(category__isnull=True)
+
+    examined = changed_count = 0
+    last_pk = 0
+    while True:
+        batch = list(expenses.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        examined += len(batch)
+
+        by_category = defaultdict(list)
+        for expense in classifier.classify(batch):
+            by_category[expense.category_id].append(expense.pk)
+        # One UPDATE per category; set updated_at by hand so sync clients see the change
+        now = timezone.now()
+        for category_id, ids in by_category.items():
+            changed_count += Expense.objects.filter(pk__in=ids).update(category_id=category_id, updated_at=now)
+    return examined, changed_count
+
+
+def create_default_categories():
+    """Add the default categories and keyword rules that don't exist yet; returns how many rules were added."""
+    created = 0
+    for order, (name, keywords) in enumerate(DEFAULT_CATEGORIES):
+        category, _ = ExpenseCategory.objects.get_or_create(name=name, defaults={'sort_order': order})
+        existing = set(category.rules.values_list('pattern', flat=True))
+        rules = [
+            ExpenseCategoryRule(category=category, pattern=keyword, priority=(order + 1) * 10)
+            for keyword in keywords if keyword not in existing
+        ]
+        ExpenseCategoryRule.objects.bulk_create(rules)
+        created += len(rules)
+    invalidate_rules()
+    return created
+
+
+def category_breakdown(expenses, archived=None, months=6, today=None):
+    """
+    Expense totals per category for each of the last ``months`` months and
+    for all time, from two grouped queries on the (vehicle, category, date)
+    index plus one on the archive.
+    """
+    this_month = (today or date.today()).replace(day=1)
+    month_list = [add_months(this_month, offset) for offset in range(1 - months, 1)]
+
+    categories = list(ExpenseCategory.objects.values_list('id', 'name'))
+    names = dict(categories)
+    order = {pk: index for index, (pk, _) in enumerate(categories)}
+    rows = {}
+
+    def row_for(category_id):
+        if category_id not in rows:
+            rows[category_id] = {
+                'category_id': category_id,
+                'name': names.get(category_id, UNCATEGORIZED),
+                'monthly': {month: 0 for month in month_list},
+                'total': 0,
+            }
+        return rows[category_id]
+
+    totals = [expenses.values('category_id').annotate(total=Sum('amount')).order_by()]
+    if archived is not None:
+        totals.append(archived.values('category_id').annotate(total=Sum('amount')).order_by())
+    for queryset in totals:
+        for row in queryset:
+            row_for(row['category_id'])['total'] += row['total'] or 0
+
+    recent = (
+        expenses.filter(date__gte=month_list[0])
+        .annotate(month=TruncMonth('date'))
+        .values('category_id', 'month')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for row in recent:
+        monthly = row_for(row['category_id'])['monthly']
+        if row['month'] in monthly:
+            monthly[row['month']] += row['total'] or 0
+
+    ordered = sorted(rows.values(), key=lambda row: (row['category_id'] is None, order.get(row['category_id'], 0)))
+    for row in ordered:
+        row['monthly'] = [row['monthly'][month] for month in month_list]
+    return {'months': month_list, 'rows': ordered}
+
+
+def archived_expenses_for(vehicles=None, vehicle_ids=None):
+    archived = ArchivedExpense.objects.all()
+    if vehicles is not None:
+        archived = archived.filter(vehicle__in=vehicles)
+    if vehicle_ids is not None:
+        archived = archived.filter(vehicle_id__in=vehicle_ids)
+    return archived
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Cached partner, EMI and category data is invalidated in one process, so the cache must be shared."""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PER_PROCESS_CACHES:
+        return [Error(
+            "The default cache is local to each process, so changes made in one worker leave stale data in the others.",
+            hint="Set CACHES['default'] to a shared backend such as FileBasedCache, Redis or Memcached.",
+            id='rentals.E001',
+        )]
+    return []
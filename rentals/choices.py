@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .models import Vehicle
+
+
+PARTNERS_CACHE_KEY = 'partner_choices'
+PARTNERS_CACHE_TIMEOUT = 60 * 60
+
+Partner = namedtuple('Partner', ['pk', 'username'])
+
+
+def active_partners():
+    """Every active user as (pk, username), ordered by username, cached until a user changes."""
+    partners = cache.get(PARTNERS_CACHE_KEY)
+    if partners is None:
+        partners = [
+            Partner(*row)
+            for row in User.objects.filter(is_active=True).order_by('username').values_list('pk', 'username')
+        ]
+        cache.set(PARTNERS_CACHE_KEY, partners, PARTNERS_CACHE_TIMEOUT)
+    return partners
+
+
+def invalidate_partners():
+    cache.delete(PARTNERS_CACHE_KEY)
+
+
+def vehicle_partners(vehicle):
+    """The vehicle's active partners, in the same order as ``active_partners``."""
+    partner_ids = set(
+        Vehicle.partners.through.objects.filter(vehicle_id=getattr(vehicle, 'pk', vehicle)).values_list('user_id', flat=True)
+    )
+    return [partner for partner in active_partners() if partner.pk in partner_ids]
+
+
+def partner_choices(vehicle=None, current=None):
+    """
+    Partners to offer for a record on ``vehicle``: its own partners, or every
+    active user when it has none. ``current`` (a user id) stays in the list
+    so editing a record never silently drops who it was assigned to.
+    """
+    partners = vehicle_partners(vehicle) if vehicle is not None else []
+    if not partners:
+        partners = active_partners()
+    if current is not None and all(partner.pk != current for partner in partners):
+        extra = [partner for partner in active_partners() if partner.pk == current]
+        if not extra:
+            # Deactivated since the record was saved
+            extra = [Partner(*row) for row in User.objects.filter(pk=current).values_list('pk', 'username')]
+        partners = partners + extra
+    return partners
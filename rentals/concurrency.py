@@ -0,0 +1,38 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def run_queries(queries):
+    """Run a dict of independent query callables one after another."""
+    return {name: query() for name, query in queries.items()}
+
+
+def _in_worker_thread(query):
+    def run():
+        try:
+            return query()
+        finally:
+            # Worker threads are not covered by the request_finished
+            # cleanup, so release their connection here
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def gather_queries(queries, writes=()):
+    """
+    Run a dict of independent query callables concurrently.
+
+    Each query runs on its own worker thread, and so on its own database
+    connection, letting the database work on them in parallel. Queries
+    named in ``writes`` may store what they compute, so they run on the
+    request's own thread instead: worker threads only ever read, and SQLite
+    never has two connections of one request writing at once.
+    """
+    names = list(queries)
+    results = await asyncio.gather(*(
+        (sync_to_async(queries[name]) if name in writes else _in_worker_thread(queries[name]))()
+        for name in names
+    ))
+    return dict(zip(names, results))
@@ -0,0 +1,235 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import (
+    TOTAL_RENT, ArchivedExpense, ArchivedRental, EMIPayment, MonthlySummary, Rental, TakenAmount, UserProfile, Vehicle,
+)
+
+
+# days_of_rent may count the return day too, so allow one day over the span
+DAYS_TOLERANCE = 1
+AMOUNT_TOLERANCE = 0.01
+
+RENTAL_MODELS = {'rental': Rental, 'archived_rental': ArchivedRental}
+MONEY_FIELDS = ('days_of_rent', 'rent_per_day', 'advance_amount', 'total_amount_received', 'discounted_amount')
+
+
+def _issue(check, record, row, message, **values):
+    return dict(check=check, record=record, id=row['id'], vehicle_id=row['vehicle_id'], message=message, **values)
+
+
+def check_rental_amounts(vehicle_ids):
+    """Rentals with negative figures, or more received and discounted than the rent."""
+    negative = Q()
+    for field in MONEY_FIELDS:
+        negative |= Q(**{f'{field}__lt': 0})
+    for record, model in RENTAL_MODELS.items():
+        rows = (
+            model.objects.filter(vehicle_id__in=vehicle_ids)
+            .annotate(rent_total=TOTAL_RENT, paid=F('total_amount_received') + F('discounted_amount'))
+            .filter(negative | Q(paid__gt=F('rent_total') + AMOUNT_TOLERANCE))
+            .values('id', 'vehicle_id', 'rent_total', 'paid', *MONEY_FIELDS)
+        )
+        for row in rows:
+            bad = [field for field in MONEY_FIELDS if row[field] < 0]
+            if bad:
+                yield _issue('rental_amounts', record, row, f"Negative {', '.join(bad)}", **{field: row[field] for field in bad})
+            else:
+                yield _issue(
+                    'rental_amounts', record, row, "Received plus discount exceeds the rent",
+                    rent_total=row['rent_total'], paid=row['paid'],
+                )
+
+
+def check_odometer(vehicle_ids):
+    """Rentals whose ending km is below their starting km."""
+    for record, model in RENTAL_MODELS.items():
+        rows = (
+            model.objects.filter(vehicle_id__in=vehicle_ids, ending_km__lt=F('starting_km'))
+            .values('id', 'vehicle_id', 'starting_km', 'ending_km')
+        )
+        for row in rows:
+            yield _issue(
+                'odometer', record, row, "Ending km is below starting km",
+                starting_km=row['starting_km'], ending_km=row['ending_km'],
+            )
+
+
+def check_rental_days(vehicle_ids):
+    """Returned rentals whose days_of_rent doesn't match date_out to date_in."""
+    for record, model in RENTAL_MODELS.items():
+        rows = (
+            model.objects.filter(vehicle_id__in=vehicle_ids, date_in__isnull=False)
+            .values_list('id', 'vehicle_id', 'date_out', 'date_in', 'days_of_rent')
+            .iterator(chunk_size=5000)
+        )
+        for pk, vehicle_id, date_out, date_in, days in rows:
+            row = {'id': pk, 'vehicle_id': vehicle_id}
+            span = (date_in - date_out).days
+            if span < 0:
+                yield _issue('rental_days', record, row, "Returned before it went out", date_out=date_out, date_in=date_in)
+            elif not span <= days <= span + DAYS_TOLERANCE:
+                yield _issue(
+                    'rental_days', record, row, f"days_of_rent is {days} for a {span}-day span",
+                    date_out=date_out, date_in=date_in, days_of_rent=days,
+                )
+
+
+def check_emi_payments(vehicle_ids):
+    """More than one EMI payment for the same vehicle and month."""
+    rows = (
+        EMIPayment.objects.filter(vehicle_id__in=vehicle_ids)
+        .annotate(month=TruncMonth('month_paid_for'))
+        .values('vehicle_id', 'month')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for row in rows:
+        ids = list(
+            EMIPayment.objects.filter(vehicle_id=row['vehicle_id'], month_paid_for__year=row['month'].year,
+                                      month_paid_for__month=row['month'].month)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        yield _issue(
+            'emi_payments', 'emi_payment', {'id': ids[0], 'vehicle_id': row['vehicle_id']},
+            f"{row['count']} EMI payments for {row['month']:%B %Y}", month=row['month'], payment_ids=ids,
+        )
+
+
+def check_taken_amounts(vehicle_ids):
+    """Amounts taken from a vehicle by someone who isn't one of its partners."""
+    partner = Vehicle.partners.through.objects.filter(vehicle_id=OuterRef('vehicle_id'), user_id=OuterRef('user_id'))
+    rows = (
+        TakenAmount.objects.filter(vehicle_id__in=vehicle_ids)
+        .filter(~Exists(partner))
+        .values('id', 'vehicle_id', 'user_id', 'amount', 'date')
+    )
+    for row in rows:
+        yield _issue(
+            'taken_amounts', 'taken_amount', row, "Taken by a user who is not a partner of the vehicle",
+            user_id=row['user_id'], amount=row['amount'], date=row['date'],
+        )
+
+
+def check_summaries(vehicle_ids):
+    """Monthly summaries that no longer match the archived rows they were built from."""
+    expected = {}
+    rentals = (
+        ArchivedRental.objects.filter(vehicle_id__in=vehicle_ids)
+        .annotate(month=TruncMonth('date_out')).values('vehicle_id', 'month')
+        .annotate(rental_count=Count('id'), income=Sum('total_amount_received'), rent_total=Sum(TOTAL_RENT))
+        .order_by()
+    )
+    for row in rentals:
+        expected.setdefault((row['vehicle_id'], row['month']), {}).update(
+            rental_count=row['rental_count'], income=row['income'] or 0, rent_total=row['rent_total'] or 0,
+        )
+    expenses = (
+        ArchivedExpense.objects.filter(vehicle_id__in=vehicle_ids)
+        .annotate(month=TruncMonth('date')).values('vehicle_id', 'month')
+        .annotate(expense_count=Count('id'), expense=Sum('amount'))
+        .order_by()
+    )
+    for row in expenses:
+        expected.setdefault((row['vehicle_id'], row['month']), {}).update(
+            expense_count=row['expense_count'], expense=row['expense'] or 0,
+        )
+
+    fields = ('rental_count', 'income', 'rent_total', 'expense_count', 'expense')
+    for summary in MonthlySummary.objects.filter(vehicle_id__in=vehicle_ids).values('id', 'vehicle_id', 'month', *fields):
+        totals = expected.pop((summary['vehicle_id'], summary['month']), {})
+        wrong = {
+            field: {'stored': summary[field], 'archived': totals.get(field, 0)}
+            for field in fields if abs(summary[field] - totals.get(field, 0)) > AMOUNT_TOLERANCE
+        }
+        if wrong:
+            yield _issue(
+                'summaries', 'monthly_summary', summary, f"Summary for {summary['month']:%B %Y} differs from the archive",
+                month=summary['month'], fields=wrong,
+            )
+    for (vehicle_id, month), totals in expected.items():
+        yield _issue(
+            'summaries', 'monthly_summary', {'id': None, 'vehicle_id': vehicle_id},
+            f"Archived rows for {month:%B %Y} have no summary", month=month,
+        )
+
+
+def check_profile_taken(user_ids=None):
+    """Profiles whose stored taken_amount disagrees with their TakenAmount rows; zero means unused."""
+    taken = TakenAmount.objects.filter(user_id=OuterRef('user_id')).values('user_id').annotate(total=Sum('amount')).values('total')
+    profiles = UserProfile.objects.exclude(taken_amount=0).annotate(recorded=taken)
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+    for row in profiles.values('id', 'user_id', 'taken_amount', 'recorded'):
+        recorded = row['recorded'] or 0
+        if abs(row['taken_amount'] - recorded) > AMOUNT_TOLERANCE:
+            yield dict(
+                check='profile_taken', record='user_profile', id=row['id'], vehicle_id=None,
+                message="Profile taken_amount differs from the recorded taken amounts",
+                user_id=row['user_id'], stored=row['taken_amount'], recorded=recorded,
+            )
+
+
+VEHICLE_CHECKS = {
+    'rental_amounts': check_rental_amounts,
+    'odometer': check_odometer,
+    'rental_days': check_rental_days,
+    'emi_payments': check_emi_payments,
+    'taken_amounts': check_taken_amounts,
+    'summaries': check_summaries,
+}
+CHECKS = list(VEHICLE_CHECKS) + ['profile_taken']
+
+
+def check_vehicles(vehicle_ids, checks=None):
+    """Run the per-vehicle checks over one batch of vehicles; the unit of work a worker process gets."""
+    issues = []
+    for name, check in VEHICLE_CHECKS.items():
+        if checks is None or name in checks:
+            issues.extend(check(vehicle_ids))
+    return issues
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        # Spawned rather than forked workers start without Django
+        django.setup()
+
+
+def _batches(items, count):
+    size = max(1, -(-len(items) // count))
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def check_ledgers(vehicle_ids=None, checks=None, workers=1, batches_per_worker=4):
+    """
+    Every invariant violation found, as a list of dicts.
+
+    Vehicles are split into batches and checked in a pool of ``workers``
+    processes, each running a few grouped queries per batch; the
+    per-user profile check runs once in this process.
+    """
+    if vehicle_ids is None:
+        vehicle_ids = list(Vehicle.objects.order_by('pk').values_list('pk', flat=True))
+    batches = _batches(list(vehicle_ids), max(1, workers) * batches_per_worker)
+
+    issues = []
+    if workers > 1 and len(batches) > 1:
+        # Children must open their own connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for batch_issues in pool.map(check_vehicles, batches, [checks] * len(batches)):
+                issues.extend(batch_issues)
+    else:
+        for batch in batches:
+            issues.extend(check_vehicles(batch, checks))
+
+    if checks is None or 'profile_taken' in checks:
+        issues.extend(check_profile_taken())
+    return issues
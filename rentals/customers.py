@@ -0,0 +1,77 @@
+from django.db.models import Count, Max, Sum
+
+from .models import BALANCE, ArchivedRental, Rental, Vehicle
+from .search import search_ids
+
+
+DETAIL_FIELDS = ('vehicle_id', 'customer_name', 'contact_no', 'customer_id')
+
+
+def _scoped_rentals(model, vehicle_ids):
+    rentals = model.objects.all()
+    if vehicle_ids is not None:
+        rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+    return rentals
+
+
+def customer_profile(customer_key, vehicle_ids=None):
+    """
+    Trip count, lifetime revenue, outstanding balance and last vehicle of a
+    customer, archived trips included.
+
+    Live and archived rentals are grouped in a single UNION query, as the
+    receivables report does, and the latest details are taken from
+    whichever table holds the newest trip.
+    """
+    rows = [
+        _scoped_rentals(model, vehicle_ids).filter(customer_key=customer_key)
+        .values('customer_key')
+        .annotate(trip_count=Count('id'), lifetime_revenue=Sum('total_amount_received'), outstanding=Sum(BALANCE), last_trip=Max('date_out'))
+        .order_by()
+        for model in (Rental, ArchivedRental)
+    ]
+    rows = list(rows[0].union(rows[1], all=True))
+    if not rows:
+        return None
+
+    profile = {
+        'customer_key': customer_key,
+        'trip_count': sum(row['trip_count'] for row in rows),
+        'lifetime_revenue': sum(row['lifetime_revenue'] or 0 for row in rows),
+        'outstanding': sum(row['outstanding'] or 0 for row in rows),
+        'last_trip': max(row['last_trip'] for row in rows),
+    }
+    latest = max(
+        (
+            rental for rental in (
+                _scoped_rentals(model, vehicle_ids).filter(customer_key=customer_key)
+                .order_by('-date_out', '-id').values('date_out', 'id', *DETAIL_FIELDS).first()
+                for model in (Rental, ArchivedRental)
+            )
+            if rental
+        ),
+        key=lambda rental: (rental['date_out'], rental['id']),
+    )
+    profile.update({field: latest[field] for field in DETAIL_FIELDS})
+    profile['last_vehicle_id'] = profile.pop('vehicle_id')
+    profile['last_vehicle'] = Vehicle.objects.filter(pk=profile['last_vehicle_id']).first()
+    return profile
+
+
+def customer_suggestions(text, vehicle_ids=None, limit=10):
+    """Distinct customers matching ``text``, each with their most recent details."""
+    rental_ids = [pk for kind, pk in search_ids(text, vehicle_ids, limit=limit * 5) if kind == 'rental']
+    rows = (
+        Rental.objects.filter(pk__in=rental_ids)
+        .exclude(customer_key='')
+        .order_by('-date_out', '-id')
+        .values('customer_key', 'customer_name', 'contact_no', 'customer_id', 'care_of')
+    )
+
+    suggestions = {}
+    for row in rows:
+        if row['customer_key'] not in suggestions:
+            suggestions[row['customer_key']] = row
+        if len(suggestions) >= limit:
+            break
+    return list(suggestions.values())
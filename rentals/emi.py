@@ -0,0 +1,122 @@
+import calendar
+from datetime import date
+
+from django.core.cache import cache
+from django.db.models.functions import TruncMonth
+
+from .analytics import month_range
+from .models import EMI, EMIPayment
+
+
+STATUS_CACHE_TIMEOUT = 60 * 60
+
+
+def due_date_for(month, due_day):
+    """Due date of an instalment, clamped to the last day of short months."""
+    last_day = calendar.monthrange(month.year, month.month)[1]
+    return date(month.year, month.month, min(due_day, last_day))
+
+
+def _instalment_status(due_date, paid, warning_days, today):
+    if paid:
+        return 'paid'
+    if due_date < today:
+        return 'overdue'
+    if (due_date - today).days <= warning_days:
+        return 'due'
+    return 'upcoming'
+
+
+def emi_schedule(vehicle_ids=None, today=None, first_month=None):
+    """
+    Expected instalments of every active EMI up to the current month.
+
+    Instalments start from the month the EMI was configured (or
+    ``first_month`` if later) and are matched against EMIPayment by
+    ``month_paid_for``, the same field pay_emi writes, using a single query
+    for all vehicles.
+    """
+    today = today or date.today()
+    current_month = today.replace(day=1)
+
+    emis = EMI.objects.filter(is_active=True).select_related('vehicle')
+    if vehicle_ids is not None:
+        emis = emis.filter(vehicle_id__in=vehicle_ids)
+    emis = list(emis)
+    if not emis:
+        return []
+
+    starts = {}
+    for emi in emis:
+        start = emi.created_at.date().replace(day=1)
+        if first_month and first_month > start:
+            start = first_month
+        starts[emi.vehicle_id] = start
+
+    payments = (
+        EMIPayment.objects.filter(vehicle_id__in=starts.keys(), month_paid_for__gte=min(starts.values()))
+        .annotate(month=TruncMonth('month_paid_for'))
+        .values_list('vehicle_id', 'month', 'date')
+    )
+    paid = {(vehicle_id, month): paid_on for vehicle_id, month, paid_on in payments}
+
+    schedule = []
+    for emi in emis:
+        for month in month_range(starts[emi.vehicle_id], current_month):
+            due_date = due_date_for(month, emi.due_day)
+            paid_on = paid.get((emi.vehicle_id, month))
+            schedule.append({
+                'vehicle': emi.vehicle,
+                'emi': emi,
+                'month': month,
+                'due_date': due_date,
+                'amount': emi.amount,
+                'paid_on': paid_on,
+                'status': _instalment_status(due_date, paid_on is not None, emi.warning_days, today),
+                'days_until': (due_date - today).days,
+                'days_overdue': max((today - due_date).days, 0),
+            })
+    return schedule
+
+
+def _status_cache_key(vehicle_id, today):
+    return f'emi_status:{vehicle_id}:{today.isoformat()}'
+
+
+def vehicle_emi_status(vehicle, today=None):
+    """Current month's EMI status for a vehicle, cached until a payment or the EMI changes."""
+    today = today or date.today()
+    key = _status_cache_key(vehicle.pk, today)
+    status = cache.get(key)
+    if status is not None:
+        return status
+
+    status = {
+        'emi_config': None,
+        'emi_due_date': None,
+        'emi_is_paid': False,
+        'days_until_emi': None,
+        'emi_warning': False,
+    }
+    current = [
+        row for row in emi_schedule([vehicle.pk], today=today, first_month=today.replace(day=1))
+        if row['month'] == today.replace(day=1)
+    ]
+    if current:
+        row = current[0]
+        status.update({
+            'emi_config': row['emi'],
+            'emi_due_date': row['due_date'],
+            'emi_is_paid': row['status'] == 'paid',
+            'days_until_emi': None if row['status'] == 'paid' else row['days_until'],
+            'emi_warning': row['status'] in ('due', 'overdue'),
+        })
+    else:
+        status['emi_config'] = EMI.objects.filter(vehicle=vehicle).first()
+
+    cache.set(key, status, STATUS_CACHE_TIMEOUT)
+    return status
+
+
+def invalidate_emi_status(vehicle_id, today=None):
+    cache.delete(_status_cache_key(vehicle_id, today or date.today()))
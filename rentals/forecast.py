@@ -0,0 +1,135 @@
+from datetime import date
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from .analytics import add_months
+from .models import Expense, MonthlySummary, Rental, RevenueForecast, Vehicle
+
+
+HISTORY_MONTHS = 36
+FORECAST_MONTHS = 6
+# Fewer months than this give a flat baseline instead of a trend
+MIN_TREND_MONTHS = 6
+# A calendar month needs this many past years before it gets a seasonal adjustment
+MIN_SEASON_YEARS = 2
+
+
+def _monthly_matrix(vehicle_ids, months):
+    """(vehicles x months) income and expense arrays from live rows and archived summaries."""
+    position = {vehicle_id: i for i, vehicle_id in enumerate(vehicle_ids)}
+    column = {month: j for j, month in enumerate(months)}
+    income = np.zeros((len(vehicle_ids), len(months)))
+    expense = np.zeros((len(vehicle_ids), len(months)))
+    first, end = months[0], add_months(months[-1], 1)
+
+    sources = [
+        (income, Rental.objects.filter(date_out__gte=first, date_out__lt=end)
+            .annotate(month=TruncMonth('date_out')).values('vehicle_id', 'month')
+            .annotate(total=Sum('total_amount_received')).order_by()),
+        (expense, Expense.objects.filter(date__gte=first, date__lt=end)
+            .annotate(month=TruncMonth('date')).values('vehicle_id', 'month')
+            .annotate(total=Sum('amount')).order_by()),
+    ]
+    for row in MonthlySummary.objects.filter(month__gte=first, month__lt=end).values('vehicle_id', 'month', 'income', 'expense'):
+        if row['vehicle_id'] in position:
+            income[position[row['vehicle_id']], column[row['month']]] += float(row['income'])
+            expense[position[row['vehicle_id']], column[row['month']]] += float(row['expense'])
+    for target, rows in sources:
+        for row in rows:
+            if row['vehicle_id'] in position:
+                target[position[row['vehicle_id']], column[row['month']]] += float(row['total'] or 0)
+    return income, expense
+
+
+def forecast_matrix(values, active, calendar, steps, skip=0):
+    """
+    Forecast every row of ``values`` (series x months) for ``steps``
+    months, starting ``skip`` months after the month following its last
+    column.
+
+    Each row gets a least-squares linear trend over its active months plus
+    the mean residual of each calendar month, all computed on whole arrays
+    at once.
+    """
+    t = np.arange(values.shape[1], dtype=float)
+    weights = active.astype(float)
+    n = weights.sum(axis=1)
+    safe_n = np.maximum(n, 1)
+
+    t_mean = (weights * t).sum(axis=1) / safe_n
+    y_mean = (weights * values).sum(axis=1) / safe_n
+    dt = (t[None, :] - t_mean[:, None]) * weights
+    spread = (dt * dt).sum(axis=1)
+    slope = np.divide((dt * (values - y_mean[:, None])).sum(axis=1), spread, out=np.zeros_like(spread), where=spread > 0)
+    slope = np.where(n >= MIN_TREND_MONTHS, slope, 0)
+    intercept = y_mean - slope * t_mean
+
+    residuals = (values - (intercept[:, None] + slope[:, None] * t[None, :])) * weights
+    one_hot = np.eye(12)[calendar]
+    season_count = weights @ one_hot
+    season = np.divide(residuals @ one_hot, season_count, out=np.zeros_like(season_count), where=season_count >= MIN_SEASON_YEARS)
+
+    future_t = values.shape[1] + skip + np.arange(steps, dtype=float)
+    future_calendar = (calendar[-1] + 1 + skip + np.arange(steps)) % 12
+    forecast = intercept[:, None] + slope[:, None] * future_t[None, :] + season[:, future_calendar]
+    return np.clip(forecast, 0, None)
+
+
+def compute_forecasts(vehicle_ids, today=None, horizon=FORECAST_MONTHS, history=HISTORY_MONTHS):
+    """
+    Income and expense forecasts per vehicle for the ``horizon`` months
+    after the current one, fitted on the ``history`` closed months before it.
+    Returns ({vehicle_id: (income array, expense array)}, forecast months).
+    """
+    this_month = (today or date.today()).replace(day=1)
+    months = [add_months(this_month, offset) for offset in range(-history, 0)]
+    future = [add_months(this_month, offset) for offset in range(1, horizon + 1)]
+    vehicle_ids = list(vehicle_ids)
+    if not vehicle_ids:
+        return {}, future
+
+    income, expense = _monthly_matrix(vehicle_ids, months)
+    # A vehicle's series starts at its first month with any activity
+    seen = (income != 0) | (expense != 0)
+    active = np.logical_or.accumulate(seen, axis=1)
+    calendar = np.array([month.month - 1 for month in months])
+
+    # History stops before the running month, which the forecast skips too
+    income_forecast = forecast_matrix(income, active, calendar, horizon, skip=1)
+    expense_forecast = forecast_matrix(expense, active, calendar, horizon, skip=1)
+    has_history = active.any(axis=1)
+    return {
+        vehicle_id: (income_forecast[i], expense_forecast[i])
+        for i, vehicle_id in enumerate(vehicle_ids) if has_history[i]
+    }, future
+
+
+def refresh_forecasts(today=None, horizon=FORECAST_MONTHS, history=HISTORY_MONTHS):
+    """Recompute and store forecasts for every vehicle; returns how many vehicles got one."""
+    forecasts, future = compute_forecasts(Vehicle.objects.values_list('pk', flat=True), today, horizon, history)
+    rows = [
+        RevenueForecast(vehicle_id=vehicle_id, month=month, income=round(income[j], 2), expense=round(expense[j], 2))
+        for vehicle_id, (income, expense) in forecasts.items()
+        for j, month in enumerate(future)
+    ]
+    with transaction.atomic():
+        RevenueForecast.objects.all().delete()
+        RevenueForecast.objects.bulk_create(rows, batch_size=500)
+    return len(forecasts)
+
+
+def forecast_series(vehicles=None, vehicle_ids=None, today=None):
+    """Stored forecasts for upcoming months, summed over the given vehicles, oldest first."""
+    this_month = (today or date.today()).replace(day=1)
+    forecasts = RevenueForecast.objects.filter(month__gt=this_month)
+    if vehicles is not None:
+        forecasts = forecasts.filter(vehicle__in=vehicles)
+    if vehicle_ids is not None:
+        forecasts = forecasts.filter(vehicle_id__in=vehicle_ids)
+    return [
+        {'month': row['month'], 'income': float(row['income'] or 0), 'expense': float(row['expense'] or 0)}
+        for row in forecasts.values('month').annotate(income=Sum('income'), expense=Sum('expense')).order_by('month')
+    ]
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
+from .choices import partner_choices
 from .models import Vehicle, Rental, Expense, UserProfile
 
 class VehicleForm(forms.ModelForm):
@@ -8,7 +9,25 @@ class VehicleForm(forms.ModelForm):
         model = Vehicle
         fields = ['name', 'registration_number', 'color', 'image', 'price_per_day']
 
-class RentalForm(forms.ModelForm):
+class PartnerChoicesMixin:
+    """
+    Offers the record's vehicle partners in the ``user`` dropdown from the
+    cached partner list instead of rendering every active user; pass
+    ``vehicle`` when creating, edits use the instance's vehicle.
+    """
+
+    def __init__(self, *args, vehicle=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if vehicle is None and self.instance.vehicle_id:
+            vehicle = self.instance.vehicle_id
+        partners = partner_choices(vehicle, current=self.instance.user_id)
+        field = self.fields['user']
+        # Validation still looks the chosen user up, but only among these
+        field.queryset = User.objects.filter(pk__in=[partner.pk for partner in partners])
+        field.choices = [('', field.empty_label)] + [(partner.pk, partner.username) for partner in partners]
+
+
+class RentalForm(PartnerChoicesMixin, forms.ModelForm):
     user = forms.ModelChoiceField(
         queryset=User.objects.filter(is_active=True).order_by('username'),
         required=False,
@@ -31,7 +50,7 @@ class RentalForm(forms.ModelForm):
             'time_in': forms.TimeInput(attrs={'type': 'time'}),
         }
 
-class ExpenseForm(forms.ModelForm):
+class ExpenseForm(PartnerChoicesMixin, forms.ModelForm):
     user = forms.ModelChoiceField(
         queryset=User.objects.filter(is_active=True).order_by('username'),
         required=False,
@@ -0,0 +1,226 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, models, transaction
+
+from .bulk import refresh_derived
+from .categories import ExpenseClassifier
+from .models import Expense, Rental, Vehicle, normalize_customer_key
+from .sheets import BATCH_SIZE, HeaderNotFound, open_workbook, parse_batches, parse_sheet
+
+
+# Filled in by import code, not validated against each row
+UNCHECKED_FIELDS = ('vehicle', 'user', 'category')
+
+
+def registration_key(text):
+    """Registration numbers compared without case, spaces or dashes."""
+    return re.sub(r'[^0-9A-Z]', '', str(text or '').upper())
+
+
+def sheet_names(source):
+    workbook = open_workbook(source)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def match_sheets(names, vehicles=None):
+    """{sheet name: Vehicle or None}, matching sheet titles to registration numbers."""
+    if vehicles is None:
+        vehicles = Vehicle.objects.all()
+    by_registration = {registration_key(vehicle.registration_number): vehicle for vehicle in vehicles}
+    return {name: by_registration.get(registration_key(name)) for name in names}
+
+
+def _shareable(source):
+    """Something worker processes can open: the upload's temporary file if it has one, else its bytes."""
+    if hasattr(source, 'temporary_file_path'):
+        return source.temporary_file_path()
+    if hasattr(source, 'read'):
+        source.seek(0)
+        return source.read()
+    return source
+
+
+_workbook_source = None
+
+
+def _init_worker(source):
+    # Each worker gets the workbook once rather than with every sheet it parses
+    global _workbook_source
+    _workbook_source = source
+
+
+def _parse_named_sheet(name):
+    return parse_sheet(_workbook_source, name)
+
+
+def parse_workbook(source, names, workers):
+    """
+    parse_sheet for each named sheet in a pool of ``workers`` processes,
+    yielded in ``names`` order as they are needed.
+    """
+    source = _shareable(source)
+    with ProcessPoolExecutor(max_workers=min(workers, len(names)), initializer=_init_worker, initargs=(source,)) as pool:
+        yield from pool.map(_parse_named_sheet, names)
+
+
+def _round_amounts(obj):
+    """Round float amounts to their field's decimal places, as saving them would, so validation judges the stored value."""
+    for field in obj._meta.concrete_fields:
+        value = getattr(obj, field.attname)
+        if isinstance(field, models.DecimalField) and isinstance(value, float):
+            try:
+                setattr(obj, field.attname, Decimal(repr(value)).quantize(Decimal(1).scaleb(-field.decimal_places)))
+            except InvalidOperation:
+                # Too large to round; validation reports it
+                pass
+
+
+class RowWriter:
+    """
+    Validates and bulk-inserts parsed rentals and expenses for one vehicle,
+    a batch at a time.
+
+    bulk_create skips the per-row save() and signals, so customer keys and
+    categories are filled in here, and utilization, mileage and statements
+    are refreshed once from the earliest written date when the writer is
+    closed. Rows that fail validation, or that the database rejects, are
+    reported by row number and skipped.
+    """
+
+    def __init__(self, vehicle, classify_expense=None):
+        self.vehicle = vehicle
+        self.classify_expense = classify_expense or ExpenseClassifier()
+        self.rentals = 0
+        self.expenses = 0
+        self.errors = []
+        self._since = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _valid(self, label, numbered):
+        valid = []
+        for number, obj in numbered:
+            _round_amounts(obj)
+            try:
+                obj.full_clean(exclude=UNCHECKED_FIELDS, validate_unique=False, validate_constraints=False)
+            except ValidationError as e:
+                details = '; '.join(f"{field}: {' '.join(messages)}" for field, messages in e.message_dict.items())
+                self.errors.append(f"{label} Row {number}: {details}")
+            else:
+                valid.append((number, obj))
+        return valid
+
+    def _insert(self, model, label, numbered):
+        """Insert the rows in one statement, or one by one if the database refuses the batch."""
+        if not numbered:
+            return []
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([obj for _, obj in numbered], batch_size=500)
+            return [obj for _, obj in numbered]
+        except DatabaseError:
+            pass
+        written = []
+        for number, obj in numbered:
+            obj.pk = None
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([obj])
+            except DatabaseError as e:
+                self.errors.append(f"{label} Row {number}: {e}")
+            else:
+                written.append(obj)
+        return written
+
+    def _track(self, kind, dates):
+        if dates:
+            earliest = min(dates)
+            self._since[kind] = min(self._since.get(kind, earliest), earliest)
+
+    def write(self, parsed):
+        """Write one parse_rows result; its row errors are kept alongside the writer's own."""
+        self.errors.extend(parsed['errors'])
+
+        rentals = []
+        for number, fields in parsed['rentals']:
+            rental = Rental(vehicle=self.vehicle, **fields)
+            rental.customer_key = normalize_customer_key(rental.contact_no, rental.customer_id, rental.customer_name)
+            rentals.append((number, rental))
+        written = self._insert(Rental, 'Rental', self._valid('Rental', rentals))
+        self.rentals += len(written)
+        self._track('rental', [rental.date_out for rental in written])
+
+        expenses = [
+            (number, Expense(vehicle=self.vehicle, category_id=self.classify_expense(fields['particulars']), **fields))
+            for number, fields in parsed['expenses']
+        ]
+        written = self._insert(Expense, 'Expense', self._valid('Expense', expenses))
+        self.expenses += len(written)
+        self._track('expense', [expense.date for expense in written])
+
+    def close(self):
+        for kind, since in self._since.items():
+            refresh_derived(kind, [self.vehicle.pk], since)
+        self._since = {}
+
+
+def import_sheet(source, vehicle, sheet_name=0, classify_expense=None, batch_size=BATCH_SIZE):
+    """
+    Stream one sheet into ``vehicle`` batch by batch, so memory stays
+    bounded by ``batch_size``. Returns the finished RowWriter.
+    """
+    with RowWriter(vehicle, classify_expense) as writer:
+        for parsed in parse_batches(source, sheet_name, batch_size):
+            writer.write(parsed)
+    return writer
+
+
+def import_workbook(source, vehicles=None, workers=1):
+    """
+    Import every sheet of a workbook into the vehicle whose registration
+    number is its title. Returns one summary dict per sheet.
+
+    With several workers the sheets are parsed in parallel and each is
+    written as soon as it arrives; otherwise every sheet is streamed a
+    batch at a time. Only the import_workbook command asks for workers;
+    uploads are imported in the request's own process.
+    """
+    matches = match_sheets(sheet_names(source), vehicles)
+    matched = [name for name, vehicle in matches.items() if vehicle is not None]
+    classify_expense = ExpenseClassifier()
+
+    summary = {
+        name: {'sheet': name, 'vehicle': vehicle, 'rentals': 0, 'expenses': 0,
+               'errors': [] if vehicle else ["No vehicle with this registration number"]}
+        for name, vehicle in matches.items()
+    }
+
+    def record(name, writer):
+        summary[name].update(rentals=writer.rentals, expenses=writer.expenses, errors=writer.errors)
+
+    if workers > 1 and len(matched) > 1:
+        for name, result in zip(matched, parse_workbook(source, matched, workers)):
+            if not result['header_found']:
+                summary[name]['errors'] = result['errors']
+                continue
+            with RowWriter(matches[name], classify_expense) as writer:
+                writer.write(result)
+            record(name, writer)
+    else:
+        for name in matched:
+            try:
+                record(name, import_sheet(source, matches[name], name, classify_expense))
+            except HeaderNotFound as e:
+                summary[name]['errors'] = [str(e)]
+
+    return list(summary.values())
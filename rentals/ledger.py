@@ -0,0 +1,120 @@
+from datetime import date
+
+from django.db import connection
+
+from .models import Expense, MonthlySummary, Rental, TakenAmount, Vehicle
+
+
+LEDGER_COLUMNS = (
+    'user_id', 'username', 'vehicle_id', 'vehicle_name', 'month', 'num_partners',
+    'income', 'expense', 'profit', 'taken', 'vehicle_balance', 'balance',
+)
+
+
+def _month(column):
+    if connection.vendor == 'sqlite':
+        return f"strftime('%%Y-%%m-01', {column})"
+    return f"CAST(date_trunc('month', {column}) AS date)"
+
+
+def _ledger_sql(for_user):
+    quote = connection.ops.quote_name
+    partners = quote(Vehicle.partners.through._meta.db_table)
+    rentals = quote(Rental._meta.db_table)
+    expenses = quote(Expense._meta.db_table)
+    taken = quote(TakenAmount._meta.db_table)
+    summaries = quote(MonthlySummary._meta.db_table)
+    vehicles = quote(Vehicle._meta.db_table)
+    users = quote('auth_user')
+
+    return f"""
+        WITH partners AS (
+            SELECT vehicle_id, user_id, COUNT(*) OVER (PARTITION BY vehicle_id) AS num_partners
+            FROM {partners}
+        ),
+        income AS (
+            SELECT vehicle_id, month, SUM(amount) AS amount FROM (
+                SELECT vehicle_id, {_month('date_out')} AS month, total_amount_received AS amount FROM {rentals}
+                UNION ALL
+                SELECT vehicle_id, month, income FROM {summaries}
+            ) AS entries GROUP BY vehicle_id, month
+        ),
+        expense AS (
+            SELECT vehicle_id, month, SUM(amount) AS amount FROM (
+                SELECT vehicle_id, {_month('date')} AS month, amount FROM {expenses}
+                UNION ALL
+                SELECT vehicle_id, month, expense FROM {summaries}
+            ) AS entries GROUP BY vehicle_id, month
+        ),
+        taken AS (
+            SELECT user_id, vehicle_id, {_month('date')} AS month, SUM(amount) AS amount
+            FROM {taken} GROUP BY user_id, vehicle_id, month
+        ),
+        cells AS (
+            SELECT p.user_id, p.vehicle_id, m.month FROM partners p
+            JOIN (SELECT vehicle_id, month FROM income UNION SELECT vehicle_id, month FROM expense) m
+                ON m.vehicle_id = p.vehicle_id
+            UNION
+            SELECT t.user_id, t.vehicle_id, t.month FROM taken t
+            JOIN partners p ON p.vehicle_id = t.vehicle_id AND p.user_id = t.user_id
+        ),
+        shares AS (
+            SELECT
+                c.user_id, c.vehicle_id, c.month, p.num_partners,
+                COALESCE(i.amount, 0) * 1.0 / p.num_partners AS income,
+                COALESCE(e.amount, 0) * 1.0 / p.num_partners AS expense,
+                COALESCE(t.amount, 0) * 1.0 AS taken
+            FROM cells c
+            JOIN partners p ON p.vehicle_id = c.vehicle_id AND p.user_id = c.user_id
+            LEFT JOIN income i ON i.vehicle_id = c.vehicle_id AND i.month = c.month
+            LEFT JOIN expense e ON e.vehicle_id = c.vehicle_id AND e.month = c.month
+            LEFT JOIN taken t ON t.user_id = c.user_id AND t.vehicle_id = c.vehicle_id AND t.month = c.month
+        ),
+        ledger AS (
+            SELECT
+                s.*,
+                s.income - s.expense AS profit,
+                SUM(s.income - s.expense - s.taken) OVER (
+                    PARTITION BY s.user_id, s.vehicle_id ORDER BY s.month ROWS UNBOUNDED PRECEDING
+                ) AS vehicle_balance,
+                SUM(s.income - s.expense - s.taken) OVER (
+                    PARTITION BY s.user_id ORDER BY s.month RANGE UNBOUNDED PRECEDING
+                ) AS balance
+            FROM shares s
+        )
+        SELECT
+            l.user_id, u.username, l.vehicle_id, v.name, l.month, l.num_partners,
+            l.income, l.expense, l.profit, l.taken, l.vehicle_balance, l.balance
+        FROM ledger l
+        JOIN {users} u ON u.id = l.user_id
+        JOIN {vehicles} v ON v.id = l.vehicle_id
+        WHERE {'l.user_id = %s' if for_user else '1 = 1'} AND l.month >= %s AND l.month < %s
+        ORDER BY u.username, l.user_id, l.month, v.name
+    """
+
+
+def partner_ledger(start=None, end=None, user_id=None, chunk_size=2000):
+    """
+    Each partner's share of every vehicle for every month in [start, end),
+    with taken amounts and running balances per vehicle and across the
+    fleet, yielded as dicts.
+
+    Everything is computed by one SQL statement: monthly income and
+    expense per vehicle (archived months included) are split by the
+    vehicle's partner count and the balances accumulated with window
+    functions, so the totals match the user detail page.
+    Balances always run from the first month on record; ``start`` and
+    ``end`` only limit the rows returned.
+    """
+    params = [user_id] if user_id is not None else []
+    params += [start or date.min, end or date.max]
+    with connection.cursor() as cursor:
+        cursor.execute(_ledger_sql(user_id is not None), params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                entry = dict(zip(LEDGER_COLUMNS, row))
+                entry['month'] = date.fromisoformat(str(entry['month'])[:10])
+                yield entry
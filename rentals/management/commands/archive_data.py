@@ -0,0 +1,73 @@
+import statistics
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from rentals.archive import archive_before, archive_cutoff, restore_archive
+from rentals.concurrency import run_queries
+from rentals.models import Vehicle
+from rentals.views import dashboard_queries, vehicle_detail_queries
+
+
+class Command(BaseCommand):
+    help = "Move rentals and expenses of long-closed years into the archive tables, or restore them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, help="Keep this many closed years live (default RENTALS_ARCHIVE_AFTER_YEARS)")
+        parser.add_argument('--restore', action='store_true', help="Move archived rows back into the live tables")
+        parser.add_argument('--since', help="With --restore, only restore rows dated on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--vehicle', type=int, action='append', help="Limit to this vehicle id (repeatable)")
+
+    def _hot_pages(self):
+        vehicles = Vehicle.objects.all()
+        busiest = vehicles.annotate(n=Count('rentals')).order_by('-n').first()
+        pages = [('dashboard', lambda: dashboard_queries(vehicles))]
+        if busiest:
+            pages.append((f'vehicle_detail ({busiest.name})', lambda: vehicle_detail_queries(busiest)))
+        return pages
+
+    def _time_pages(self, pages):
+        timings = {}
+        for name, queries in pages:
+            samples = []
+            for _ in range(3):
+                start = time.perf_counter()
+                run_queries(queries())
+                samples.append((time.perf_counter() - start) * 1000)
+            timings[name] = statistics.median(samples)
+        return timings
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError("--since must be in YYYY-MM-DD format.")
+
+        pages = self._hot_pages()
+        before = self._time_pages(pages)
+
+        start = time.perf_counter()
+        if options['restore']:
+            result = restore_archive(since=since, vehicle_ids=options['vehicle'])
+            action = "Restored"
+        else:
+            cutoff = archive_cutoff(options['years'])
+            self.stdout.write(f"Archiving rows dated before {cutoff}.")
+            result = archive_before(cutoff, vehicle_ids=options['vehicle'])
+            action = "Archived"
+        elapsed = time.perf_counter() - start
+
+        after = self._time_pages(pages)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {result['rentals']} rentals and {result['expenses']} expenses in {elapsed:.2f}s "
+            f"({result['summaries']} monthly summaries)."
+        ))
+        if result.get('kept_open'):
+            self.stdout.write(f"Kept {result['kept_open']} unreturned or unpaid rentals live.")
+        for name in before:
+            self.stdout.write(f"{name}: {before[name]:.1f} ms before, {after[name]:.1f} ms after")
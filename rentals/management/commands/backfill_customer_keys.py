@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from rentals.models import Rental, normalize_customer_key
+
+
+class Command(BaseCommand):
+    help = "Fill in Rental.customer_key for rentals saved before customer keys existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+
+        while True:
+            batch = list(
+                Rental.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'contact_no', 'customer_id', 'customer_name', 'customer_key')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            changed = []
+            for rental in batch:
+                key = normalize_customer_key(rental.contact_no, rental.customer_id, rental.customer_name)
+                if key != rental.customer_key:
+                    rental.customer_key = key
+                    changed.append(rental)
+            Rental.objects.bulk_update(changed, ['customer_key'])
+            updated += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"Updated customer keys for {updated} rentals."))
@@ -0,0 +1,76 @@
+import statistics
+import time
+from importlib import import_module
+from urllib.error import URLError
+from urllib.parse import urljoin
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from rentals.access import AccessContext
+
+
+def session_cookie(user):
+    """A session cookie logging ``user`` in on any server sharing these settings."""
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the dashboard, vehicle and user pages as served by a running server. Run it against the "
+        "server with and without RENTALS_ASYNC_VIEWS=1 (under uvicorn vehicle_manager.asgi:application) to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', required=True, help="Base URL of the running server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--user', required=True, help="Username whose view of the data is measured")
+        parser.add_argument('--vehicle', type=int, help="Vehicle id for the vehicle detail page")
+        parser.add_argument('--year', type=int, help="Year for the user detail page")
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist.")
+
+        vehicles = AccessContext(user).vehicles()
+        vehicle = vehicles.filter(pk=options['vehicle']).first() if options['vehicle'] else vehicles.first()
+        year = options['year'] or time.localtime().tm_year
+
+        pages = [('dashboard', reverse('dashboard'))]
+        if vehicle:
+            pages.append((f'vehicle_detail ({vehicle.name})', reverse('vehicle_detail', args=[vehicle.pk])))
+        pages.append((f'user_detail ({year})', f"{reverse('user_detail', args=[user.pk])}?year={year}"))
+
+        cookie = session_cookie(user)
+
+        def fetch(path):
+            url = urljoin(options['url'], path)
+            try:
+                with urlopen(Request(url, headers={'Cookie': cookie})) as response:
+                    response.read()
+                    landed = response.geturl()
+            except URLError as e:
+                raise CommandError(f"Could not fetch {url}: {e}")
+            if landed != url:
+                raise CommandError(f"{url} redirected to {landed}; does the server use the same SECRET_KEY and database?")
+
+        for name, path in pages:
+            # Warm up caches and connections before timing
+            fetch(path)
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                fetch(path)
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(f"{name}: median {statistics.median(timings):.1f} ms, max {max(timings):.1f} ms")
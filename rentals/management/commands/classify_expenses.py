@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from rentals.categories import backfill_categories, create_default_categories
+
+
+class Command(BaseCommand):
+    help = "Assign expense categories from the category rules, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--reclassify', action='store_true', help="Re-run the rules on expenses that already have a category")
+        parser.add_argument('--with-defaults', action='store_true', help="Create the default categories and keyword rules first")
+
+    def handle(self, *args, **options):
+        if options['with_defaults']:
+            created = create_default_categories()
+            self.stdout.write(f"Added {created} default category rules.")
+
+        examined, changed = backfill_categories(batch_size=options['batch_size'], reclassify=options['reclassify'])
+        self.stdout.write(self.style.SUCCESS(f"Classified {changed} of {examined} expenses."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rentals.forecast import FORECAST_MONTHS, HISTORY_MONTHS, refresh_forecasts
+
+
+class Command(BaseCommand):
+    help = "Forecast income and expense for every vehicle and store them for the charts; run nightly"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=FORECAST_MONTHS, help="How many months ahead to forecast")
+        parser.add_argument('--history', type=int, default=HISTORY_MONTHS, help="How many past months to fit on")
+
+    def handle(self, *args, **options):
+        if not 1 <= options['months'] <= 12:
+            raise CommandError("--months must be between 1 and 12.")
+        if options['history'] < 1:
+            raise CommandError("--history must be at least 1.")
+        count = refresh_forecasts(horizon=options['months'], history=options['history'])
+        self.stdout.write(self.style.SUCCESS(f"Forecast {options['months']} months for {count} vehicles."))
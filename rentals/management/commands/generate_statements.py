@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from rentals.analytics import add_months
+from rentals.models import PartnerStatement
+from rentals.statements import generate_statement, is_closed
+
+
+class Command(BaseCommand):
+    help = "Render partner statements for a closed month and regenerate stale ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="Month to render (YYYY-MM); defaults to last month")
+        parser.add_argument('--stale-only', action='store_true', help="Only regenerate statements flagged as stale")
+
+    def handle(self, *args, **options):
+        stale = list(PartnerStatement.objects.filter(is_stale=True).select_related('user'))
+        for statement in stale:
+            generate_statement(statement.user, statement.month)
+
+        rendered = 0
+        if not options['stale_only']:
+            if options['month']:
+                try:
+                    month = date.fromisoformat(f"{options['month']}-01")
+                except ValueError:
+                    raise CommandError("--month must be in YYYY-MM format.")
+            else:
+                month = add_months(date.today().replace(day=1), -1)
+            if not is_closed(month):
+                raise CommandError("Statements can only be rendered for closed months.")
+
+            done = set(PartnerStatement.objects.filter(month=month, is_stale=False).values_list('user_id', flat=True))
+            for user in User.objects.filter(vehicles__isnull=False).distinct().exclude(pk__in=done):
+                generate_statement(user, month)
+                rendered += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} statements and regenerated {len(stale)} stale ones."))
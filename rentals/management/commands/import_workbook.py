@@ -0,0 +1,35 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rentals.importer import import_workbook
+from rentals.sheets import UNREADABLE_ERRORS
+
+
+class Command(BaseCommand):
+    help = "Import every sheet of a workbook into the vehicle whose registration number is the sheet's title"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The .xlsx workbook to import")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processes parsing sheets (1 runs in-process)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            summary = import_workbook(options['path'], workers=options['workers'])
+        except UNREADABLE_ERRORS as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+        elapsed = time.perf_counter() - start
+
+        for sheet in summary:
+            target = sheet['vehicle'].name if sheet['vehicle'] else 'no vehicle'
+            self.stdout.write(f"{sheet['sheet']} ({target}): {sheet['rentals']} rentals, {sheet['expenses']} expenses")
+            for error in sheet['errors']:
+                self.stderr.write(f"{sheet['sheet']}: {error}")
+
+        rentals = sum(sheet['rentals'] for sheet in summary)
+        expenses = sum(sheet['expenses'] for sheet in summary)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {rentals} rentals and {expenses} expenses from {len(summary)} sheets in {elapsed:.1f}s."
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from rentals.mileage import refresh_mileage
+from rentals.models import Vehicle
+
+
+class Command(BaseCommand):
+    help = "Rebuild stored odometer mileage records from the full rental history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, help="Only rebuild this vehicle id")
+
+    def handle(self, *args, **options):
+        vehicles = Vehicle.objects.all()
+        if options['vehicle']:
+            vehicles = vehicles.filter(pk=options['vehicle'])
+
+        total = 0
+        for vehicle_id in vehicles.values_list('pk', flat=True):
+            total += refresh_mileage(vehicle_id)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt mileage for {total} rentals."))
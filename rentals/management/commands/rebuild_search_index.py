@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rentals.search import ensure_search_index, rebuild_search_index, uses_fts
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index over rentals and expenses"
+
+    def handle(self, *args, **options):
+        if not uses_fts():
+            raise CommandError("The full-text index is only used on SQLite; other databases search the tables directly.")
+
+        ensure_search_index()
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
@@ -0,0 +1,31 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rentals.notifications import send_emi_reminders
+
+
+class Command(BaseCommand):
+    help = "Email partners about unpaid EMIs inside their warning window (safe to run repeatedly from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Run as if today were this date (YYYY-MM-DD)")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be sent without sending")
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError("--date must be in YYYY-MM-DD format.")
+
+        emails, vehicles, failures = send_emi_reminders(today=today, dry_run=options['dry_run'])
+
+        for email, error in failures:
+            self.stderr.write(f"EMI reminder to {email} failed: {error}")
+
+        if options['dry_run']:
+            self.stdout.write(f"Would send {emails} reminder emails covering {vehicles} vehicles.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Sent {emails} reminder emails covering {vehicles} vehicles."))
@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from .access import AccessContext
+
+
+class AccessContextMiddleware:
+    """Attach a lazily loaded AccessContext to every request as ``request.access``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.access = SimpleLazyObject(lambda: AccessContext(request.user))
+        return self.get_response(request)
@@ -0,0 +1,149 @@
+from datetime import time
+
+from django.conf import settings
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, Lag, TruncMonth
+
+from .models import ArchivedRental, Rental, RentalMileage
+
+
+# km between one trip's ending_km and the next trip's starting_km that is
+# still considered normal (e.g. driving the car back to the yard)
+GAP_TOLERANCE_KM = getattr(settings, 'MILEAGE_GAP_TOLERANCE_KM', 0)
+
+RENTAL_ORDER = ['date_out', 'time_out', 'id']
+
+ANOMALY = Q(odometer_backwards=True) | Q(has_gap=True)
+
+
+def _last_before(rentals, since):
+    if since is not None:
+        rentals = rentals.filter(date_out__lt=since)
+    return (
+        rentals.order_by('-date_out', '-time_out', '-id')
+        .values('id', 'date_out', 'time_out', 'ending_km', 'mileage__cumulative_km')
+        .first()
+    )
+
+
+def refresh_mileage(vehicle_id, since=None):
+    """
+    Recompute mileage records for a vehicle's live rentals from ``since``
+    onwards.
+
+    Previous ending km and the running km total come from SQL window
+    functions, seeded with the last rental before ``since`` (archived ones
+    included) so earlier history is never re-read and archived trips stay
+    in the running total.
+    """
+    rentals = Rental.objects.filter(vehicle_id=vehicle_id)
+    previous_ending = None
+    cumulative_base = 0
+
+    anchors = [_last_before(ArchivedRental.objects.filter(vehicle_id=vehicle_id), since)]
+    if since is not None:
+        anchors.append(_last_before(rentals, since))
+        rentals = rentals.filter(date_out__gte=since)
+    anchors = [anchor for anchor in anchors if anchor]
+    if anchors:
+        anchor = max(anchors, key=lambda row: (row['date_out'], row['time_out'] or time.min, row['id']))
+        previous_ending = anchor['ending_km']
+        cumulative_base = anchor['mileage__cumulative_km'] or 0
+
+    trip_km = Case(
+        When(starting_km__isnull=False, ending_km__isnull=False, then=F('ending_km') - F('starting_km')),
+        default=None,
+        output_field=IntegerField(),
+    )
+    rows = (
+        rentals.annotate(trip=trip_km)
+        .annotate(
+            previous_ending=Window(
+                Lag('ending_km', default=Value(previous_ending, output_field=IntegerField())),
+                order_by=[F(field).asc() for field in RENTAL_ORDER],
+            ),
+            running_km=Window(
+                Sum(Case(When(trip__gt=0, then=F('trip')), default=Value(0), output_field=IntegerField())),
+                order_by=[F(field).asc() for field in RENTAL_ORDER],
+            ),
+        )
+        .values_list('id', 'date_out', 'starting_km', 'ending_km', 'trip', 'previous_ending', 'running_km')
+    )
+
+    records = []
+    for rental_id, date_out, starting_km, ending_km, trip, prev_ending, running_km in rows:
+        gap = None
+        if starting_km is not None and prev_ending is not None:
+            gap = starting_km - prev_ending
+        records.append(RentalMileage(
+            rental_id=rental_id,
+            vehicle_id=vehicle_id,
+            date_out=date_out,
+            trip_km=trip,
+            gap_km=gap,
+            cumulative_km=cumulative_base + (running_km or 0),
+            odometer_backwards=(trip is not None and trip < 0) or (gap is not None and gap < 0),
+            has_gap=gap is not None and gap > GAP_TOLERANCE_KM,
+        ))
+
+    RentalMileage.objects.bulk_create(
+        records,
+        update_conflicts=True,
+        unique_fields=['rental'],
+        update_fields=['vehicle', 'date_out', 'trip_km', 'gap_km', 'cumulative_km', 'odometer_backwards', 'has_gap'],
+    )
+    return len(records)
+
+
+def _km_and_revenue():
+    # Only trips with a usable km reading count towards revenue per km
+    return {
+        'km': Sum(Case(When(trip_km__gt=0, then=F('trip_km')), default=Value(0))),
+        'km_revenue': Sum(Case(
+            When(trip_km__gt=0, then=Coalesce('rental__total_amount_received', 'archived_rental__total_amount_received')),
+            default=Value(0),
+            output_field=DecimalField(),
+        )),
+        'trips': Count('id', filter=Q(trip_km__gt=0)),
+    }
+
+
+def _with_rates(row):
+    km = row['km'] or 0
+    trips = row['trips'] or 0
+    revenue = float(row['km_revenue'] or 0)
+    return {
+        'km': km,
+        'trips': trips,
+        'avg_trip_km': round(km / trips, 1) if trips else 0,
+        'revenue_per_km': round(revenue / km, 2) if km else None,
+    }
+
+
+def monthly_mileage(vehicle_id):
+    """km driven, trip count and revenue per km for each month of a vehicle."""
+    rows = (
+        RentalMileage.objects.filter(vehicle_id=vehicle_id)
+        .annotate(month=TruncMonth('date_out'))
+        .values('month')
+        .annotate(**_km_and_revenue())
+        .order_by('month')
+    )
+    return [dict(_with_rates(row), month=row['month']) for row in rows]
+
+
+def mileage_summary(vehicle_id):
+    records = RentalMileage.objects.filter(vehicle_id=vehicle_id)
+    summary = _with_rates(records.aggregate(**_km_and_revenue()))
+    summary['anomaly_count'] = records.filter(ANOMALY, rental__isnull=False).count()
+    return summary
+
+
+def mileage_anomalies(vehicle_id):
+    # Archived rentals can't be corrected any more, so only live ones are listed
+    return (
+        RentalMileage.objects.filter(vehicle_id=vehicle_id, rental__isnull=False)
+        .filter(ANOMALY)
+        .select_related('rental')
+        .order_by('-date_out')
+    )
@@ -1,3 +1,6 @@
+import re
+
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -22,6 +25,27 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - Partner"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the User post_save signal skip profiles nobody edited
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def changed_fields(self):
+        """Names of fields that differ from what was loaded, or None if it was never loaded."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]
+        ]
+
 
 class Vehicle(models.Model):
     name = models.CharField(max_length=100, help_text="e.g., INNOVA 2014 V4")
@@ -37,6 +61,66 @@ class Vehicle(models.Model):
 
 
 
+def normalize_customer_key(contact_no, customer_id, customer_name):
+    """
+    Stable key for a customer: phone number first, then ID, then name.
+
+    Spreadsheet imports store numbers as floats ("9876543210.0") and add
+    country codes, so phone numbers are reduced to their last 10 digits.
+    """
+    contact = str(contact_no or '').strip()
+    if re.fullmatch(r'\d+\.0', contact):
+        contact = contact[:-2]
+    digits = re.sub(r'\D', '', contact)
+    if len(digits) >= 6:
+        return f"tel:{digits[-10:]}"
+
+    ident = re.sub(r'[^0-9A-Za-z]', '', str(customer_id or '')).upper()
+    if len(ident) >= 4:
+        return f"id:{ident}"
+
+    name = re.sub(r'[^0-9a-z]+', ' ', str(customer_name or '').lower()).strip()
+    return f"name:{name}" if name else ''
+
+
+TOTAL_RENT = models.ExpressionWrapper(
+    models.F('days_of_rent') * models.F('rent_per_day'),
+    output_field=models.DecimalField(max_digits=14, decimal_places=2),
+)
+# What the customer still owes: rent less the agreed discount and what was received
+BALANCE = models.ExpressionWrapper(
+    models.F('days_of_rent') * models.F('rent_per_day') - models.F('discounted_amount') - models.F('total_amount_received'),
+    output_field=models.DecimalField(max_digits=14, decimal_places=2),
+)
+# Written as a comparison of columns so the partial index below can serve it
+HAS_BALANCE = models.Q(
+    total_amount_received__lt=models.F('days_of_rent') * models.F('rent_per_day') - models.F('discounted_amount')
+)
+
+
+class RentalQuerySet(models.QuerySet):
+    """Rent and balance computed by the database, so they can be filtered, sorted and summed."""
+
+    def with_balance(self):
+        return self.annotate(rent_total=TOTAL_RENT, outstanding=BALANCE)
+
+    def outstanding(self):
+        """Rentals with money still to collect."""
+        return self.filter(HAS_BALANCE)
+
+    def outstanding_by(self, *fields):
+        """Outstanding rentals and amount grouped by ``fields``, largest amount first."""
+        return (
+            self.outstanding()
+            .values(*fields)
+            .annotate(rental_count=models.Count('id'), outstanding=models.Sum(BALANCE))
+            .order_by('-outstanding', *fields)
+        )
+
+    def outstanding_total(self):
+        return self.outstanding().aggregate(total=models.Sum(BALANCE))['total'] or 0
+
+
 class Rental(models.Model):
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='rentals')
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='rentals', help_text="Partner responsible for this rental")
@@ -60,19 +144,82 @@ class Rental(models.Model):
 
     total_amount_received = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     discounted_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    customer_key = models.CharField(max_length=120, blank=True, default='', db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RentalQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.customer_name} - {self.date_out}"
 
+    def save(self, *args, **kwargs):
+        self.customer_key = normalize_customer_key(self.contact_no, self.customer_id, self.customer_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'customer_key', 'updated_at'}
+        super().save(*args, **kwargs)
+
     @property
     def total_rent(self):
         return self.days_of_rent * self.rent_per_day
 
     @property
     def balance(self):
-        return (self.days_of_rent * self.rent_per_day) - self.total_amount_received
+        return (self.days_of_rent * self.rent_per_day) - self.discounted_amount - self.total_amount_received
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle', 'date_out']),
+            models.Index(fields=['vehicle', 'date_in']),
+            models.Index(fields=['vehicle', 'date_out'], condition=HAS_BALANCE, name='rental_outstanding_idx'),
+        ]
+
+
+
+class ExpenseCategory(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    sort_order = models.IntegerField(default=0)
 
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['sort_order', 'name']
+        verbose_name_plural = "Expense categories"
+
+
+class ExpenseCategoryRule(models.Model):
+    """Assigns a category to expenses whose particulars match; lower priority numbers are tried first."""
+    MATCH_KEYWORD = 'keyword'
+    MATCH_REGEX = 'regex'
+    MATCH_CHOICES = [
+        (MATCH_KEYWORD, 'Keyword'),
+        (MATCH_REGEX, 'Regular expression'),
+    ]
+
+    category = models.ForeignKey(ExpenseCategory, on_delete=models.CASCADE, related_name='rules')
+    match_type = models.CharField(max_length=10, choices=MATCH_CHOICES, default=MATCH_KEYWORD)
+    pattern = models.CharField(max_length=200, help_text="Keywords match whole words, ignoring case")
+    priority = models.IntegerField(default=100)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.category.name}: {self.pattern}"
+
+    def regex(self):
+        if self.match_type == self.MATCH_REGEX:
+            return self.pattern
+        return r'\b' + re.escape(self.pattern.strip()) + r'\b'
+
+    def clean(self):
+        try:
+            re.compile(self.regex())
+        except re.error as e:
+            raise ValidationError({'pattern': f"Invalid regular expression: {e}"})
+
+    class Meta:
+        ordering = ['priority', 'id']
 
 
 class Expense(models.Model):
@@ -83,11 +230,25 @@ class Expense(models.Model):
     place = models.CharField(max_length=100, blank=True, null=True)
     care_of = models.CharField(max_length=100, blank=True, null=True, verbose_name="C/O")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    category = models.ForeignKey(ExpenseCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='expenses')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.particulars} - {self.amount}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets saves tell whether the particulars were edited
+        instance._loaded_particulars = dict(zip(field_names, values)).get('particulars')
+        return instance
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle', 'category', 'date']),
+        ]
+
 
 class TakenAmount(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='taken_amounts')
@@ -95,6 +256,7 @@ class TakenAmount(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.user.username} - {self.vehicle.name} - {self.amount} on {self.date}"
@@ -124,6 +286,202 @@ class EMIPayment(models.Model):
     month_paid_for = models.DateField(help_text="The month this EMI is paid for (usually 1st of the month)")
     remarks = models.CharField(max_length=200, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"EMI Payment - {self.vehicle.name} - {self.month_paid_for.strftime('%B %Y')}"
+
+
+class VehicleUtilization(models.Model):
+    """Utilization of a vehicle for one closed month, computed once and kept."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='utilization')
+    month = models.DateField(help_text="First day of the month")
+    rented_days = models.DecimalField(max_digits=7, decimal_places=2, default=0)
+    available_days = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    trip_count = models.IntegerField(default=0)
+    trip_days = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.vehicle.name} - {self.month.strftime('%B %Y')}"
+
+    class Meta:
+        unique_together = ('vehicle', 'month')
+
+
+class RevenueForecast(models.Model):
+    """Forecast income and expense of a vehicle for one upcoming month, written by the forecast_revenue command."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='forecasts')
+    month = models.DateField(help_text="First day of the month")
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.vehicle.name} - {self.month.strftime('%B %Y')} (forecast)"
+
+    class Meta:
+        unique_together = ('vehicle', 'month')
+
+
+class RentalMileage(models.Model):
+    """
+    Odometer figures for one rental, derived from the vehicle's ordered rental
+    history. Archiving a rental moves its record to ``archived_rental``, so
+    all-time figures keep counting it.
+    """
+    rental = models.OneToOneField(Rental, on_delete=models.CASCADE, null=True, blank=True, related_name='mileage')
+    archived_rental = models.OneToOneField('ArchivedRental', on_delete=models.CASCADE, null=True, blank=True, related_name='mileage')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='mileage_records')
+    date_out = models.DateField()
+    trip_km = models.IntegerField(blank=True, null=True)
+    gap_km = models.IntegerField(blank=True, null=True, help_text="Starting km minus the previous trip's ending km")
+    cumulative_km = models.IntegerField(default=0, help_text="Running total of rented km for the vehicle")
+    odometer_backwards = models.BooleanField(default=False)
+    has_gap = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.rental or self.archived_rental} - {self.trip_km or 0} km"
+
+    @property
+    def is_anomaly(self):
+        return self.odometer_backwards or self.has_gap
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle', 'date_out']),
+        ]
+
+
+class EMIReminder(models.Model):
+    """A reminder email already sent to a partner for one vehicle's monthly EMI."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='emi_reminders')
+    partner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='emi_reminders')
+    month = models.DateField(help_text="The EMI month the reminder was for")
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"EMI reminder - {self.vehicle.name} - {self.partner.username} - {self.month.strftime('%B %Y')}"
+
+    class Meta:
+        unique_together = ('vehicle', 'partner', 'month')
+
+
+class PartnerStatement(models.Model):
+    """A partner's statement for one closed month, rendered to disk as HTML and XLSX."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='statements')
+    month = models.DateField(help_text="First day of the month")
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Share of the month's income")
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Share of the month's expenses")
+    taken = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    closing_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    is_stale = models.BooleanField(default=False, help_text="A back-dated edit touched this month since it was rendered")
+    generated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Statement - {self.user.username} - {self.month.strftime('%B %Y')}"
+
+    class Meta:
+        unique_together = ('user', 'month')
+
+
+class ArchivedRental(models.Model):
+    """A rental moved out of the live table by the archiver; same columns and primary key as Rental."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='archived_rentals')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_rentals')
+    date_out = models.DateField()
+    time_out = models.TimeField(blank=True, null=True)
+    date_in = models.DateField(blank=True, null=True)
+    time_in = models.TimeField(blank=True, null=True)
+
+    customer_name = models.CharField(max_length=100)
+    contact_no = models.CharField(max_length=20, blank=True, null=True)
+    customer_id = models.CharField(max_length=50, blank=True, null=True)
+    care_of = models.CharField(max_length=100, blank=True, null=True, verbose_name="C/O")
+    destination = models.CharField(max_length=200, blank=True, null=True)
+
+    days_of_rent = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    rent_per_day = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    advance_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    starting_km = models.IntegerField(blank=True, null=True)
+    ending_km = models.IntegerField(blank=True, null=True)
+
+    total_amount_received = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discounted_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    customer_key = models.CharField(max_length=120, blank=True, default='', db_index=True, editable=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    objects = RentalQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.customer_name} - {self.date_out} (archived)"
+
+    @property
+    def total_rent(self):
+        return self.days_of_rent * self.rent_per_day
+
+    @property
+    def balance(self):
+        return (self.days_of_rent * self.rent_per_day) - self.discounted_amount - self.total_amount_received
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle', 'date_out']),
+        ]
+
+
+class ArchivedExpense(models.Model):
+    """An expense moved out of the live table by the archiver; same columns and primary key as Expense."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='archived_expenses')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_expenses')
+    date = models.DateField()
+    particulars = models.CharField(max_length=200)
+    place = models.CharField(max_length=100, blank=True, null=True)
+    care_of = models.CharField(max_length=100, blank=True, null=True, verbose_name="C/O")
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    category = models.ForeignKey(ExpenseCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_expenses')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.particulars} - {self.amount} (archived)"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle', 'date']),
+        ]
+
+
+class MonthlySummary(models.Model):
+    """Monthly totals of one vehicle's archived rentals and expenses."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='monthly_summaries')
+    month = models.DateField(help_text="First day of the month")
+    rental_count = models.IntegerField(default=0)
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    rent_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_count = models.IntegerField(default=0)
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.vehicle.name} - {self.month.strftime('%B %Y')}"
+
+    class Meta:
+        unique_together = ('vehicle', 'month')
+
+
+class Tombstone(models.Model):
+    """A deleted rental, expense, taken amount or EMI payment, kept so sync clients can drop their copy."""
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    vehicle_id = models.BigIntegerField(help_text="Plain id so the record outlives the vehicle")
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle_id', 'deleted_at']),
+        ]
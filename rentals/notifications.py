@@ -1,4 +1,7 @@
-from django.core.mail import send_mail
+from collections import defaultdict
+from datetime import date
+
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
 
@@ -66,3 +69,102 @@ This is an automated notification from Vehicle Manager.
         )
     except Exception as e:
         print(f"Email notification failed: {str(e)}")
+
+
+def _emi_reminder_message(partner, rows):
+    lines = []
+    for row in rows:
+        if row['days_until'] < 0:
+            when = f"overdue by {-row['days_until']} days"
+        elif row['days_until'] == 0:
+            when = "due today"
+        else:
+            when = f"due in {row['days_until']} days"
+        vehicle = row['vehicle']
+        lines.append(f"- {vehicle.name} ({vehicle.registration_number}): ₹{row['amount']} on {row['due_date']} ({when})")
+
+    name = partner['first_name'] or partner['username']
+    return f"""
+Hello {name},
+
+The following EMIs are still unpaid:
+
+{chr(10).join(lines)}
+
+This is an automated notification from Vehicle Manager.
+    """
+
+
+def send_emi_reminders(today=None, dry_run=False):
+    """
+    Email each partner one reminder listing their vehicles with an unpaid EMI
+    inside its warning window.
+
+    Reminders already logged in EMIReminder are skipped, so running this more
+    than once a day does not send duplicates. Returns (emails sent, vehicles
+    reminded, failures), failures being (email address, error) pairs for
+    the caller to report; those partners are tried again on the next run.
+    """
+    from .emi import emi_schedule
+    from .models import EMIReminder, Vehicle
+
+    today = today or date.today()
+    month = today.replace(day=1)
+
+    pending = {
+        row['vehicle'].pk: row
+        for row in emi_schedule(today=today, first_month=month)
+        if row['month'] == month and row['status'] in ('due', 'overdue')
+    }
+    if not pending:
+        return 0, 0, []
+
+    already_sent = set(
+        EMIReminder.objects.filter(month=month, vehicle_id__in=pending.keys())
+        .values_list('vehicle_id', 'partner_id')
+    )
+    partnerships = (
+        Vehicle.partners.through.objects.filter(vehicle_id__in=pending.keys(), user__is_active=True)
+        .exclude(user__email='')
+        .values('vehicle_id', 'user_id', 'user__email', 'user__username', 'user__first_name')
+    )
+
+    by_partner = defaultdict(list)
+    partners = {}
+    for link in partnerships:
+        if (link['vehicle_id'], link['user_id']) in already_sent:
+            continue
+        partners[link['user_id']] = {
+            'email': link['user__email'],
+            'username': link['user__username'],
+            'first_name': link['user__first_name'],
+        }
+        by_partner[link['user_id']].append(pending[link['vehicle_id']])
+
+    if dry_run:
+        return len(by_partner), len({row['vehicle'].pk for rows in by_partner.values() for row in rows}), []
+
+    sent = []
+    failures = []
+    connection = get_connection()
+    with connection:
+        for partner_id, rows in by_partner.items():
+            partner = partners[partner_id]
+            message = EmailMessage(
+                subject=f"EMI Reminder - {len(rows)} vehicle{'s' if len(rows) != 1 else ''} due",
+                body=_emi_reminder_message(partner, rows),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[partner['email']],
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as e:
+                failures.append((partner['email'], str(e)))
+                continue
+            reminders = [EMIReminder(vehicle_id=row['vehicle'].pk, partner_id=partner_id, month=month) for row in rows]
+            # Log each email as soon as it has gone out, so a run that dies midway doesn't resend it
+            EMIReminder.objects.bulk_create(reminders, ignore_conflicts=True)
+            sent.extend(reminders)
+
+    return len({reminder.partner_id for reminder in sent}), len({reminder.vehicle_id for reminder in sent}), failures
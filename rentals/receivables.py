@@ -0,0 +1,135 @@
+from datetime import date, timedelta
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import BALANCE, ArchivedRental, Rental
+
+
+# (label, first day, last day) of age; the last bucket is open-ended
+AGING_BUCKETS = [
+    ('0-30', 0, 30),
+    ('31-60', 31, 60),
+    ('61-90', 61, 90),
+    ('90+', 91, None),
+]
+
+AGING_BASES = ('date_in', 'date_out')
+
+
+def _aged_from(basis):
+    # Rentals still out have no return date, so they age from the day they left
+    return Coalesce('date_in', 'date_out') if basis == 'date_in' else F('date_out')
+
+
+def bucket_for(days):
+    for label, first, last in AGING_BUCKETS:
+        if last is None or days <= last:
+            return label
+
+
+def _bucket_filter(label, first, last, today):
+    # Rentals dated in the future count as current
+    condition = Q() if first == 0 else Q(aged_from__lte=today - timedelta(days=first))
+    if last is not None:
+        condition &= Q(aged_from__gte=today - timedelta(days=last))
+    return condition
+
+
+def _scoped(model, vehicle_ids, basis):
+    rentals = model.objects.outstanding().annotate(aged_from=_aged_from(basis))
+    if vehicle_ids is not None:
+        rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+    return rentals
+
+
+def _grouped(model, vehicle_ids, basis, today):
+    return (
+        _scoped(model, vehicle_ids, basis)
+        .values(
+            'vehicle_id', 'vehicle__name', 'vehicle__registration_number',
+            'user_id', 'user__username', 'user__first_name', 'user__last_name',
+        )
+        .annotate(
+            rental_count=Count('id'),
+            total=Sum(BALANCE),
+            **{
+                f'bucket_{index}': Sum(BALANCE, filter=_bucket_filter(label, first, last, today))
+                for index, (label, first, last) in enumerate(AGING_BUCKETS)
+            },
+        )
+        .order_by()
+    )
+
+
+def _empty_row(**fields):
+    return dict(fields, rental_count=0, total=0, buckets={label: 0 for label, _, _ in AGING_BUCKETS})
+
+
+def _add(target, row):
+    target['rental_count'] += row['rental_count']
+    target['total'] += row['total'] or 0
+    for index, (label, _, _) in enumerate(AGING_BUCKETS):
+        target['buckets'][label] += row[f'bucket_{index}'] or 0
+
+
+def aging_report(vehicle_ids=None, basis='date_in', today=None):
+    """
+    Outstanding rental balances split into age buckets, per vehicle and per
+    partner.
+
+    Live and archived rentals are grouped by (vehicle, partner) in a single
+    UNION query over the outstanding-rental partial index; the two
+    breakdowns are rolled up from those rows.
+    """
+    today = today or date.today()
+    rows = _grouped(Rental, vehicle_ids, basis, today).union(
+        _grouped(ArchivedRental, vehicle_ids, basis, today), all=True,
+    )
+
+    vehicles = {}
+    partners = {}
+    totals = _empty_row()
+    for row in rows:
+        vehicle = vehicles.get(row['vehicle_id'])
+        if vehicle is None:
+            vehicle = vehicles[row['vehicle_id']] = _empty_row(
+                id=row['vehicle_id'], name=row['vehicle__name'], registration_number=row['vehicle__registration_number'],
+            )
+        partner = partners.get(row['user_id'])
+        if partner is None:
+            full_name = f"{row['user__first_name'] or ''} {row['user__last_name'] or ''}".strip()
+            partner = partners[row['user_id']] = _empty_row(
+                id=row['user_id'], name=full_name or row['user__username'] or 'Unassigned',
+            )
+        for target in (vehicle, partner, totals):
+            _add(target, row)
+
+    return {
+        'basis': basis,
+        'today': today,
+        'buckets': [label for label, _, _ in AGING_BUCKETS],
+        'vehicles': sorted(vehicles.values(), key=lambda row: (-row['total'], row['name'])),
+        'partners': sorted(partners.values(), key=lambda row: (-row['total'], row['name'])),
+        'totals': totals,
+    }
+
+
+def aging_rows(vehicle_ids=None, basis='date_in', today=None):
+    """Every outstanding rental with its age and bucket, streamed from the database."""
+    today = today or date.today()
+    fields = (
+        'id', 'vehicle__name', 'vehicle__registration_number', 'user__username', 'customer_name', 'contact_no',
+        'date_out', 'date_in', 'aged_from', 'days_of_rent', 'rent_per_day', 'discounted_amount',
+        'total_amount_received', 'balance_due',
+    )
+    for model in (Rental, ArchivedRental):
+        rentals = (
+            _scoped(model, vehicle_ids, basis)
+            .annotate(balance_due=BALANCE)
+            .order_by('aged_from', 'id')
+            .values_list(*fields, named=True)
+        )
+        for rental in rentals.iterator(chunk_size=2000):
+            age = max((today - rental.aged_from).days, 0)
+            yield rental, age, bucket_for(age)
@@ -0,0 +1,194 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Rental, Expense
+
+
+SEARCH_TABLE = 'rentals_search'
+
+# Rentals and expenses share one FTS table; their rowids are interleaved so
+# triggers can find a row by primary key without scanning the index
+RENTAL_ROWID = 'new.id * 2'
+EXPENSE_ROWID = 'new.id * 2 + 1'
+
+RENTAL_COLUMNS = "'rental', 'v' || new.vehicle_id, new.customer_name, new.contact_no, new.customer_id, new.care_of, new.destination, NULL, NULL"
+EXPENSE_COLUMNS = "'expense', 'v' || new.vehicle_id, NULL, NULL, NULL, new.care_of, NULL, new.particulars, new.place"
+
+TEXT_COLUMNS = ['customer_name', 'contact_no', 'customer_id', 'care_of', 'destination', 'particulars', 'place']
+
+SEARCH_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        kind UNINDEXED, vehicle,
+        customer_name, contact_no, customer_id, care_of, destination, particulars, place,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_rental_insert AFTER INSERT ON rentals_rental BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, kind, vehicle, customer_name, contact_no, customer_id, care_of, destination, particulars, place)
+        VALUES ({RENTAL_ROWID}, {RENTAL_COLUMNS});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_rental_update AFTER UPDATE ON rentals_rental BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+        INSERT INTO {SEARCH_TABLE}(rowid, kind, vehicle, customer_name, contact_no, customer_id, care_of, destination, particulars, place)
+        VALUES ({RENTAL_ROWID}, {RENTAL_COLUMNS});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_rental_delete AFTER DELETE ON rentals_rental BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_expense_insert AFTER INSERT ON rentals_expense BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, kind, vehicle, customer_name, contact_no, customer_id, care_of, destination, particulars, place)
+        VALUES ({EXPENSE_ROWID}, {EXPENSE_COLUMNS});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_expense_update AFTER UPDATE ON rentals_expense BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+        INSERT INTO {SEARCH_TABLE}(rowid, kind, vehicle, customer_name, contact_no, customer_id, care_of, destination, particulars, place)
+        VALUES ({EXPENSE_ROWID}, {EXPENSE_COLUMNS});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_expense_delete AFTER DELETE ON rentals_expense BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+]
+
+REBUILD_STATEMENTS = [
+    f"DELETE FROM {SEARCH_TABLE}",
+    f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, kind, vehicle, customer_name, contact_no, customer_id, care_of, destination, particulars, place)
+    SELECT id * 2, 'rental', 'v' || vehicle_id, customer_name, contact_no, customer_id, care_of, destination, NULL, NULL
+    FROM rentals_rental
+    """,
+    f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, kind, vehicle, customer_name, contact_no, customer_id, care_of, destination, particulars, place)
+    SELECT id * 2 + 1, 'expense', 'v' || vehicle_id, NULL, NULL, NULL, care_of, NULL, particulars, place
+    FROM rentals_expense
+    """,
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')",
+]
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [name])
+    return cursor.fetchone() is not None
+
+
+def ensure_search_index(**kwargs):
+    """Create the FTS table and its triggers, filling it the first time."""
+    if not uses_fts():
+        return
+    with connection.cursor() as cursor:
+        if not _table_exists(cursor, 'rentals_rental') or not _table_exists(cursor, 'rentals_expense'):
+            return
+        created = not _table_exists(cursor, SEARCH_TABLE)
+        for statement in SEARCH_SCHEMA:
+            cursor.execute(statement)
+    if created:
+        rebuild_search_index()
+
+
+def rebuild_search_index():
+    with connection.cursor() as cursor:
+        for statement in REBUILD_STATEMENTS:
+            cursor.execute(statement)
+
+
+def build_match_query(text):
+    """Turn user input into an FTS5 prefix query where every word must match."""
+    terms = re.findall(r'\w+', text, flags=re.UNICODE)
+    if not terms:
+        return ''
+    columns = ' '.join(TEXT_COLUMNS)
+    return '{%s} : (%s)' % (columns, ' AND '.join(f'"{term}"*' for term in terms))
+
+
+def search_ids(text, vehicle_ids=None, limit=50):
+    """
+    Return (kind, object_id) pairs matching ``text``, newest first.
+
+    ``vehicle_ids`` restricts results to those vehicles; None means no
+    restriction (superusers).
+    """
+    match = build_match_query(text)
+    if not match:
+        return []
+
+    if not uses_fts():
+        return _search_ids_fallback(text, vehicle_ids, limit)
+
+    if vehicle_ids is not None:
+        # Vehicles are indexed as "v<id>" tokens so permission filtering
+        # happens inside the full-text match instead of after it
+        vehicle_ids = list(vehicle_ids)
+        if not vehicle_ids:
+            return []
+        scope = ' OR '.join(f'v{int(pk)}' for pk in vehicle_ids)
+        match = f'vehicle : ({scope}) AND {match}'
+
+    # Ordered by the records' own dates, the same as the fallback, with
+    # each match looked up by primary key
+    sql = f"""
+        SELECT hit.kind, hit.rowid / 2
+        FROM {SEARCH_TABLE} AS hit
+        LEFT JOIN rentals_rental AS rental ON hit.kind = 'rental' AND rental.id = hit.rowid / 2
+        LEFT JOIN rentals_expense AS expense ON hit.kind = 'expense' AND expense.id = hit.rowid / 2
+        WHERE hit.{SEARCH_TABLE} MATCH %s
+        ORDER BY COALESCE(rental.date_out, expense.date) DESC, hit.kind DESC, hit.rowid DESC
+        LIMIT %s
+    """
+    params = [match, limit]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def _search_ids_fallback(text, vehicle_ids, limit):
+    rental_filter = Q()
+    expense_filter = Q()
+    for term in re.findall(r'\w+', text, flags=re.UNICODE):
+        rental_filter &= (
+            Q(customer_name__icontains=term) | Q(contact_no__icontains=term) | Q(customer_id__icontains=term)
+            | Q(care_of__icontains=term) | Q(destination__icontains=term)
+        )
+        expense_filter &= Q(particulars__icontains=term) | Q(place__icontains=term) | Q(care_of__icontains=term)
+
+    rentals = Rental.objects.filter(rental_filter)
+    expenses = Expense.objects.filter(expense_filter)
+    if vehicle_ids is not None:
+        rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+        expenses = expenses.filter(vehicle_id__in=vehicle_ids)
+
+    # Newest first across both kinds, rentals before expenses on the same day
+    found = [(day, 'rental', pk) for pk, day in rentals.order_by('-date_out', '-pk').values_list('pk', 'date_out')[:limit]]
+    found += [(day, 'expense', pk) for pk, day in expenses.order_by('-date', '-pk').values_list('pk', 'date')[:limit]]
+    found.sort(reverse=True)
+    return [(kind, pk) for _, kind, pk in found[:limit]]
+
+
+def search(text, vehicle_ids=None, limit=50):
+    """Matching Rental and Expense objects, newest first."""
+    hits = search_ids(text, vehicle_ids, limit)
+    rental_ids = [pk for kind, pk in hits if kind == 'rental']
+    expense_ids = [pk for kind, pk in hits if kind == 'expense']
+    objects = {}
+    objects.update({('rental', r.pk): r for r in Rental.objects.filter(pk__in=rental_ids).select_related('vehicle')})
+    objects.update({('expense', e.pk): e for e in Expense.objects.filter(pk__in=expense_ids).select_related('vehicle')})
+    return [(kind, objects[(kind, pk)]) for kind, pk in hits if (kind, pk) in objects]
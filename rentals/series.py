@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncWeek, TruncYear
+
+from .analytics import add_months
+from .models import Expense, MonthlySummary, Rental
+
+
+GRANULARITIES = {
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'quarter': TruncQuarter,
+    'year': TruncYear,
+}
+
+# How far back a chart looks when no start date is given
+DEFAULT_SPAN = {
+    'week': timedelta(weeks=26),
+    'month': timedelta(days=365 * 2),
+    'quarter': timedelta(days=365 * 3),
+    'year': timedelta(days=365 * 10),
+}
+
+MAX_POINTS = 520
+
+
+class SeriesError(ValueError):
+    pass
+
+
+def period_start(value, granularity):
+    if granularity == 'week':
+        return value - timedelta(days=value.weekday())
+    if granularity == 'month':
+        return value.replace(day=1)
+    if granularity == 'quarter':
+        return date(value.year, (value.month - 1) // 3 * 3 + 1, 1)
+    return date(value.year, 1, 1)
+
+
+def next_period(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(weeks=1)
+    return add_months(start, {'month': 1, 'quarter': 3, 'year': 12}[granularity])
+
+
+def periods(start, end, granularity):
+    """Start dates of every period overlapping [start, end]."""
+    current = period_start(start, granularity)
+    result = []
+    while current <= end:
+        result.append(current)
+        if len(result) > MAX_POINTS:
+            raise SeriesError(f"That range has more than {MAX_POINTS} {granularity}s; pick a coarser granularity.")
+        current = next_period(current, granularity)
+    return result
+
+
+def _bucket(value):
+    # Trunc* returns datetimes for some backends
+    return value.date() if hasattr(value, 'date') else value
+
+
+def income_expense_series(vehicle_ids, granularity='month', start=None, end=None, today=None):
+    """
+    Income and expense per period between ``start`` and ``end`` as parallel
+    arrays, summed in the database at the requested granularity.
+
+    Archived months only exist as monthly summaries, so weeks cover live
+    rows only and the response says up to which month that applies.
+    """
+    if granularity not in GRANULARITIES:
+        raise SeriesError("Granularity must be one of: " + ", ".join(GRANULARITIES) + ".")
+    end = end or today or date.today()
+    start = start or end - DEFAULT_SPAN[granularity]
+    if start > end:
+        raise SeriesError("The start date must not be after the end date.")
+
+    buckets = periods(start, end, granularity)
+    index = {bucket: i for i, bucket in enumerate(buckets)}
+    income = [0.0] * len(buckets)
+    expense = [0.0] * len(buckets)
+    trunc = GRANULARITIES[granularity]
+
+    live = [
+        (income, Rental.objects.filter(date_out__range=(start, end)).annotate(period=trunc('date_out'))
+            .values('period').annotate(total=Sum('total_amount_received'))),
+        (expense, Expense.objects.filter(date__range=(start, end)).annotate(period=trunc('date'))
+            .values('period').annotate(total=Sum('amount'))),
+    ]
+    for target, rows in live:
+        for row in rows.filter(vehicle_id__in=vehicle_ids).order_by():
+            target[index[_bucket(row['period'])]] += float(row['total'] or 0)
+
+    summaries = MonthlySummary.objects.filter(vehicle_id__in=vehicle_ids, month__range=(start.replace(day=1), end))
+    archived_through = None
+    for row in summaries.values('month').annotate(income=Sum('income'), expense=Sum('expense')).order_by('month'):
+        archived_through = row['month']
+        if granularity == 'week':
+            continue
+        i = index.get(period_start(row['month'], granularity))
+        if i is not None:
+            income[i] += float(row['income'] or 0)
+            expense[i] += float(row['expense'] or 0)
+
+    return {
+        'granularity': granularity,
+        'start': start,
+        'end': end,
+        'periods': buckets,
+        'income': [round(value, 2) for value in income],
+        'expense': [round(value, 2) for value in expense],
+        'profit': [round(i - e, 2) for i, e in zip(income, expense)],
+        'archived_through': archived_through if granularity == 'week' else None,
+    }
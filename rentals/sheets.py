@@ -0,0 +1,248 @@
+"""
+Reading rental/expense workbooks into plain row dicts.
+
+Nothing here touches Django, so sheets can be parsed in worker processes
+and the results pickled back to the process that writes them.
+
+Workbooks can be given as a path, an open binary file (such as an upload)
+or bytes.
+"""
+from datetime import date, datetime, time
+from io import BytesIO
+from zipfile import BadZipFile
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+
+HEADER_COLUMNS = ('DATE OUT', 'CUSTOMER')
+HEADER_SEARCH_ROWS = 20
+# Rows handed to the parser at a time while streaming a sheet
+BATCH_SIZE = 1000
+# What opening something that isn't a readable .xlsx workbook raises
+UNREADABLE_ERRORS = (BadZipFile, InvalidFileException, KeyError, OSError)
+
+
+class HeaderNotFound(ValueError):
+    pass
+
+
+def _value(value):
+    """The cell value, or None for blanks and NaN."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value != value:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _text(value):
+    value = _value(value)
+    return None if value is None else str(value)
+
+
+def _date(value):
+    value = _value(value)
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        parsed = pd.to_datetime(value, dayfirst=True, errors='coerce')
+        return None if pd.isna(parsed) else parsed.date()
+    return None
+
+
+def _time(value):
+    value = _value(value)
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.time()
+    if isinstance(value, time):
+        return value
+    if isinstance(value, str):
+        parsed = pd.to_datetime(value, errors='coerce')
+        return None if pd.isna(parsed) else parsed.time()
+    return None
+
+
+def _number(value, default=0):
+    value = _value(value)
+    if isinstance(value, bool) or value is None:
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return default if number != number else number
+
+
+def _integer(value):
+    number = _number(value, default=None)
+    return None if number is None else int(number)
+
+
+def _column_names(header):
+    """Upper-cased header names, with repeats suffixed .1, .2 like pandas does (C/O, C/O.1)."""
+    names, seen = [], {}
+    for i, value in enumerate(header):
+        name = f'UNNAMED: {i}' if _value(value) is None else str(value).strip().upper()
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _is_header(values):
+    labels = {str(value).strip().upper() for value in values if value is not None}
+    return all(column in labels for column in HEADER_COLUMNS)
+
+
+def open_workbook(source):
+    """Open a workbook read-only from a path, a binary file or bytes."""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif hasattr(source, 'seek'):
+        # The same upload is opened once for its sheet names and again per sheet
+        source.seek(0)
+    return load_workbook(source, read_only=True, data_only=True)
+
+
+def read_sheet(source, sheet_name=0, batch_size=BATCH_SIZE):
+    """
+    Stream a sheet in one pass, yielding (column names, batch of (row
+    number, row tuple) pairs) from its DATE OUT/CUSTOMER header row on.
+
+    The workbook is opened read-only, so only ``batch_size`` rows are held
+    at a time; blank rows are dropped, but row numbers are the ones shown
+    in the spreadsheet. Raises HeaderNotFound if the header isn't within
+    the first HEADER_SEARCH_ROWS rows.
+    """
+    workbook = open_workbook(source)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        # Some writers record a wrong sheet size, which would cut rows short
+        sheet.reset_dimensions()
+        # Rows missing from the file come back empty, so counting them gives sheet row numbers
+        rows = enumerate(sheet.iter_rows(values_only=True), start=1)
+
+        columns = None
+        for number, values in rows:
+            if number > HEADER_SEARCH_ROWS:
+                break
+            if _is_header(values):
+                columns = _column_names(values)
+                break
+        if columns is None:
+            raise HeaderNotFound("Header row not found (DATE OUT, CUSTOMER)")
+
+        batch = []
+        for number, values in rows:
+            if all(value is None for value in values):
+                continue
+            batch.append((number, values))
+            if len(batch) >= batch_size:
+                yield columns, batch
+                batch = []
+        if batch:
+            yield columns, batch
+    finally:
+        workbook.close()
+
+
+def parse_rental(row, columns):
+    """Rental fields from a sheet row, or None when the row has no rental on it."""
+    customer = _text(row.get('CUSTOMER'))
+    date_out = _date(row.get('DATE OUT'))
+    if not customer or not date_out:
+        return None
+
+    advance = row.get('ADV; AMOUNT') if 'ADV; AMOUNT' in columns else None
+    if _value(advance) is None and 'ADV AMOUNT' in columns:
+        advance = row.get('ADV AMOUNT')
+    return {
+        'date_out': date_out,
+        'time_out': _time(row.get('TIME OUT')),
+        'date_in': _date(row.get('DATE IN')),
+        'time_in': _time(row.get('TIME IN')),
+        'customer_name': customer,
+        # The column is sometimes headed "CONTACT NO;"
+        'contact_no': _text(row.get('CONTACT NO;')) or _text(row.get('CONTACT NO')),
+        'customer_id': _text(row.get('CUSTOMER ID')),
+        'care_of': _text(row.get('C/O')),
+        'destination': _text(row.get('DESTINATION')),
+        'days_of_rent': _number(row.get('DAYS OF RENT')),
+        'rent_per_day': _number(row.get('RENT/DAY')),
+        'advance_amount': _number(advance),
+        'starting_km': _integer(row.get('STARTING KM')),
+        'ending_km': _integer(row.get('ENDING KM')),
+        'total_amount_received': _number(row.get('TOTAL AMOUNT RECEIVED')),
+    }
+
+
+def parse_expense(row, columns, today=None):
+    """Expense fields from a sheet row, or None when the row has no expense on it."""
+    particulars = _text(row.get('PARTICULARS'))
+    if not particulars or _value(row.get('AMOUNT')) is None:
+        return None
+
+    # Expenses share the sheet with rentals, so their C/O is the second C/O
+    # column, or the only one on rows without a customer
+    care_of = _text(row.get('C/O.1')) if 'C/O.1' in columns else None
+    if not care_of and 'C/O' in columns and _value(row.get('CUSTOMER')) is None:
+        care_of = _text(row.get('C/O'))
+    return {
+        'date': _date(row.get('DATE')) or today or date.today(),
+        'particulars': particulars,
+        'place': _text(row.get('PLACE')),
+        'care_of': care_of,
+        'amount': _number(row.get('AMOUNT')),
+    }
+
+
+def parse_rows(rows, columns):
+    """
+    Split (row number, row tuple) pairs into (row number, field dict)
+    pairs of rentals and expenses, collecting row errors.
+    """
+    result = {'rentals': [], 'expenses': [], 'errors': []}
+    names = set(columns)
+    for number, values in rows:
+        row = dict(zip(columns, values))
+        for kind, parse in (('rentals', parse_rental), ('expenses', parse_expense)):
+            try:
+                fields = parse(row, names)
+            except Exception as e:
+                result['errors'].append(f"{kind[:-1].capitalize()} Row {number}: {e}")
+                continue
+            if fields:
+                result[kind].append((number, fields))
+    return result
+
+
+def parse_batches(source, sheet_name=0, batch_size=BATCH_SIZE):
+    """parse_rows for each batch of a sheet as it is read; raises HeaderNotFound like read_sheet."""
+    for columns, batch in read_sheet(source, sheet_name, batch_size):
+        yield parse_rows(batch, columns)
+
+
+def parse_sheet(source, sheet_name=0):
+    """Parse a whole sheet at once; the unit of work for import worker processes."""
+    result = {'sheet': sheet_name, 'header_found': True, 'rentals': [], 'expenses': [], 'errors': []}
+    try:
+        for parsed in parse_batches(source, sheet_name):
+            for key in ('rentals', 'expenses', 'errors'):
+                result[key].extend(parsed[key])
+    except HeaderNotFound as e:
+        return dict(result, header_found=False, rentals=[], expenses=[], errors=[str(e)])
+    return result
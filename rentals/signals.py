@@ -1,7 +1,29 @@
-from django.db.models.signals import post_save
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Vehicle, Rental, Expense, ExpenseCategory, ExpenseCategoryRule, TakenAmount, EMI, EMIPayment
+
+_batch = threading.local()
+
+@contextmanager
+def per_row_refresh_muted():
+    """
+    Skip the utilization, mileage, statement and tombstone receivers for
+    rows saved or deleted inside the block; the caller brings derived data
+    up to date once for the whole batch.
+    """
+    muted = getattr(_batch, 'muted', False)
+    _batch.muted = True
+    try:
+        yield
+    finally:
+        _batch.muted = muted
+
+def _muted():
+    return getattr(_batch, 'muted', False)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -10,5 +32,142 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+    # Only a profile already loaded on this user can carry edits; touching
+    # instance.profile otherwise costs a query, and logins save the user
+    # just to bump last_login.
+    if not User.profile.related.is_cached(instance):
+        return
+    profile = User.profile.related.get_cached_value(instance)
+    if profile is None:
+        return
+    changed = profile.changed_fields()
+    if changed is None:
+        profile.save()
+    elif changed:
+        profile.save(update_fields=changed + ['updated_at'])
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_partner_choices(sender, instance, update_fields=None, **kwargs):
+    from .choices import invalidate_partners
+    # Logins only bump last_login, which the partner lists don't show
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_partners()
+
+@receiver(pre_save, sender=Rental)
+def remember_rental_dates(sender, instance, **kwargs):
+    # Keep the stored dates so edits can invalidate the months they used to cover
+    instance._previous_dates = None
+    if instance.pk:
+        instance._previous_dates = Rental.objects.filter(pk=instance.pk).values_list('vehicle_id', 'date_out').first()
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+def invalidate_rental_utilization(sender, instance, **kwargs):
+    if _muted():
+        return
+    from .analytics import invalidate_utilization
+    previous = getattr(instance, '_previous_dates', None)
+    if previous and previous[0] != instance.vehicle_id:
+        invalidate_utilization(previous[0], previous[1])
+    invalidate_utilization(instance.vehicle_id, instance.date_out, previous[1] if previous else None)
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+def refresh_rental_mileage(sender, instance, **kwargs):
+    if _muted():
+        return
+    from .mileage import refresh_mileage
+    previous = getattr(instance, '_previous_dates', None)
+    if previous and previous[0] != instance.vehicle_id:
+        refresh_mileage(previous[0], since=previous[1])
+    since = min(d for d in (instance.date_out, previous[1] if previous else None) if d)
+    refresh_mileage(instance.vehicle_id, since=since)
+
+@receiver(post_save, sender=EMI)
+@receiver(post_delete, sender=EMI)
+@receiver(post_save, sender=EMIPayment)
+@receiver(post_delete, sender=EMIPayment)
+def invalidate_vehicle_emi_status(sender, instance, **kwargs):
+    from .emi import invalidate_emi_status
+    invalidate_emi_status(instance.vehicle_id)
+
+@receiver(pre_save, sender=Expense)
+@receiver(pre_save, sender=TakenAmount)
+def remember_entry_dates(sender, instance, **kwargs):
+    instance._previous_dates = None
+    if instance.pk:
+        instance._previous_dates = sender.objects.filter(pk=instance.pk).values_list('vehicle_id', 'date').first()
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=TakenAmount)
+@receiver(post_delete, sender=TakenAmount)
+def mark_entry_statements_stale(sender, instance, **kwargs):
+    if _muted():
+        return
+    from .statements import mark_statements_stale
+    previous = getattr(instance, '_previous_dates', None)
+    if previous:
+        mark_statements_stale(previous[0], previous[1])
+    mark_statements_stale(instance.vehicle_id, instance.date_out if sender is Rental else instance.date)
+
+@receiver(m2m_changed, sender=Vehicle.partners.through)
+def mark_partner_statements_stale(sender, instance, action, reverse, pk_set, **kwargs):
+    from .statements import mark_partner_statements_stale
+    # Changing who partners a vehicle changes every partner's share of it
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_vehicle_ids = list(instance.vehicles.values_list('pk', flat=True))
+        else:
+            instance._cleared_partner_ids = list(instance.partners.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        if reverse:
+            mark_partner_statements_stale(user_ids=[instance.pk], vehicle_ids=getattr(instance, '_cleared_vehicle_ids', []))
+        else:
+            mark_partner_statements_stale(user_ids=getattr(instance, '_cleared_partner_ids', []), vehicle_ids=[instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            mark_partner_statements_stale(user_ids=[instance.pk], vehicle_ids=pk_set)
+        else:
+            mark_partner_statements_stale(user_ids=pk_set, vehicle_ids=[instance.pk])
+
+@receiver(post_save, sender=Rental)
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=TakenAmount)
+@receiver(post_delete, sender=Rental)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=TakenAmount)
+@receiver(post_delete, sender=EMIPayment)
+def record_sync_tombstone(sender, instance, **kwargs):
+    if _muted():
+        return
+    from .sync import FEED_MODELS, record_tombstone
+    kind = next(kind for kind, model in FEED_MODELS.items() if model is sender)
+    if kwargs['signal'] is post_delete:
+        record_tombstone(kind, instance.pk, instance.vehicle_id)
+        return
+    # Moving a record to another vehicle deletes it from the old vehicle's feed
+    previous = getattr(instance, '_previous_dates', None)
+    if previous and previous[0] != instance.vehicle_id:
+        record_tombstone(kind, instance.pk, previous[0])
+
+@receiver(pre_save, sender=Expense)
+def classify_expense(sender, instance, **kwargs):
+    from .categories import ExpenseClassifier
+    # Keep a category someone picked unless the particulars it was picked for changed
+    edited = instance.particulars != getattr(instance, '_loaded_particulars', instance.particulars)
+    if instance.category_id is None or edited:
+        instance.category_id = ExpenseClassifier()(instance.particulars)
+    instance._loaded_particulars = instance.particulars
+
+@receiver(post_save, sender=ExpenseCategory)
+@receiver(post_delete, sender=ExpenseCategory)
+@receiver(post_save, sender=ExpenseCategoryRule)
+@receiver(post_delete, sender=ExpenseCategoryRule)
+def invalidate_category_rules(sender, instance, **kwargs):
+    from .categories import invalidate_rules
+    invalidate_rules()
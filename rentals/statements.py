@@ -0,0 +1,223 @@
+import io
+import os
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Count, Q, Sum
+from django.template.loader import render_to_string
+from openpyxl import Workbook
+from openpyxl.styles import Border, Font, PatternFill, Side
+
+from .analytics import add_months, month_start
+from .models import Expense, MonthlySummary, PartnerStatement, Rental, TakenAmount, Vehicle
+
+
+STATEMENTS_ROOT = getattr(settings, 'PARTNER_STATEMENTS_ROOT', os.path.join(settings.MEDIA_ROOT, 'statements'))
+
+storage = FileSystemStorage(location=STATEMENTS_ROOT)
+
+ZERO = Decimal('0')
+
+
+def is_closed(month, today=None):
+    return month_start(month) < (today or date.today()).replace(day=1)
+
+
+def statement_path(user_id, month, extension):
+    return f"{user_id}/{month.strftime('%Y-%m')}.{extension}"
+
+
+def _totals_by_vehicle(queryset, date_field, amount_field, month, next_month):
+    """Month and to-date totals per vehicle in one grouped query."""
+    rows = (
+        queryset.filter(**{f'{date_field}__lt': next_month})
+        .values('vehicle_id')
+        .annotate(
+            month_total=Sum(amount_field, filter=Q(**{f'{date_field}__gte': month})),
+            to_date=Sum(amount_field),
+        )
+    )
+    return {row['vehicle_id']: (row['month_total'] or ZERO, row['to_date'] or ZERO) for row in rows}
+
+
+def _add_archived(totals, vehicle_ids, field, month, next_month):
+    """Fold archived monthly summaries into live per-vehicle totals."""
+    rows = (
+        MonthlySummary.objects.filter(vehicle_id__in=vehicle_ids, month__lt=next_month)
+        .values('vehicle_id')
+        .annotate(month_total=Sum(field, filter=Q(month__gte=month)), to_date=Sum(field))
+    )
+    for row in rows:
+        month_total, to_date = totals.get(row['vehicle_id'], (ZERO, ZERO))
+        totals[row['vehicle_id']] = (month_total + (row['month_total'] or ZERO), to_date + (row['to_date'] or ZERO))
+    return totals
+
+
+def statement_data(user, month):
+    """
+    Share of income and expense per vehicle for one month, taken amounts and
+    the running balance at the end of the month.
+
+    Shares are split by the vehicle's current partner count, as on the user
+    detail page.
+    """
+    month = month_start(month)
+    next_month = add_months(month, 1)
+
+    vehicle_ids = Vehicle.objects.filter(partners=user).values('pk')
+    vehicles = list(
+        Vehicle.objects.filter(pk__in=vehicle_ids).annotate(num_partners=Count('partners')).order_by('name')
+    )
+    ids = [vehicle.pk for vehicle in vehicles]
+
+    income = _totals_by_vehicle(Rental.objects.filter(vehicle_id__in=ids), 'date_out', 'total_amount_received', month, next_month)
+    income = _add_archived(income, ids, 'income', month, next_month)
+    expense = _totals_by_vehicle(Expense.objects.filter(vehicle_id__in=ids), 'date', 'amount', month, next_month)
+    expense = _add_archived(expense, ids, 'expense', month, next_month)
+    taken = _totals_by_vehicle(TakenAmount.objects.filter(user=user, vehicle_id__in=ids), 'date', 'amount', month, next_month)
+
+    rows = []
+    totals = {key: ZERO for key in ('income', 'expense', 'profit', 'taken', 'opening_balance', 'closing_balance')}
+    for vehicle in vehicles:
+        num_partners = vehicle.num_partners or 1
+        month_income, income_to_date = income.get(vehicle.pk, (ZERO, ZERO))
+        month_expense, expense_to_date = expense.get(vehicle.pk, (ZERO, ZERO))
+        month_taken, taken_to_date = taken.get(vehicle.pk, (ZERO, ZERO))
+
+        share_income = month_income / num_partners
+        share_expense = month_expense / num_partners
+        closing_balance = (income_to_date - expense_to_date) / num_partners - taken_to_date
+        row = {
+            'vehicle': vehicle,
+            'num_partners': num_partners,
+            'income': share_income,
+            'expense': share_expense,
+            'profit': share_income - share_expense,
+            'taken': month_taken,
+            'closing_balance': closing_balance,
+            'opening_balance': closing_balance - (share_income - share_expense) + month_taken,
+        }
+        rows.append(row)
+        for key in totals:
+            totals[key] += row[key]
+
+    return {'user': user, 'month': month, 'rows': rows, 'totals': totals}
+
+
+def _statement_workbook(data):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = data['month'].strftime('%b %Y')
+
+    header_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    border_thin = Border(
+        left=Side(style='thin', color='000000'),
+        right=Side(style='thin', color='000000'),
+        top=Side(style='thin', color='000000'),
+        bottom=Side(style='thin', color='000000')
+    )
+
+    user = data['user']
+    ws.cell(row=1, column=1, value=f"Statement for {user.get_full_name() or user.username}").font = Font(bold=True, size=14)
+    ws.cell(row=2, column=1, value=data['month'].strftime('%B %Y')).font = Font(bold=True)
+
+    headers = ['Vehicle', 'Registration', 'Partners', 'Opening Balance', 'Income Share', 'Expense Share', 'Profit Share', 'Taken', 'Closing Balance']
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=4, column=col, value=header)
+        cell.font = Font(bold=True)
+        cell.fill = header_fill
+        cell.border = border_thin
+
+    row_num = 5
+    for row in data['rows'] + [dict(data['totals'], vehicle=None, num_partners='')]:
+        vehicle = row['vehicle']
+        values = [
+            vehicle.name if vehicle else 'TOTAL',
+            vehicle.registration_number if vehicle else '',
+            row['num_partners'],
+            float(row['opening_balance']),
+            float(row['income']),
+            float(row['expense']),
+            float(row['profit']),
+            float(row['taken']),
+            float(row['closing_balance']),
+        ]
+        for col, value in enumerate(values, 1):
+            cell = ws.cell(row=row_num, column=col, value=value)
+            cell.border = border_thin
+            if col > 3:
+                cell.number_format = '#,##0.00'
+            if not vehicle:
+                cell.font = Font(bold=True)
+        row_num += 1
+
+    for col, width in enumerate([20, 16, 10, 16, 14, 14, 14, 12, 16], 1):
+        ws.column_dimensions[ws.cell(row=4, column=col).column_letter].width = width
+    return wb
+
+
+def _write(path, content):
+    if storage.exists(path):
+        storage.delete(path)
+    storage.save(path, ContentFile(content))
+
+
+def generate_statement(user, month):
+    """Render a closed month's statement to disk and record it."""
+    data = statement_data(user, month)
+    month = data['month']
+
+    html = render_to_string('statements/partner_statement.html', data)
+    _write(statement_path(user.pk, month, 'html'), html.encode('utf-8'))
+
+    buffer = io.BytesIO()
+    _statement_workbook(data).save(buffer)
+    _write(statement_path(user.pk, month, 'xlsx'), buffer.getvalue())
+
+    statement, _ = PartnerStatement.objects.update_or_create(
+        user=user, month=month,
+        defaults={
+            'income': data['totals']['income'],
+            'expense': data['totals']['expense'],
+            'taken': data['totals']['taken'],
+            'closing_balance': data['totals']['closing_balance'],
+            'is_stale': False,
+        },
+    )
+    return statement
+
+
+def get_statement(user, month):
+    """The stored statement for a closed month, regenerated only if missing or stale."""
+    month = month_start(month)
+    statement = PartnerStatement.objects.filter(user=user, month=month).first()
+    if (
+        statement is None or statement.is_stale
+        or not storage.exists(statement_path(user.pk, month, 'html'))
+        or not storage.exists(statement_path(user.pk, month, 'xlsx'))
+    ):
+        statement = generate_statement(user, month)
+    return statement
+
+
+def open_statement(statement, extension):
+    return storage.open(statement_path(statement.user_id, statement.month, extension), 'rb')
+
+
+def mark_statements_stale(vehicle_id, since):
+    """Flag statements of the vehicle's partners from ``since``'s month onward; balances carry forward."""
+    if since is None:
+        return 0
+    return PartnerStatement.objects.filter(
+        user__vehicles=vehicle_id, month__gte=month_start(since), is_stale=False,
+    ).update(is_stale=True)
+
+
+def mark_partner_statements_stale(user_ids=(), vehicle_ids=()):
+    """Flag every statement of users whose vehicle shares changed."""
+    return PartnerStatement.objects.filter(
+        Q(user_id__in=list(user_ids)) | Q(user__vehicles__in=list(vehicle_ids)), is_stale=False,
+    ).update(is_stale=True)
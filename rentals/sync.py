@@ -0,0 +1,132 @@
+import base64
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EMIPayment, Expense, Rental, TakenAmount, Tombstone
+
+
+# Rows saved within this many seconds may still sit in an open transaction,
+# so the feed waits for them to settle rather than step past them.
+SETTLE_SECONDS = getattr(settings, 'RENTALS_SYNC_SETTLE_SECONDS', 5)
+
+FEED_LIMIT = 500
+MAX_FEED_LIMIT = 2000
+
+# Order matters: it breaks ties between records changed at the same instant
+FEED_MODELS = {
+    'rental': Rental,
+    'expense': Expense,
+    'taken_amount': TakenAmount,
+    'emi_payment': EMIPayment,
+}
+KINDS = list(FEED_MODELS) + ['deleted']
+
+FEED_FIELDS = {
+    kind: [field.attname for field in model._meta.concrete_fields if field.name != 'customer_key']
+    for kind, model in FEED_MODELS.items()
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(position):
+    changed_at, kind_index, pk = position
+    raw = f"{changed_at.isoformat()}|{kind_index}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """The (timestamp, kind index, id) position a cursor points at, or None for the beginning."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        changed_at, kind_index, pk = raw.split('|')
+        changed_at = datetime.fromisoformat(changed_at)
+        kind_index, pk = int(kind_index), int(pk)
+    except ValueError:
+        raise InvalidCursor("Invalid cursor.")
+    if timezone.is_naive(changed_at) or not 0 <= kind_index < len(KINDS):
+        raise InvalidCursor("Invalid cursor.")
+    return changed_at, kind_index, pk
+
+
+def _after(position, kind_index, column):
+    """Keyset condition for rows of one kind that sort after ``position``."""
+    if position is None:
+        return Q()
+    changed_at, cursor_kind, pk = position
+    if kind_index > cursor_kind:
+        return Q(**{f'{column}__gte': changed_at})
+    if kind_index == cursor_kind:
+        return Q(**{f'{column}__gt': changed_at}) | Q(**{column: changed_at, 'pk__gt': pk})
+    return Q(**{f'{column}__gt': changed_at})
+
+
+def _changed(kind, queryset, column, position, until, limit):
+    kind_index = KINDS.index(kind)
+    rows = queryset.filter(_after(position, kind_index, column), **{f'{column}__lte': until}).order_by(column, 'pk')
+    return [(row[column], kind_index, row['id'], kind, row) for row in rows[:limit]]
+
+
+def change_feed(vehicle_ids, cursor=None, limit=FEED_LIMIT):
+    """
+    Records changed after ``cursor`` on the given vehicles (all of them if
+    None), oldest first and at most ``limit`` of them, with the cursor to
+    send next time.
+
+    Each model is read with a keyset query on its ``updated_at`` index and
+    the results merged, so a page costs a handful of indexed range scans
+    however large the tables are.
+    """
+    position = decode_cursor(cursor)
+    until = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+
+    candidates = []
+    for kind, model in FEED_MODELS.items():
+        queryset = model.objects.values(*FEED_FIELDS[kind])
+        if vehicle_ids is not None:
+            queryset = queryset.filter(vehicle_id__in=vehicle_ids)
+        candidates += _changed(kind, queryset, 'updated_at', position, until, limit + 1)
+
+    tombstones = Tombstone.objects.values('id', 'kind', 'object_id', 'deleted_at')
+    if vehicle_ids is not None:
+        tombstones = tombstones.filter(vehicle_id__in=vehicle_ids)
+    candidates += _changed('deleted', tombstones, 'deleted_at', position, until, limit + 1)
+
+    candidates.sort(key=lambda candidate: candidate[:3])
+    page = candidates[:limit]
+
+    changes = {kind: [] for kind in KINDS}
+    for _, _, _, kind, row in page:
+        changes[kind].append(row)
+
+    # A record moved to another vehicle leaves a tombstone on the old one;
+    # don't send it to clients that can still see the record.
+    live = set()
+    for kind, model in FEED_MODELS.items():
+        ids = [row['object_id'] for row in changes['deleted'] if row['kind'] == kind]
+        if ids:
+            queryset = model.objects.filter(pk__in=ids)
+            if vehicle_ids is not None:
+                queryset = queryset.filter(vehicle_id__in=vehicle_ids)
+            live.update((kind, pk) for pk in queryset.values_list('pk', flat=True))
+    changes['deleted'] = [
+        {'type': row['kind'], 'id': row['object_id']}
+        for row in changes['deleted'] if (row['kind'], row['object_id']) not in live
+    ]
+
+    return {
+        'changes': changes,
+        'cursor': encode_cursor(page[-1][:3]) if page else cursor,
+        'has_more': len(candidates) > limit,
+    }
+
+
+def record_tombstone(kind, object_id, vehicle_id):
+    Tombstone.objects.create(kind=kind, object_id=object_id, vehicle_id=vehicle_id)
@@ -1,3 +1,1210 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .analytics import compute_utilization, monthly_utilization
+from .archive import archive_before, restore_archive
+from .availability import AvailabilityIndex
+from .bulk import BulkActionError, bulk_action
+from .categories import ExpenseClassifier, backfill_categories, category_breakdown
+from .choices import active_partners
+from .concurrency import gather_queries
+from .consistency import check_ledgers
+from .customers import customer_profile
+from .emi import vehicle_emi_status
+from .forecast import compute_forecasts
+from .importer import import_sheet, import_workbook
+from .ledger import partner_ledger
+from .models import (
+    EMI, ArchivedExpense, ArchivedRental, EMIPayment, EMIReminder, Expense, ExpenseCategory, ExpenseCategoryRule,
+    MonthlySummary, PartnerStatement, Rental, RentalMileage, TakenAmount, Tombstone, UserProfile, Vehicle,
+    VehicleUtilization,
+)
+from .mileage import mileage_summary, refresh_mileage
+from .notifications import send_emi_reminders
+from .receivables import aging_report
+from .search import _search_ids_fallback, search_ids
+from .series import SeriesError, income_expense_series
+from .sheets import HeaderNotFound
+from .statements import get_statement
+from .sync import change_feed
+from .views import VEHICLE_DETAIL_WRITES, with_partner_stats
+
+
+# Keep tests away from the cache the running site uses
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': tempfile.mkdtemp(prefix='rentals-tests-cache-'),
+    }
+}
+
+
+def _writes(queries):
+    return [query['sql'] for query in queries if query['sql'].split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+
+
+class LoginWritesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('partner', password='secret')
+
+    def test_login_only_updates_last_login(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login'), {'username': 'partner', 'password': 'secret'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+
+        writes = _writes(queries)
+        self.assertEqual(len(writes), 1, writes)
+        self.assertIn('"last_login"', writes[0])
+        self.assertNotIn('django_session', ' '.join(query['sql'] for query in queries))
+
+    def test_page_views_do_not_write(self):
+        self.client.post(reverse('login'), {'username': 'partner', 'password': 'secret'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('dashboard'))
+        self.assertEqual(_writes(queries), [])
+
+    def test_user_save_skips_unchanged_profile(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(len(_writes(queries)), 1)
+
+    def test_user_save_writes_edited_profile(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        user.profile.can_import_data = True
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        writes = _writes(queries)
+        self.assertEqual(len(writes), 2, writes)
+        self.assertIn('"can_import_data"', writes[1])
+        self.assertNotIn('"can_manage_users"', writes[1])
+        self.assertTrue(UserProfile.objects.get(user=self.user).can_import_data)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('partner', password='secret')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.vehicle.partners.add(cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_removed_partner_loses_access_on_next_request(self):
+        url = reverse('vehicle_detail', args=[self.vehicle.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # A queryset delete sends no signals, like a change made by another worker
+        Vehicle.partners.through.objects.filter(user=self.user).delete()
+        self.assertRedirects(self.client.get(url), reverse('vehicle_list'), fetch_redirect_response=False)
+
+    def test_revoked_flag_applies_on_next_request(self):
+        UserProfile.objects.filter(user=self.user).update(can_import_data=True)
+        self.assertEqual(self.client.get(reverse('import_data')).status_code, 200)
+        UserProfile.objects.filter(user=self.user).update(can_import_data=False)
+        self.assertRedirects(self.client.get(reverse('import_data')), reverse('dashboard'), fetch_redirect_response=False)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SharedCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('partner', password='secret')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        # Due today, so the current month shows a warning until it is paid
+        EMI.objects.create(vehicle=cls.vehicle, amount=15000, due_day=date.today().day, warning_days=5)
+
+    def setUp(self):
+        cache.clear()
+        # A separate connection to the same cache stands in for another worker process
+        self.other_worker = caches.create_connection('default')
+
+    def test_deactivated_user_leaves_partner_choices_everywhere(self):
+        self.assertIn(self.user.pk, [partner.pk for partner in active_partners()])
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.other_worker.get('partner_choices'))
+        self.assertNotIn(self.user.pk, [partner.pk for partner in active_partners()])
+
+    def test_payment_clears_emi_warning_everywhere(self):
+        today = date.today()
+        self.assertTrue(vehicle_emi_status(self.vehicle)['emi_warning'])
+        EMIPayment.objects.create(vehicle=self.vehicle, amount=15000, date=today, month_paid_for=today.replace(day=1))
+        self.assertIsNone(self.other_worker.get(f'emi_status:{self.vehicle.pk}:{today.isoformat()}'))
+        self.assertFalse(vehicle_emi_status(self.vehicle)['emi_warning'])
+
+
+class EMIReminderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = date(2026, 3, 8)
+        for number in (1, 2):
+            vehicle = Vehicle.objects.create(name=f'Car {number}', registration_number=f'KL 10 A {number}')
+            EMI.objects.create(vehicle=vehicle, amount=15000, due_day=10, warning_days=5)
+            EMI.objects.filter(vehicle=vehicle).update(created_at='2026-01-01T00:00:00Z')
+            vehicle.partners.add(User.objects.create_user(f'partner{number}', email=f'p{number}@example.com'))
+
+    def test_reminders_are_logged_as_they_are_sent(self):
+        send = EmailMessage.send
+        calls = []
+
+        def send_then_die(message, *args, **kwargs):
+            calls.append(message)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return send(message, *args, **kwargs)
+
+        with mock.patch.object(EmailMessage, 'send', send_then_die), self.assertRaises(KeyboardInterrupt):
+            send_emi_reminders(today=self.today)
+        self.assertEqual(EMIReminder.objects.count(), 1)
+
+        self.assertEqual(send_emi_reminders(today=self.today), (1, 1, []))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(send_emi_reminders(today=self.today), (0, 0, []))
+
+    def test_failed_sends_are_reported_on_stderr(self):
+        send = EmailMessage.send
+
+        def refuse_first(message, *args, **kwargs):
+            if message.to == ['p1@example.com']:
+                raise SMTPException('mailbox unavailable')
+            return send(message, *args, **kwargs)
+
+        stdout, stderr = StringIO(), StringIO()
+        with mock.patch.object(EmailMessage, 'send', refuse_first), redirect_stdout(StringIO()) as process_stdout:
+            call_command('send_emi_reminders', '--date', self.today.isoformat(), stdout=stdout, stderr=stderr)
+
+        self.assertEqual(process_stdout.getvalue(), '')
+        self.assertIn('Sent 1 reminder emails', stdout.getvalue())
+        self.assertEqual(stderr.getvalue(), 'EMI reminder to p1@example.com failed: mailbox unavailable\n')
+        self.assertEqual(list(EMIReminder.objects.values_list('partner__username', flat=True)), ['partner2'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        rental = dict(vehicle=cls.vehicle, date_out=date(2022, 5, 1), days_of_rent=2, rent_per_day=1000)
+        cls.settled = Rental.objects.create(
+            customer_name='Settled', date_in=date(2022, 5, 3), total_amount_received=2000, starting_km=1000, ending_km=1300, **rental,
+        )
+        cls.still_out = Rental.objects.create(customer_name='Still out', total_amount_received=2000, **rental)
+        cls.owing = Rental.objects.create(customer_name='Owing', date_in=date(2022, 5, 3), total_amount_received=500, **rental)
+
+    def test_open_and_unpaid_rentals_stay_live(self):
+        result = archive_before(date(2024, 1, 1))
+
+        self.assertEqual((result['rentals'], result['kept_open']), (1, 2))
+        self.assertEqual(list(ArchivedRental.objects.values_list('pk', flat=True)), [self.settled.pk])
+        self.assertEqual(set(Rental.objects.values_list('pk', flat=True)), {self.still_out.pk, self.owing.pk})
+        summary = MonthlySummary.objects.get(vehicle=self.vehicle, month=date(2022, 5, 1))
+        self.assertEqual((summary.rental_count, summary.income), (1, 2000))
+
+    def test_archived_trips_keep_counting_towards_mileage(self):
+        # Leave the archived trip as the last one before the next
+        Rental.objects.filter(pk__in=[self.still_out.pk, self.owing.pk]).delete()
+        archive_before(date(2024, 1, 1))
+        summary = mileage_summary(self.vehicle.pk)
+        self.assertEqual((summary['km'], summary['trips'], summary['revenue_per_km']), (300, 1, 6.67))
+
+        later = Rental.objects.create(
+            vehicle=self.vehicle, customer_name='Later', date_out=date(2025, 1, 1), date_in=date(2025, 1, 2),
+            starting_km=1350, ending_km=1450, total_amount_received=1000,
+        )
+        self.assertEqual((later.mileage.gap_km, later.mileage.cumulative_km), (50, 400))
+        refresh_mileage(self.vehicle.pk)
+        later.mileage.refresh_from_db()
+        self.assertEqual(later.mileage.cumulative_km, 400)
+
+        restore_archive()
+        self.assertEqual(RentalMileage.objects.get(rental=self.settled.pk).trip_km, 300)
+        self.assertEqual(mileage_summary(self.vehicle.pk)['km'], 400)
+
+    def test_archived_records_leave_the_sync_feed(self):
+        fuel = Expense.objects.create(vehicle=self.vehicle, particulars='Diesel', amount=500, date=date(2022, 5, 2))
+        archive_before(date(2024, 1, 1))
+
+        self.assertEqual(
+            set(Tombstone.objects.values_list('kind', 'object_id')), {('rental', self.settled.pk), ('expense', fuel.pk)},
+        )
+        with mock.patch('rentals.sync.SETTLE_SECONDS', 0):
+            deleted = change_feed([self.vehicle.pk])['changes']['deleted']
+        self.assertCountEqual(deleted, [{'type': 'rental', 'id': self.settled.pk}, {'type': 'expense', 'id': fuel.pk}])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BulkActionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.partner = User.objects.create_user('partner')
+        cls.outsider = User.objects.create_user('outsider')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.vehicle.partners.add(cls.partner)
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        cls.first = Rental.objects.create(vehicle=cls.vehicle, customer_name='First', date_out=date(2026, 3, 1), date_in=date(2026, 3, 3))
+        cls.second = Rental.objects.create(vehicle=cls.vehicle, customer_name='Second', date_out=date(2026, 3, 5), date_in=date(2026, 3, 7))
+        Rental.objects.create(vehicle=cls.other, customer_name='Booked', date_out=date(2026, 3, 2), date_in=date(2026, 3, 4))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_delete_leaves_tombstones_for_sync_clients(self):
+        ids = [self.first.pk, self.second.pk]
+        self.assertEqual(bulk_action('rental', self.vehicle, ids, 'delete'), 2)
+        self.assertFalse(Rental.objects.filter(pk__in=ids).exists())
+        self.assertEqual(
+            set(Tombstone.objects.filter(kind='rental', vehicle_id=self.vehicle.pk).values_list('object_id', flat=True)),
+            set(ids),
+        )
+
+    def _delete_queries(self, kind, count):
+        vehicle = Vehicle.objects.create(name=f'{count} {kind}s', registration_number=f'KL 10 {kind[0].upper()} {count:04}')
+        if kind == 'rental':
+            rows = [Rental.objects.create(vehicle=vehicle, customer_name=f'C{day}', date_out=date(2026, 1, 1) + timedelta(days=2 * day), starting_km=day * 100, ending_km=day * 100 + 50) for day in range(count)]
+        else:
+            rows = [Expense.objects.create(vehicle=vehicle, particulars='Diesel', amount=100, date=date(2026, 1, 1) + timedelta(days=day)) for day in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(bulk_action(kind, vehicle, [row.pk for row in rows], 'delete'), count)
+        self.assertEqual(Tombstone.objects.filter(kind=kind, vehicle_id=vehicle.pk).count(), count)
+        return len(queries)
+
+    def test_delete_cost_does_not_grow_with_the_batch(self):
+        cache.clear()
+        for kind in ('rental', 'expense'):
+            self.assertEqual(self._delete_queries(kind, 5), self._delete_queries(kind, 40), kind)
+
+    def test_delete_refreshes_derived_data_once(self):
+        for vehicle in (self.vehicle, self.other):
+            VehicleUtilization.objects.create(vehicle=vehicle, month=date(2026, 3, 1), rented_days=4, available_days=31)
+        bulk_action('rental', self.vehicle, [self.first.pk, self.second.pk], 'delete')
+        self.assertFalse(VehicleUtilization.objects.filter(vehicle=self.vehicle).exists())
+        self.assertTrue(VehicleUtilization.objects.filter(vehicle=self.other).exists())
+        # Single deletes still go through the receivers
+        Rental.objects.get(vehicle=self.other).delete()
+        self.assertFalse(VehicleUtilization.objects.filter(vehicle=self.other).exists())
+
+    def test_shift_into_another_booking_is_refused(self):
+        with self.assertRaisesMessage(BulkActionError, 'overlap the booking by Second'):
+            bulk_action('rental', self.vehicle, [self.first.pk], 'shift', days=3)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.date_out, date(2026, 3, 1))
+
+    def test_shifting_rentals_together_is_allowed(self):
+        self.assertEqual(bulk_action('rental', self.vehicle, [self.first.pk, self.second.pk], 'shift', days=3), 2)
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.date_out, self.first.date_in), (date(2026, 3, 4), date(2026, 3, 6)))
+
+    def test_move_onto_a_booked_vehicle_is_refused(self):
+        with self.assertRaisesMessage(BulkActionError, 'overlap the booking by Booked'):
+            bulk_action('rental', self.vehicle, [self.first.pk], 'move', target_vehicle=self.other)
+        self.assertEqual(bulk_action('rental', self.vehicle, [self.second.pk], 'move', target_vehicle=self.other), 1)
+
+    def test_reassign_only_to_vehicle_partners(self):
+        with self.assertRaises(BulkActionError):
+            bulk_action('rental', self.vehicle, [self.first.pk], 'reassign', user=self.outsider)
+        self.assertEqual(bulk_action('rental', self.vehicle, [self.first.pk], 'reassign', user=self.partner), 1)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.user, self.partner)
+
+
+class ForecastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        # Three years that only spike in December
+        MonthlySummary.objects.bulk_create(
+            MonthlySummary(vehicle=cls.vehicle, month=date(year, month, 1), income=5000 if month == 12 else 1000)
+            for year in (2023, 2024, 2025, 2026) for month in range(1, 13)
+            if date(2023, 10, 1) <= date(year, month, 1) < date(2026, 10, 1)
+        )
+
+    def test_seasonal_peak_lands_in_its_calendar_month(self):
+        forecasts, months = compute_forecasts([self.vehicle.pk], today=date(2026, 10, 19))
+        income = dict(zip(months, forecasts[self.vehicle.pk][0]))
+
+        self.assertEqual(months[0], date(2026, 11, 1))
+        self.assertEqual(max(income, key=income.get), date(2026, 12, 1))
+        self.assertGreater(income[date(2026, 12, 1)], 4000)
+        self.assertLess(income[date(2027, 1, 1)], 2000)
+
+
+def _workbook(sheets):
+    """An uploaded .xlsx with one sheet per (title, rows) pair."""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets:
+        sheet = workbook.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+    stream = BytesIO()
+    workbook.save(stream)
+    return SimpleUploadedFile('import.xlsx', stream.getvalue())
+
+
+HEADER = ['DATE OUT', 'CUSTOMER', 'DAYS OF RENT', 'TOTAL AMOUNT RECEIVED', 'DATE', 'PARTICULARS', 'AMOUNT']
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bad_rows_are_reported_and_the_rest_imported(self):
+        rows = [['Bookings'], HEADER, []]
+        rows += [[date(2026, 3, day), f'Customer {day}', 2, 1234.56, date(2026, 3, day), 'Diesel', 600.5] for day in range(1, 6)]
+        # Too many days for the column; the expense on the same row is fine
+        rows[5][2] = 123456
+        writer = import_sheet(_workbook([('Sheet', rows)]), self.vehicle, batch_size=2)
+
+        self.assertEqual((writer.rentals, writer.expenses), (4, 5))
+        self.assertEqual(len(writer.errors), 1)
+        # Numbered as in the spreadsheet, blank rows included
+        self.assertTrue(writer.errors[0].startswith('Rental Row 6: days_of_rent'), writer.errors)
+        self.assertEqual(Rental.objects.filter(vehicle=self.vehicle).count(), 4)
+        self.assertEqual(Rental.objects.get(customer_name='Customer 1').total_amount_received, Decimal('1234.56'))
+
+    def test_missing_header_is_reported(self):
+        with self.assertRaises(HeaderNotFound):
+            import_sheet(_workbook([('Sheet', [['nothing here']])]), self.vehicle)
+
+    def test_workbook_sheets_go_to_their_vehicles(self):
+        upload = _workbook([
+            ('kl-10-bk-8469', [HEADER, [date(2026, 3, 1), 'Anu', 1, 1000, None, None, None]]),
+            ('KL10BK1000', [HEADER, [None, None, None, None, date(2026, 3, 2), 'Tyre', 900]]),
+            ('KL 99 X 1', [HEADER, [date(2026, 3, 1), 'Nobody', 1, 1000, None, None, None]]),
+        ])
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                Rental.objects.all().delete()
+                Expense.objects.all().delete()
+                summary = {row['sheet']: row for row in import_workbook(upload, workers=workers)}
+
+                self.assertEqual((summary['kl-10-bk-8469']['vehicle'], summary['kl-10-bk-8469']['rentals']), (self.vehicle, 1))
+                self.assertEqual((summary['KL10BK1000']['vehicle'], summary['KL10BK1000']['expenses']), (self.other, 1))
+                self.assertIsNone(summary['KL 99 X 1']['vehicle'])
+                self.assertEqual(Rental.objects.get().vehicle, self.vehicle)
+                self.assertEqual(Expense.objects.get().vehicle, self.other)
+
+
+    def test_uploads_are_parsed_in_the_request_process(self):
+        upload = _workbook([
+            ('KL 10 BK 8469', [HEADER, [date(2026, 3, 1), 'Anu', 1, 1000, None, None, None]]),
+            ('KL 10 BK 1000', [HEADER, [date(2026, 3, 1), 'Biju', 1, 1000, None, None, None]]),
+        ])
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        with mock.patch('rentals.importer.ProcessPoolExecutor') as pool:
+            self.client.post(reverse('import_data'), {'excel_file': upload, 'multi_sheet': 'on'})
+        pool.assert_not_called()
+        self.assertEqual(Rental.objects.count(), 2)
+
+    def test_command_parses_sheets_in_workers(self):
+        upload = _workbook([
+            ('KL 10 BK 8469', [HEADER, [date(2026, 3, 1), 'Anu', 1, 1000, None, None, None], [date(2026, 3, 2), 'Bad', 123456, 0, None, None, None]]),
+            ('KL 10 BK 1000', [HEADER, [None, None, None, None, date(2026, 3, 2), 'Tyre', 900]]),
+        ])
+        with tempfile.NamedTemporaryFile(suffix='.xlsx') as f:
+            f.write(upload.read())
+            f.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_workbook', f.name, '--workers', '2', stdout=out, stderr=err)
+        self.assertIn('Imported 1 rentals and 1 expenses from 2 sheets', out.getvalue())
+        self.assertIn('KL 10 BK 8469: Rental Row 3: days_of_rent', err.getvalue())
+
+@override_settings(CACHES=TEST_CACHES)
+class AvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='secret')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        cls.booked = Rental.objects.create(
+            vehicle=cls.vehicle, customer_name='Booked', date_out=date(2026, 3, 2), time_out=time(9),
+            date_in=date(2026, 3, 4), time_in=time(18),
+        )
+        cls.still_out = Rental.objects.create(vehicle=cls.other, customer_name='Still out', date_out=date(2026, 3, 1))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_index_finds_overlaps_only(self):
+        index = AvailabilityIndex.for_window(datetime(2026, 3, 1), datetime(2026, 3, 10))
+        self.assertEqual(
+            [clash['rental_id'] for clash in index.conflicts(self.vehicle.pk, datetime(2026, 3, 4, 12), datetime(2026, 3, 5))],
+            [self.booked.pk],
+        )
+        # Ends as the booking starts, or starts as it ends
+        self.assertFalse(index.is_busy(self.vehicle.pk, datetime(2026, 3, 1), datetime(2026, 3, 2, 9)))
+        self.assertFalse(index.is_busy(self.vehicle.pk, datetime(2026, 3, 4, 18), datetime(2026, 3, 5)))
+        # A rental not returned yet keeps the vehicle busy from then on
+        self.assertEqual(index.conflicts(self.other.pk, datetime(2026, 3, 9), datetime(2026, 3, 10))[0]['end'], None)
+
+    def test_overlapping_booking_is_rejected(self):
+        url = reverse('rental_create', args=[self.vehicle.pk])
+        booking = {'date_out': '2026-03-03', 'date_in': '2026-03-05', 'customer_name': 'Clash', 'days_of_rent': 2,
+                   'rent_per_day': 1000, 'advance_amount': 0, 'total_amount_received': 0, 'discounted_amount': 0}
+        response = self.client.post(url, booking)
+        self.assertContains(response, 'already booked by Booked')
+        self.assertFalse(Rental.objects.filter(customer_name='Clash').exists())
+
+        response = self.client.post(url, booking | {'date_out': '2026-03-05', 'date_in': '2026-03-06'})
+        self.assertRedirects(response, reverse('vehicle_detail', args=[self.vehicle.pk]), fetch_redirect_response=False)
+
+    def test_window_accepts_timezone_aware_bounds(self):
+        response = self.client.get(reverse('availability'), {
+            'start': '2026-03-03T10:00:00+00:00', 'end': '2026-03-03T12:00:00+00:00', 'format': 'json',
+        })
+        self.assertEqual(response.status_code, 200)
+        available = {row['id']: row['available'] for row in response.json()['vehicles']}
+        self.assertEqual(available, {self.vehicle.pk: False, self.other.pk: False})
+
+    def test_invalid_window_is_a_bad_request(self):
+        params = {'start': '2026-03-03T12:00', 'end': '2026-03-03T10:00'}
+        self.assertEqual(self.client.get(reverse('availability'), params).status_code, 400)
+        self.assertEqual(self.client.get(reverse('availability'), params | {'format': 'json'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('availability'), {'start': 'soon'}).status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UtilizationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='secret')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        # Out at 10:00 on 30 March, back some time on 2 April
+        Rental.objects.create(vehicle=cls.vehicle, customer_name='Anu', date_out=date(2026, 3, 30), time_out=time(10), date_in=date(2026, 4, 2))
+        cls.months = [date(2026, 3, 1), date(2026, 4, 1)]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rental_is_split_across_the_months_it_covers(self):
+        stats = compute_utilization([self.vehicle.pk], self.months, today=date(2026, 10, 19))[self.vehicle.pk]
+        march, april = stats[date(2026, 3, 1)], stats[date(2026, 4, 1)]
+
+        self.assertEqual((march['rented_days'], march['available_days']), (1.58, 31))
+        self.assertEqual((april['rented_days'], april['available_days']), (2, 30))
+        # The trip belongs to the month it started in
+        self.assertEqual((march['trip_count'], march['trip_days'], april['trip_count']), (1, 3.58, 0))
+
+    def test_closed_months_are_stored_and_invalidated_by_edits(self):
+        first, last = self.months
+        monthly_utilization([self.vehicle.pk], first, last, today=date(2026, 10, 19))
+        self.assertEqual(VehicleUtilization.objects.filter(vehicle=self.vehicle).count(), 2)
+
+        Rental.objects.create(vehicle=self.vehicle, customer_name='Babu', date_out=date(2026, 4, 10), date_in=date(2026, 4, 11))
+        self.assertEqual(list(VehicleUtilization.objects.filter(vehicle=self.vehicle).values_list('month', flat=True)), [first])
+
+        april = monthly_utilization([self.vehicle.pk], first, last, today=date(2026, 10, 19))[self.vehicle.pk][1]
+        self.assertEqual((april['rented_days'], april['trip_count']), (4, 1))
+
+    def test_out_of_range_years_are_clamped(self):
+        self.client.force_login(self.admin)
+        for year in ('0', '99999', 'soon'):
+            with self.subTest(year=year):
+                response = self.client.get(reverse('fleet_utilization'), {'year': year})
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(response.context['selected_year'], response.context['available_years'])
+
+
+class MileageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        trips = [(1, 1000, 1200), (5, 1250, 1400), (9, 1390, 1380)]
+        cls.first, cls.gap, cls.backwards = [
+            Rental.objects.create(vehicle=cls.vehicle, customer_name=f'Trip {day}', date_out=date(2026, 3, day), starting_km=start, ending_km=end)
+            for day, start, end in trips
+        ]
+
+    def _records(self):
+        return {
+            record.rental_id: (record.trip_km, record.gap_km, record.cumulative_km, record.odometer_backwards, record.has_gap)
+            for record in RentalMileage.objects.filter(vehicle=self.vehicle)
+        }
+
+    def test_trips_gaps_and_backwards_readings(self):
+        self.assertEqual(self._records(), {
+            self.first.pk: (200, None, 200, False, False),
+            self.gap.pk: (150, 50, 350, False, True),
+            # Started below the last reading and ended below its own start
+            self.backwards.pk: (-10, -10, 350, True, False),
+        })
+
+    def test_edit_updates_records_in_place(self):
+        self.backwards.ending_km = 1500
+        self.backwards.save()
+        self.gap.starting_km = 1200
+        self.gap.save()
+
+        records = self._records()
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[self.gap.pk], (200, 0, 400, False, False))
+        self.assertEqual(records[self.backwards.pk], (110, -10, 510, True, False))
+
+    def test_refresh_from_a_date_builds_on_earlier_records(self):
+        RentalMileage.objects.filter(rental__in=[self.gap, self.backwards]).delete()
+        self.assertEqual(refresh_mileage(self.vehicle.pk, since=date(2026, 3, 5)), 2)
+        self.assertEqual(self._records()[self.backwards.pk], (-10, -10, 350, True, False))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        # Entered out of date order
+        cls.late = Rental.objects.create(vehicle=cls.other, customer_name='Biju', destination='Kochi', date_out=date(2026, 3, 10), date_in=date(2026, 3, 11))
+        cls.fuel = Expense.objects.create(vehicle=cls.vehicle, particulars='Diesel', place='Kochi', amount=500, date=date(2026, 3, 5))
+        cls.early = Rental.objects.create(vehicle=cls.vehicle, customer_name='Anitha', destination='Kochi', date_out=date(2026, 3, 1), date_in=date(2026, 3, 2))
+
+    def test_results_are_newest_first_on_every_backend(self):
+        expected = [('rental', self.late.pk), ('expense', self.fuel.pk), ('rental', self.early.pk)]
+        self.assertEqual(search_ids('koch'), expected)
+        self.assertEqual(_search_ids_fallback('koch', None, 50), expected)
+        self.assertEqual(search_ids('koch', limit=2), expected[:2])
+
+    def test_results_are_limited_to_the_given_vehicles(self):
+        self.assertEqual(search_ids('kochi', vehicle_ids=[self.other.pk]), [('rental', self.late.pk)])
+        self.assertEqual(search_ids('biju', vehicle_ids=[self.vehicle.pk]), [])
+        self.assertEqual(search_ids('kochi', vehicle_ids=[]), [])
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        self.assertEqual(search_ids('anit'), [('rental', self.early.pk)])
+        self.early.customer_name = 'Sreeja'
+        self.early.save()
+        self.assertEqual(search_ids('anit'), [])
+        self.assertEqual(search_ids('sree'), [('rental', self.early.pk)])
+
+        self.fuel.delete()
+        self.assertEqual(search_ids('diesel'), [])
+
+    def test_archived_records_leave_the_index(self):
+        archive_before(date(2026, 3, 8))
+        self.assertEqual(search_ids('kochi'), [('rental', self.late.pk)])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CustomerProfileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='secret')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        trip = dict(customer_name='Anu', contact_no='98470 12345', days_of_rent=2, rent_per_day=1000)
+        Rental.objects.create(vehicle=cls.vehicle, date_out=date(2022, 5, 1), date_in=date(2022, 5, 3), total_amount_received=2000, **trip)
+        cls.live = Rental.objects.create(vehicle=cls.other, date_out=date(2026, 3, 1), date_in=date(2026, 3, 3), total_amount_received=1500, **trip)
+        archive_before(date(2024, 1, 1))
+
+    def test_archived_trips_count_towards_the_profile(self):
+        profile = customer_profile(self.live.customer_key)
+        self.assertEqual((profile['trip_count'], profile['lifetime_revenue'], profile['outstanding']), (2, 3500, 500))
+        self.assertEqual((profile['last_trip'], profile['last_vehicle']), (date(2026, 3, 1), self.other))
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('customer_detail', args=[self.live.customer_key]))
+        self.assertEqual([rental.date_out for rental in response.context['rentals']], [date(2026, 3, 1), date(2022, 5, 1)])
+
+    def test_customer_with_only_archived_trips(self):
+        self.live.delete()
+        profile = customer_profile(self.live.customer_key)
+        self.assertEqual((profile['trip_count'], profile['lifetime_revenue'], profile['last_vehicle']), (1, 2000, self.vehicle))
+        self.assertEqual(profile['contact_no'], '98470 12345')
+        self.assertIsNone(customer_profile(self.live.customer_key, vehicle_ids=[self.other.pk]))
+
+
+class ConcurrentQueriesTests(SimpleTestCase):
+    def test_writing_queries_stay_on_the_request_thread(self):
+        queries = {name: threading.get_ident for name in ('rentals', 'expenses', 'utilization')}
+        request_thread = threading.get_ident()
+        threads = async_to_sync(gather_queries)(queries, writes=VEHICLE_DETAIL_WRITES)
+
+        self.assertEqual(list(threads), ['rentals', 'expenses', 'utilization'])
+        self.assertEqual(threads['utilization'], request_thread)
+        self.assertNotIn(request_thread, (threads['rentals'], threads['expenses']))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PartnerStatementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.partner = User.objects.create_user('partner', password='secret')
+        cls.other_partner = User.objects.create_user('other')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.vehicle.partners.add(cls.partner, cls.other_partner)
+        cls.month = date(2026, 3, 1)
+
+    def setUp(self):
+        # Rendered statements go to a scratch directory, not the site's
+        patcher = mock.patch('rentals.statements.storage', FileSystemStorage(location=tempfile.mkdtemp(prefix='rentals-tests-statements-')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _statements(self):
+        return [get_statement(user, self.month) for user in (self.partner, self.other_partner)]
+
+    def _monthly(self, year):
+        self.client.force_login(self.partner)
+        response = self.client.get(reverse('user_detail', args=[self.partner.pk]), {'year': year})
+        return {row['month_number']: (row['income'], row['expense'], row['taken']) for row in response.context['monthly_data']}
+
+    def test_closed_months_are_served_from_stored_statements(self):
+        rental = Rental.objects.create(vehicle=self.vehicle, customer_name='Anu', date_out=self.month, date_in=date(2026, 3, 2), total_amount_received=3000)
+        Expense.objects.create(vehicle=self.vehicle, particulars='Tyre', amount=1000, date=date(2026, 3, 9))
+        TakenAmount.objects.create(user=self.partner, vehicle=self.vehicle, amount=200, date=date(2026, 3, 20))
+
+        with mock.patch('rentals.statements.date') as statements_date, mock.patch('rentals.views.date') as views_date:
+            for mocked in (statements_date, views_date):
+                mocked.today.return_value = date(2026, 10, 19)
+                mocked.side_effect = date
+            self.assertEqual(self._monthly(2026), {3: (1500, 500, 200)})
+            # March to September, the closed months since the first record
+            self.assertEqual(PartnerStatement.objects.filter(user=self.partner).count(), 7)
+
+            # Only the stored figures are read back for a closed month
+            PartnerStatement.objects.filter(user=self.partner, month=self.month).update(income=1)
+            self.assertEqual(self._monthly(2026), {3: (1, 500, 200)})
+
+            # Until a back-dated edit marks it stale
+            rental.total_amount_received = 4000
+            rental.save()
+            self.assertEqual(self._monthly(2026), {3: (2000, 500, 200)})
+
+    def test_open_month_is_computed_live(self):
+        today = date.today()
+        Rental.objects.create(vehicle=self.vehicle, customer_name='Anu', date_out=today, date_in=today, total_amount_received=3000)
+        self.assertEqual(self._monthly(today.year)[today.month], (1500, 0, 0))
+        self.assertFalse(PartnerStatement.objects.filter(month=today.replace(day=1)).exists())
+
+    def test_clearing_a_vehicles_partners_marks_their_statements_stale(self):
+        statements = self._statements()
+        self.vehicle.partners.clear()
+        for statement in statements:
+            statement.refresh_from_db()
+            self.assertTrue(statement.is_stale)
+
+    def test_clearing_a_partners_vehicles_marks_their_statements_stale(self):
+        statements = self._statements()
+        self.partner.vehicles.clear()
+        for statement in statements:
+            statement.refresh_from_db()
+            self.assertTrue(statement.is_stale)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SyncFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.partner = User.objects.create_user('partner', password='secret')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        cls.vehicle.partners.add(cls.partner)
+        cls.rentals = [
+            Rental.objects.create(vehicle=cls.vehicle, customer_name=f'Customer {day}', date_out=date(2026, 3, day), date_in=date(2026, 3, day))
+            for day in range(1, 6)
+        ]
+        cls.expenses = [
+            Expense.objects.create(vehicle=cls.vehicle, particulars=f'Diesel {day}', amount=500, date=date(2026, 3, day))
+            for day in range(1, 4)
+        ]
+        # Several records changed at the same instant, across kinds
+        cls.earlier = timezone.now() - timedelta(hours=2)
+        Rental.objects.update(updated_at=cls.earlier)
+        Expense.objects.update(updated_at=cls.earlier)
+        Rental.objects.filter(pk=cls.rentals[0].pk).update(updated_at=cls.earlier + timedelta(minutes=5))
+
+    def _pages(self, vehicle_ids, cursor=None, limit=3):
+        seen = []
+        while True:
+            feed = change_feed(vehicle_ids, cursor=cursor, limit=limit)
+            seen += [(kind, row['id']) for kind in ('rental', 'expense') for row in feed['changes'][kind]]
+            seen += [('deleted', row['id']) for row in feed['changes']['deleted']]
+            cursor = feed['cursor']
+            if not feed['has_more']:
+                return seen, cursor
+
+    def test_pages_cover_every_change_once(self):
+        seen, cursor = self._pages(None)
+        expected = [('rental', rental.pk) for rental in self.rentals] + [('expense', expense.pk) for expense in self.expenses]
+        self.assertCountEqual(seen, expected)
+        self.assertEqual(self._pages(None, cursor)[0], [])
+        # Oldest first: the latest change is the one left for the next page
+        feed = change_feed(None, limit=len(expected) - 1)
+        self.assertTrue(feed['has_more'])
+        self.assertNotIn(self.rentals[0].pk, [row['id'] for row in feed['changes']['rental']])
+
+    def test_recent_changes_wait_to_settle(self):
+        _, cursor = self._pages(None)
+        rental = self.rentals[1]
+        rental.customer_name = 'Renamed'
+        rental.save()
+        self.assertEqual(self._pages(None, cursor)[0], [])
+        with mock.patch('rentals.sync.SETTLE_SECONDS', 0):
+            self.assertEqual(self._pages(None, cursor)[0], [('rental', rental.pk)])
+
+    def test_deleted_and_moved_records_leave_tombstones(self):
+        _, cursor = self._pages(None)
+        deleted, moved = self.rentals[1], self.rentals[2]
+        deleted_pk = deleted.pk
+        deleted.delete()
+        moved.vehicle = self.other
+        moved.save()
+
+        with mock.patch('rentals.sync.SETTLE_SECONDS', 0):
+            # A client of the old vehicle drops both
+            self.assertCountEqual(self._pages([self.vehicle.pk], cursor)[0], [('deleted', deleted_pk), ('deleted', moved.pk)])
+            # One that sees both vehicles keeps the moved rental
+            self.assertCountEqual(self._pages(None, cursor)[0], [('deleted', deleted_pk), ('rental', moved.pk)])
+
+    def test_bad_cursor_and_foreign_vehicle_are_refused(self):
+        self.client.force_login(self.partner)
+        url = reverse('sync_changes')
+        self.assertEqual(self.client.get(url, {'cursor': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'vehicle': self.other.pk}).status_code, 403)
+
+        feed = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual((feed['vehicles'], feed['has_more']), ([self.vehicle.pk], True))
+        self.assertEqual(sum(len(rows) for rows in feed['changes'].values()), 2)
+
+
+class RentalBalanceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.partner = User.objects.create_user('partner')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        rental = dict(date_out=date(2026, 3, 1), days_of_rent=Decimal('2.5'), rent_per_day=1000)
+        cls.owing = Rental.objects.create(vehicle=cls.vehicle, user=cls.partner, customer_name='Owing', total_amount_received=1000, discounted_amount=500, **rental)
+        cls.paid = Rental.objects.create(vehicle=cls.vehicle, customer_name='Paid', total_amount_received=2000, discounted_amount=500, **rental)
+        cls.overpaid = Rental.objects.create(vehicle=cls.other, customer_name='Overpaid', total_amount_received=3000, **rental)
+        cls.short = Rental.objects.create(vehicle=cls.other, user=cls.partner, customer_name='Short', total_amount_received=2400, **rental)
+
+    def test_sql_balance_matches_the_model(self):
+        for rental in Rental.objects.with_balance():
+            with self.subTest(rental=rental.customer_name):
+                self.assertEqual((rental.rent_total, rental.outstanding), (rental.total_rent, rental.balance))
+
+    def test_outstanding_rentals_and_totals(self):
+        self.assertCountEqual(Rental.objects.outstanding(), [self.owing, self.short])
+        self.assertEqual(Rental.objects.outstanding_total(), 1100)
+        self.assertEqual(Rental.objects.filter(vehicle=self.other).outstanding_total(), 100)
+        self.assertEqual(
+            [(row['vehicle_id'], row['rental_count'], row['outstanding']) for row in Rental.objects.outstanding_by('vehicle_id')],
+            [(self.vehicle.pk, 1, 1000), (self.other.pk, 1, 100)],
+        )
+        self.assertEqual(list(Rental.objects.outstanding_by('user_id').values_list('user_id', 'outstanding')), [(self.partner.pk, 1100)])
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_vehicle_page_adds_archived_balances(self):
+        cache.clear()
+        now = timezone.now()
+        ArchivedRental.objects.create(
+            vehicle=self.vehicle, customer_name='Archived', date_out=date(2022, 5, 1), days_of_rent=1, rent_per_day=1000,
+            total_amount_received=700, created_at=now, updated_at=now,
+        )
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        response = self.client.get(reverse('vehicle_detail', args=[self.vehicle.pk]))
+        self.assertEqual(response.context['outstanding'], 1300)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReceivablesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.partner = User.objects.create_user('partner', password='secret', first_name='Anil')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        cls.other.partners.add(cls.partner)
+        rental = dict(days_of_rent=1, rent_per_day=1000)
+        cls.recent = Rental.objects.create(vehicle=cls.vehicle, user=cls.partner, customer_name='Recent', date_out=date(2026, 6, 20), date_in=date(2026, 6, 25), days_of_rent=2, rent_per_day=1000, total_amount_received=500)
+        cls.still_out = Rental.objects.create(vehicle=cls.vehicle, user=cls.partner, customer_name='Still out', date_out=date(2026, 3, 1), **rental)
+        cls.unassigned = Rental.objects.create(vehicle=cls.vehicle, customer_name='Unassigned', date_out=date(2026, 4, 20), date_in=date(2026, 5, 10), total_amount_received=200, **rental)
+        Rental.objects.create(vehicle=cls.vehicle, customer_name='Paid', date_out=date(2026, 6, 1), date_in=date(2026, 6, 2), total_amount_received=1000, **rental)
+        now = timezone.now()
+        cls.archived = ArchivedRental.objects.create(
+            vehicle=cls.other, user=cls.partner, customer_name='Archived', date_out=date(2025, 12, 1), date_in=date(2025, 12, 2),
+            days_of_rent=1, rent_per_day=600, created_at=now, updated_at=now,
+        )
+        cls.today = date(2026, 6, 30)
+
+    def test_balances_are_bucketed_by_age(self):
+        report = aging_report(today=self.today)
+        self.assertEqual(report['totals']['total'], 3900)
+        self.assertEqual(report['totals']['rental_count'], 4)
+        self.assertEqual(report['totals']['buckets'], {'0-30': 1500, '31-60': 800, '61-90': 0, '90+': 1600})
+        self.assertEqual([(row['name'], row['total'], row['rental_count']) for row in report['vehicles']], [('Innova', 3300, 3), ('Ertiga', 600, 1)])
+        self.assertEqual([(row['name'], row['total']) for row in report['partners']], [('Anil', 3100), ('Unassigned', 800)])
+
+    def test_date_out_basis_ages_from_departure(self):
+        report = aging_report(basis='date_out', today=self.today)
+        self.assertEqual(report['totals']['buckets'], {'0-30': 1500, '31-60': 0, '61-90': 800, '90+': 1600})
+
+    def test_report_is_scoped_to_visible_vehicles(self):
+        self.client.force_login(self.partner)
+        response = self.client.get(reverse('receivables'), {'format': 'json'})
+        self.assertEqual(Decimal(response.json()['totals']['total']), 600)
+
+    def test_csv_lists_each_outstanding_rental(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        with mock.patch('rentals.receivables.date') as mocked:
+            mocked.today.return_value = self.today
+            response = self.client.get(reverse('receivables_csv'))
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [line.split(',') for line in lines[1:]]
+        self.assertEqual(
+            [(int(row[0]), Decimal(row[-3]), row[-1]) for row in rows],
+            [(self.still_out.pk, 1000, '90+'), (self.unassigned.pk, 800, '31-60'), (self.recent.pk, 1500, '0-30'), (self.archived.pk, 600, '90+')],
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExpenseCategoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.fuel = ExpenseCategory.objects.create(name='Fuel', sort_order=0)
+        cls.repairs = ExpenseCategory.objects.create(name='Repairs', sort_order=1)
+        ExpenseCategoryRule.objects.create(category=cls.fuel, pattern='diesel', priority=10)
+        ExpenseCategoryRule.objects.create(category=cls.repairs, pattern='service', priority=20)
+        ExpenseCategoryRule.objects.create(category=cls.repairs, match_type=ExpenseCategoryRule.MATCH_REGEX, pattern=r'oil\s+change', priority=30)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rules_match_whole_words_in_priority_order(self):
+        classify = ExpenseClassifier()
+        self.assertEqual(classify('DIESEL  Kochi'), self.fuel.pk)
+        self.assertEqual(classify('Diesel after service'), self.fuel.pk)
+        self.assertEqual(classify('Engine oil   change'), self.repairs.pk)
+        self.assertIsNone(classify('Servicestation tea'))
+        self.assertIsNone(classify(None))
+
+    def test_bad_patterns_are_skipped(self):
+        classify = ExpenseClassifier(rules=[('(', self.fuel.pk), (r'\btoll\b', self.repairs.pk)])
+        self.assertEqual(classify('Toll plaza'), self.repairs.pk)
+
+    def test_saving_classifies_but_keeps_a_picked_category(self):
+        expense = Expense.objects.create(vehicle=self.vehicle, particulars='Diesel', amount=3000, date=date(2026, 3, 1))
+        self.assertEqual(expense.category_id, self.fuel.pk)
+
+        expense.category = self.repairs
+        expense.save()
+        expense.refresh_from_db()
+        self.assertEqual(expense.category_id, self.repairs.pk)
+
+        # Editing the particulars reclassifies
+        expense = Expense.objects.get(pk=expense.pk)
+        expense.particulars = 'Full service'
+        expense.category = self.fuel
+        expense.save()
+        self.assertEqual(expense.category_id, self.repairs.pk)
+
+    def test_rule_changes_apply_to_the_next_save(self):
+        self.assertIsNone(ExpenseClassifier()('Tyre rotation'))
+        ExpenseCategoryRule.objects.create(category=self.repairs, pattern='tyre', priority=40)
+        expense = Expense.objects.create(vehicle=self.vehicle, particulars='Tyre rotation', amount=500, date=date(2026, 3, 1))
+        self.assertEqual(expense.category_id, self.repairs.pk)
+
+    def test_backfill_updates_one_batch_at_a_time(self):
+        for particulars in ('Diesel', 'Service', 'Snacks', 'Diesel top-up', 'Oil change'):
+            Expense.objects.create(vehicle=self.vehicle, particulars=particulars, amount=100, date=date(2026, 3, 1))
+        Expense.objects.update(category=None)
+
+        self.assertEqual(backfill_categories(batch_size=2), (5, 4))
+        self.assertEqual(
+            dict(Expense.objects.values_list('particulars', 'category_id')),
+            {'Diesel': self.fuel.pk, 'Service': self.repairs.pk, 'Snacks': None, 'Diesel top-up': self.fuel.pk, 'Oil change': self.repairs.pk},
+        )
+        # Only uncategorized expenses are looked at again
+        self.assertEqual(backfill_categories(batch_size=2), (1, 0))
+
+    def test_breakdown_rolls_up_recent_months_and_the_archive(self):
+        Expense.objects.create(vehicle=self.vehicle, particulars='Diesel', amount=3000, date=date(2026, 3, 5))
+        Expense.objects.create(vehicle=self.vehicle, particulars='Diesel', amount=2000, date=date(2026, 1, 5))
+        Expense.objects.create(vehicle=self.vehicle, particulars='Snacks', amount=100, date=date(2026, 2, 5))
+        Expense.objects.create(vehicle=self.vehicle, particulars='Service', amount=4000, date=date(2025, 6, 5))
+        ArchivedExpense.objects.create(
+            vehicle=self.vehicle, particulars='Diesel', amount=1000, date=date(2024, 5, 1), category=self.fuel,
+            created_at=timezone.now(), updated_at=timezone.now(),
+        )
+
+        breakdown = category_breakdown(Expense.objects.all(), ArchivedExpense.objects.all(), months=3, today=date(2026, 3, 20))
+        self.assertEqual(breakdown['months'], [date(2026, 1, 1), date(2026, 2, 1), date(2026, 3, 1)])
+        self.assertEqual(
+            [(row['name'], row['monthly'], row['total']) for row in breakdown['rows']],
+            [('Fuel', [2000, 0, 3000], 6000), ('Repairs', [0, 0, 0], 4000), ('Uncategorized', [0, 100, 0], 100)],
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PartnerLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.anil = User.objects.create_user('anil', password='secret')
+        cls.bina = User.objects.create_user('bina')
+        cls.innova = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.ertiga = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        cls.innova.partners.add(cls.anil, cls.bina)
+        cls.ertiga.partners.add(cls.anil)
+
+        MonthlySummary.objects.create(vehicle=cls.innova, month=date(2025, 12, 1), income=4000, expense=1000)
+        Rental.objects.create(vehicle=cls.innova, customer_name='Anu', date_out=date(2026, 1, 10), total_amount_received=3000)
+        Expense.objects.create(vehicle=cls.innova, particulars='Diesel', amount=1000, date=date(2026, 1, 15))
+        Rental.objects.create(vehicle=cls.ertiga, customer_name='Biju', date_out=date(2026, 2, 1), total_amount_received=2000)
+        TakenAmount.objects.create(user=cls.anil, vehicle=cls.innova, amount=500, date=date(2026, 2, 5))
+        # Not a partner of this vehicle, so not on the ledger
+        TakenAmount.objects.create(user=cls.bina, vehicle=cls.ertiga, amount=700, date=date(2026, 2, 5))
+
+    def _rows(self, *args, **kwargs):
+        return [
+            (row['username'], row['vehicle_name'], row['month'], row['income'], row['expense'], row['taken'], row['vehicle_balance'], row['balance'])
+            for row in partner_ledger(*args, **kwargs)
+        ]
+
+    def test_shares_and_running_balances(self):
+        self.assertEqual(self._rows(), [
+            ('anil', 'Innova', date(2025, 12, 1), 2000, 500, 0, 1500, 1500),
+            ('anil', 'Innova', date(2026, 1, 1), 1500, 500, 0, 2500, 2500),
+            # The fleet balance for a month counts every vehicle's row in it
+            ('anil', 'Ertiga', date(2026, 2, 1), 2000, 0, 0, 2000, 4000),
+            ('anil', 'Innova', date(2026, 2, 1), 0, 0, 500, 2000, 4000),
+            ('bina', 'Innova', date(2025, 12, 1), 2000, 500, 0, 1500, 1500),
+            ('bina', 'Innova', date(2026, 1, 1), 1500, 500, 0, 2500, 2500),
+        ])
+
+    def test_range_limits_rows_but_not_balances(self):
+        self.assertEqual(self._rows(date(2026, 2, 1), date(2026, 3, 1), user_id=self.anil.pk), [
+            ('anil', 'Ertiga', date(2026, 2, 1), 2000, 0, 0, 2000, 4000),
+            ('anil', 'Innova', date(2026, 2, 1), 0, 0, 500, 2000, 4000),
+        ])
+
+    def test_rows_are_streamed_in_chunks(self):
+        self.assertEqual(len(list(partner_ledger(chunk_size=1))), 6)
+
+    def test_only_superusers_see_the_fleet_ledger(self):
+        self.client.force_login(self.anil)
+        self.assertRedirects(self.client.get(reverse('fleet_ledger')), reverse('dashboard'), fetch_redirect_response=False)
+
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        response = self.client.get(reverse('fleet_ledger'), {'year': 2026, 'partner': self.bina.pk})
+        self.assertEqual(response.context['totals'], {'income': 1500, 'expense': 500, 'profit': 1000, 'taken': 0})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UserListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.admin = User.objects.create_superuser('admin', password='secret')
+        cls.anil = User.objects.create_user('anil', password='secret', first_name='Anil', email='anil@example.com')
+        cls.bina = User.objects.create_user('bina', first_name='Bina')
+        cls.outsider = User.objects.create_user('outsider', is_active=False)
+        cls.innova = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.ertiga = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        cls.innova.partners.add(cls.anil, cls.bina)
+        cls.ertiga.partners.add(cls.anil)
+
+        MonthlySummary.objects.create(vehicle=cls.innova, month=date(2025, 12, 1), income=4000, expense=1000)
+        Rental.objects.create(vehicle=cls.innova, customer_name='Anu', date_out=date(2026, 1, 10), total_amount_received=3000)
+        Expense.objects.create(vehicle=cls.innova, user=cls.bina, particulars='Diesel', amount=1000, date=date(2026, 1, 15))
+        Rental.objects.create(vehicle=cls.ertiga, customer_name='Biju', date_out=date(2026, 2, 1), total_amount_received=2000)
+        TakenAmount.objects.create(user=cls.anil, vehicle=cls.innova, amount=500, date=date(2026, 2, 5))
+
+    def _users(self, **params):
+        return self.client.get(reverse('user_list'), params).context['users']
+
+    def test_rows_carry_partner_stats(self):
+        users = with_partner_stats(User.objects.filter(pk__in=[self.anil.pk, self.bina.pk, self.outsider.pk]))
+        stats = {user.username: (user.vehicle_count, user.profit_share, user.taken_total, user.balance) for user in users}
+        self.assertEqual(stats, {'anil': (2, 4500, 500, 4000), 'bina': (1, 2500, 0, 2500), 'outsider': (0, 0, 0, 0)})
+        # Agrees with the ledger's closing balance
+        self.assertEqual(list(partner_ledger(user_id=self.anil.pk))[-1]['balance'], 4000)
+        self.assertIsNotNone(users.get(pk=self.bina.pk).last_expense)
+
+    def test_search_and_paging_happen_in_the_database(self):
+        User.objects.bulk_create([User(username=f'driver{number:02}') for number in range(30)])
+        self.client.force_login(self.admin)
+
+        users = self._users(q='ANIL@')
+        self.assertEqual([user.username for user in users], ['anil'])
+        self.assertEqual(users[0].balance, 4000)
+
+        self.assertEqual(len(self._users()), 25)
+        self.assertEqual(len(self._users(page=2)), 34 - 25)
+        response = self.client.get(reverse('user_list'))
+        self.assertEqual((response.context['total_count'], response.context['inactive_count']), (34, 1))
+
+    def test_partners_see_themselves_and_their_partners(self):
+        self.client.force_login(self.anil)
+        self.assertEqual([user.username for user in self._users()], ['anil', 'bina'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LedgerCheckTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.partner = User.objects.create_user('partner')
+        cls.outsider = User.objects.create_user('outsider')
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        cls.other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        cls.vehicle.partners.add(cls.partner)
+        now = timezone.now()
+
+        # Consistent records, which no check should report
+        rental = dict(vehicle=cls.vehicle, customer_name='Anu', date_out=date(2026, 3, 1), days_of_rent=1, rent_per_day=1000)
+        Rental.objects.create(date_in=date(2026, 3, 2), total_amount_received=800, discounted_amount=200, starting_km=100, ending_km=200, **rental)
+        EMIPayment.objects.create(vehicle=cls.vehicle, amount=15000, date=date(2026, 4, 5), month_paid_for=date(2026, 4, 1))
+        TakenAmount.objects.create(user=cls.partner, vehicle=cls.vehicle, amount=200, date=date(2026, 3, 5))
+        ArchivedRental.objects.create(
+            vehicle=cls.other, customer_name='Old', date_out=date(2025, 1, 10), date_in=date(2025, 1, 11), days_of_rent=1,
+            rent_per_day=1000, total_amount_received=1000, created_at=now, updated_at=now,
+        )
+        MonthlySummary.objects.create(vehicle=cls.other, month=date(2025, 1, 1), rental_count=1, income=1000, rent_total=1000)
+
+        # One broken record per check
+        cls.overpaid = Rental.objects.create(total_amount_received=1500, **rental)
+        cls.negative = Rental.objects.create(discounted_amount=-10, **rental)
+        cls.odometer = Rental.objects.create(starting_km=500, ending_km=400, **rental)
+        cls.long_trip = Rental.objects.create(date_in=date(2026, 3, 5), **rental)
+        cls.early_return = Rental.objects.create(date_in=date(2026, 2, 28), **rental)
+        cls.first_emi = EMIPayment.objects.create(vehicle=cls.vehicle, amount=15000, date=date(2026, 3, 5), month_paid_for=date(2026, 3, 1))
+        EMIPayment.objects.create(vehicle=cls.vehicle, amount=15000, date=date(2026, 3, 6), month_paid_for=date(2026, 3, 15))
+        cls.outsider_taken = TakenAmount.objects.create(user=cls.outsider, vehicle=cls.vehicle, amount=300, date=date(2026, 3, 5))
+        cls.stale_summary = MonthlySummary.objects.create(vehicle=cls.other, month=date(2025, 2, 1), income=500)
+        ArchivedExpense.objects.create(vehicle=cls.other, particulars='Tyre', amount=4000, date=date(2025, 3, 3), created_at=now, updated_at=now)
+        UserProfile.objects.filter(user=cls.partner).update(taken_amount=300)
+
+    def test_each_check_reports_only_broken_records(self):
+        issues = check_ledgers()
+        self.assertEqual(sorted((issue['check'], issue['record'], issue['id'] or 0) for issue in issues), sorted([
+            ('rental_amounts', 'rental', self.overpaid.pk),
+            ('rental_amounts', 'rental', self.negative.pk),
+            ('odometer', 'rental', self.odometer.pk),
+            ('rental_days', 'rental', self.long_trip.pk),
+            ('rental_days', 'rental', self.early_return.pk),
+            ('emi_payments', 'emi_payment', self.first_emi.pk),
+            ('taken_amounts', 'taken_amount', self.outsider_taken.pk),
+            ('summaries', 'monthly_summary', self.stale_summary.pk),
+            ('summaries', 'monthly_summary', 0),
+            ('profile_taken', 'user_profile', self.partner.profile.pk),
+        ]))
+        by_id = {(issue['check'], issue['id']): issue for issue in issues}
+        self.assertEqual(by_id['rental_amounts', self.negative.pk]['message'], 'Negative discounted_amount')
+        self.assertEqual(by_id['summaries', self.stale_summary.pk]['fields'], {'income': {'stored': 500, 'archived': 0}})
+
+    def test_checks_and_vehicles_can_be_narrowed(self):
+        self.assertEqual({issue['check'] for issue in check_ledgers(checks=['odometer'])}, {'odometer'})
+        self.assertEqual({issue['check'] for issue in check_ledgers(vehicle_ids=[self.other.pk], checks=['summaries', 'odometer'])}, {'summaries'})
+
+    def test_batches_cover_every_vehicle(self):
+        self.assertEqual(len(check_ledgers(checks=['summaries'], batches_per_worker=10)), 2)
+
+    def test_command_writes_a_json_report(self):
+        out, err = StringIO(), StringIO()
+        call_command('check_ledgers', '--workers', '1', '--check', 'odometer', stdout=out, stderr=err)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['checks'], report['issue_count']), ({'odometer': 1}, 1))
+        self.assertIn('Found 1 issues', err.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('check_ledgers', '--workers', '1', '--fail-on-issues', stdout=StringIO(), stderr=StringIO())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IncomeSeriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.vehicle = Vehicle.objects.create(name='Innova', registration_number='KL 10 BK 8469')
+        other = Vehicle.objects.create(name='Ertiga', registration_number='KL 10 BK 1000')
+        for vehicle, day, amount in ((cls.vehicle, date(2026, 1, 5), 1000), (cls.vehicle, date(2026, 1, 7), 500), (cls.vehicle, date(2026, 2, 10), 2000), (other, date(2026, 1, 5), 9999)):
+            Rental.objects.create(vehicle=vehicle, customer_name='Anu', date_out=day, total_amount_received=amount)
+        Expense.objects.create(vehicle=cls.vehicle, particulars='Diesel', amount=300, date=date(2026, 1, 6))
+        Expense.objects.create(vehicle=cls.vehicle, particulars='Tyre', amount=400, date=date(2026, 4, 1))
+        MonthlySummary.objects.create(vehicle=cls.vehicle, month=date(2025, 12, 1), income=800, expense=100)
+
+    def _series(self, granularity, start, end):
+        return income_expense_series([self.vehicle.pk], granularity, start, end)
+
+    def test_monthly_series_includes_archived_months(self):
+        series = self._series('month', date(2025, 12, 1), date(2026, 4, 30))
+        self.assertEqual(series['periods'], [date(2025, 12, 1), date(2026, 1, 1), date(2026, 2, 1), date(2026, 3, 1), date(2026, 4, 1)])
+        self.assertEqual(series['income'], [800, 1500, 2000, 0, 0])
+        self.assertEqual(series['expense'], [100, 300, 0, 0, 400])
+        self.assertEqual(series['profit'], [700, 1200, 2000, 0, -400])
+        self.assertIsNone(series['archived_through'])
+
+    def test_coarser_granularities_roll_up_months(self):
+        quarters = self._series('quarter', date(2025, 12, 1), date(2026, 4, 30))
+        self.assertEqual((quarters['periods'], quarters['income'], quarters['expense']), (
+            [date(2025, 10, 1), date(2026, 1, 1), date(2026, 4, 1)], [800, 3500, 0], [100, 300, 400],
+        ))
+        years = self._series('year', date(2025, 12, 1), date(2026, 12, 31))
+        self.assertEqual((years['periods'], years['income']), ([date(2025, 1, 1), date(2026, 1, 1)], [800, 3500]))
+
+    def test_weekly_series_covers_live_rows_only(self):
+        series = self._series('week', date(2025, 12, 31), date(2026, 1, 11))
+        self.assertEqual(series['periods'], [date(2025, 12, 29), date(2026, 1, 5)])
+        self.assertEqual((series['income'], series['expense']), ([0, 1500], [0, 300]))
+        self.assertEqual(series['archived_through'], date(2025, 12, 1))
+
+    def test_bad_ranges_are_rejected(self):
+        with self.assertRaises(SeriesError):
+            self._series('day', None, None)
+        with self.assertRaises(SeriesError):
+            self._series('month', date(2026, 2, 1), date(2026, 1, 1))
+        with self.assertRaises(SeriesError):
+            self._series('week', date(2000, 1, 1), date(2026, 1, 1))
+
+    def test_vehicle_series_endpoint(self):
+        url = reverse('vehicle_series', args=[self.vehicle.pk])
+        self.client.force_login(User.objects.create_user('outsider', password='secret'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser('admin', password='secret'))
+        response = self.client.get(url, {'granularity': 'quarter', 'start': '2025-12-01', 'end': '2026-04-30'})
+        self.assertEqual(response.json()['income'], [800, 3500, 0])
+        self.assertNotIn('forecast', response.json())
+        self.assertIn('forecast', self.client.get(url, {'start': '2025-12-01', 'end': '2026-04-30'}).json())
+        self.assertEqual(self.client.get(url, {'start': '01/12/2025'}).json(), {'error': 'Dates must be in YYYY-MM-DD format.'})
+        self.assertEqual(self.client.get(url, {'granularity': 'day'}).status_code, 400)
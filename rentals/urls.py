@@ -1,23 +1,52 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if getattr(settings, 'RENTALS_ASYNC_VIEWS', False):
+    from . import async_views as page_views
+else:
+    page_views = views
+
 urlpatterns = [
-    path('', views.dashboard, name='dashboard'),
+    path('', page_views.dashboard, name='dashboard'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
 
     # Vehicle URLs
     path('vehicles/', views.vehicle_list, name='vehicle_list'),
     path('vehicles/add/', views.vehicle_create, name='vehicle_create'),
-    path('vehicles/<int:pk>/', views.vehicle_detail, name='vehicle_detail'),
+    path('vehicles/<int:pk>/', page_views.vehicle_detail, name='vehicle_detail'),
     path('vehicles/<int:pk>/edit/', views.vehicle_edit, name='vehicle_edit'),
+    path('vehicles/<int:pk>/series/', views.vehicle_series, name='vehicle_series'),
     path('vehicles/<int:pk>/delete/', views.vehicle_delete, name='vehicle_delete'),
     path('vehicles/<int:pk>/partners/', views.vehicle_partners_get, name='vehicle_partners_get'),
     path('vehicles/<int:pk>/partners/update/', views.vehicle_partners_update, name='vehicle_partners_update'),
     path('vehicles/<int:pk>/pay-emi/', views.pay_emi, name='pay_emi'),
+    path('vehicles/<int:pk>/bulk/', views.vehicle_bulk_action, name='vehicle_bulk_action'),
     path('emi/<int:pk>/delete/', views.delete_emi, name='delete_emi'),
     path('vehicles/<int:pk>/update-emi/', views.update_emi, name='update_emi'),
     path('vehicles/<int:pk>/export-excel/', views.vehicle_export_excel, name='vehicle_export_excel'),
+    path('utilization/', views.fleet_utilization, name='fleet_utilization'),
+
+    # Availability
+    path('availability/', views.availability, name='availability'),
+
+    # Search
+    path('search/', views.search, name='search'),
+
+    # Customers
+    path('customers/autocomplete/', views.customer_autocomplete, name='customer_autocomplete'),
+    path('customers/<str:key>/', views.customer_detail, name='customer_detail'),
+
+    # Receivables
+    path('receivables/', views.receivables, name='receivables'),
+    path('receivables/export.csv', views.receivables_csv, name='receivables_csv'),
+
+    # Sync
+    path('sync/changes/', views.sync_changes, name='sync_changes'),
+
+    # EMI
+    path('emi/', views.emi_board, name='emi_board'),
 
     # Rental URLs
     path('vehicles/<int:vehicle_id>/rentals/add/', views.rental_create, name='rental_create'),
@@ -35,7 +64,10 @@ urlpatterns = [
     # User Management URLs
     path('users/', views.user_list, name='user_list'),
     path('users/add/', views.user_create, name='user_create'),
-    path('users/<int:pk>/', views.user_detail, name='user_detail'),
+    path('users/ledger/', views.fleet_ledger, name='fleet_ledger'),
+    path('users/ledger/export.csv', views.fleet_ledger_csv, name='fleet_ledger_csv'),
+    path('users/<int:pk>/', page_views.user_detail, name='user_detail'),
+    path('users/<int:pk>/statements/<int:year>/<int:month>/', views.partner_statement, name='partner_statement'),
     path('users/<int:pk>/edit/', views.user_edit, name='user_edit'),
     path('users/<int:pk>/update-taken-amount/', views.update_taken_amount, name='update_taken_amount'),
     path('users/<int:pk>/delete/', views.user_delete, name='user_delete'),
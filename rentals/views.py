@@ -1,17 +1,38 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Sum, Count, F
-from django.db.models.functions import TruncMonth
+from django.db.models import Sum, Count, F, FloatField, Min, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce, TruncMonth
 from django.contrib import messages
+from django.core.paginator import Paginator
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.auth.models import User
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from decimal import Decimal
-from .models import Vehicle, Rental, Expense, UserProfile, TakenAmount
+from .models import Vehicle, Rental, Expense, UserProfile, TakenAmount, EMIPayment, MonthlySummary, ArchivedRental
 from .forms import VehicleForm, RentalForm, ExpenseForm, UserCreateForm, UserEditForm
-import pandas as pd
-from datetime import datetime, date
-from django.contrib.auth import authenticate, login, logout
+from .availability import fleet_availability, find_conflicting_rentals
+from .analytics import add_months, monthly_utilization, summarize_utilization
+from .mileage import mileage_summary, monthly_mileage, mileage_anomalies
+from .search import search as search_records
+from .customers import customer_profile, customer_suggestions
+from .emi import emi_schedule, vehicle_emi_status
+from .receivables import AGING_BASES, aging_report, aging_rows
+from .categories import archived_expenses_for, category_breakdown
+from .ledger import partner_ledger
+from .forecast import forecast_series
+from .series import GRANULARITIES, SeriesError, income_expense_series
+from .choices import active_partners, partner_choices, vehicle_partners
+from .bulk import BULK_ACTIONS, BULK_MODELS, BulkActionError, bulk_action
+from .importer import import_sheet, import_workbook
+from .sheets import UNREADABLE_ERRORS, HeaderNotFound
+from .concurrency import run_queries
+from .statements import get_statement, is_closed, open_statement
+from .sync import FEED_LIMIT, MAX_FEED_LIMIT, InvalidCursor, change_feed
+from .archive import archive_month_bounds, archived_by_month, archived_total, combine_monthly, summaries_for, with_archived
+import csv
+from datetime import MAXYEAR, MINYEAR, datetime, date, timedelta
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import AuthenticationForm
 
@@ -22,15 +43,11 @@ def login_view(request):
     if request.method == 'POST':
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                messages.info(request, f"You are now logged in as {username}.")
-                return redirect('dashboard')
-            else:
-                messages.error(request, "Invalid username or password.")
+            # The form has already authenticated the user; don't hash the password twice
+            user = form.get_user()
+            login(request, user)
+            messages.info(request, f"You are now logged in as {user.get_username()}.")
+            return redirect('dashboard')
         else:
             messages.error(request, "Invalid username or password.")
     else:
@@ -44,34 +61,41 @@ def logout_view(request):
     return redirect('login')
 
 
-@login_required
-def dashboard(request):
-    # Filter vehicles based on user permissions
-    if request.user.is_superuser:
-        # Admin sees all vehicles
-        vehicles = Vehicle.objects.all()
-    else:
-        # Partners only see vehicles they are partnered with
-        vehicles = Vehicle.objects.filter(partners=request.user)
+def dashboard_queries(vehicles):
+    """Independent queries behind the dashboard, keyed by name."""
+    rentals = Rental.objects.filter(vehicle__in=vehicles)
+    expenses = Expense.objects.filter(vehicle__in=vehicles)
+    # Archived years only exist as monthly summaries
+    summaries = summaries_for(vehicles=vehicles)
+    return {
+        'total_income': lambda: (rentals.aggregate(Sum('total_amount_received'))['total_amount_received__sum'] or 0) + archived_total(summaries, 'income'),
+        'total_expense': lambda: (expenses.aggregate(Sum('amount'))['amount__sum'] or 0) + archived_total(summaries, 'expense'),
+        'active_vehicles_count': vehicles.count,
+        'rentals_by_month': lambda: combine_monthly(rentals.annotate(month=TruncMonth('date_out')).values('month').annotate(income=Sum('total_amount_received')).order_by('month'), archived_by_month(summaries, 'income'), 'income'),
+        'expenses_by_month': lambda: combine_monthly(expenses.annotate(month=TruncMonth('date')).values('month').annotate(expense=Sum('amount')).order_by('month'), archived_by_month(summaries, 'expense'), 'expense'),
+        'expense_categories': lambda: category_breakdown(expenses, archived_expenses_for(vehicles=vehicles)),
+        'forecast': lambda: forecast_series(vehicles=vehicles),
+    }
 
-    # Calculate totals based on filtered vehicles
-    total_income = Rental.objects.filter(vehicle__in=vehicles).aggregate(Sum('total_amount_received'))['total_amount_received__sum'] or 0
-    total_expense = Expense.objects.filter(vehicle__in=vehicles).aggregate(Sum('amount'))['amount__sum'] or 0
-    profit = total_income - total_expense
-    active_vehicles_count = vehicles.count()
 
-    rentals_by_month = Rental.objects.filter(vehicle__in=vehicles).annotate(month=TruncMonth('date_out')).values('month').annotate(income=Sum('total_amount_received')).order_by('month')
-    expenses_by_month = Expense.objects.filter(vehicle__in=vehicles).annotate(month=TruncMonth('date')).values('month').annotate(expense=Sum('amount')).order_by('month')
+def _forecast_data(forecast):
+    # Same shape and month labels as monthly_data so charts can append it
+    return [
+        {'month': row['month'].strftime('%B %Y'), 'income': row['income'], 'expense': row['expense'], 'profit': row['income'] - row['expense']}
+        for row in forecast
+    ]
+
 
+def dashboard_context(results):
     monthly_data = {}
 
-    for r in rentals_by_month:
+    for r in results['rentals_by_month']:
         month = r['month'].strftime('%B %Y')
         if month not in monthly_data:
             monthly_data[month] = {'month': month, 'income': 0, 'expense': 0, 'profit': 0}
         monthly_data[month]['income'] += float(r['income'])
 
-    for e in expenses_by_month:
+    for e in results['expenses_by_month']:
         month = e['month'].strftime('%B %Y')
         if month not in monthly_data:
             monthly_data[month] = {'month': month, 'income': 0, 'expense': 0, 'profit': 0}
@@ -83,44 +107,77 @@ def dashboard(request):
         final_monthly_data.append(data)
 
     final_monthly_data.sort(key=lambda x: datetime.strptime(x['month'], '%B %Y'))
-    context = {
-        'total_income': total_income,
-        'total_expense': total_expense,
-        'profit': profit,
-        'active_vehicles_count': active_vehicles_count,
+    return {
+        'total_income': results['total_income'],
+        'total_expense': results['total_expense'],
+        'profit': results['total_income'] - results['total_expense'],
+        'active_vehicles_count': results['active_vehicles_count'],
         'monthly_data': final_monthly_data,
+        'forecast_data': _forecast_data(results['forecast']),
+        'expense_categories': results['expense_categories'],
     }
-    return render(request, 'dashboard.html', context)
+
+
+@login_required
+def dashboard(request):
+    # Admin sees all vehicles, partners only the ones they are partnered with
+    vehicles = request.access.vehicles()
+    results = run_queries(dashboard_queries(vehicles))
+    return render(request, 'dashboard.html', dashboard_context(results))
 
 
 # Vehicle Views
 @login_required
 def vehicle_list(request):
-    if request.user.is_superuser:
-        vehicles = Vehicle.objects.all()
-    else:
-        vehicles = Vehicle.objects.filter(partners=request.user)
+    vehicles = request.access.vehicles()
     return render(request, 'vehicle_list.html', {'vehicles': vehicles})
 
 
-@login_required
-def vehicle_detail(request, pk):
-    vehicle = get_object_or_404(Vehicle, pk=pk)
+def _vehicle_utilization(vehicle):
+    rental_bounds = vehicle.rentals.aggregate(first=Min('date_out'), last=Max('date_out'))
+    expense_bounds = vehicle.expenses.aggregate(first=Min('date'), last=Max('date'))
+    archive_first, archive_last = archive_month_bounds(summaries_for(vehicle_ids=[vehicle.pk]))
+    firsts = [d for d in (rental_bounds['first'], expense_bounds['first'], archive_first) if d]
+    lasts = [d for d in (rental_bounds['last'], expense_bounds['last'], archive_last) if d]
+    this_month = date.today().replace(day=1)
+    first_month = min(firsts).replace(day=1) if firsts else this_month
+    last_month = max(lasts).replace(day=1) if lasts else this_month
+    return monthly_utilization([vehicle.pk], first_month, last_month)[vehicle.pk]
 
-    # Check permission
-    if not request.user.is_superuser and not vehicle.partners.filter(pk=request.user.pk).exists():
-        messages.error(request, "You do not have permission to view this vehicle.")
-        return redirect('vehicle_list')
 
+# vehicle_detail_queries entries that may write: utilization stores the
+# closed months it had to compute
+VEHICLE_DETAIL_WRITES = ('utilization',)
+
+
+def vehicle_detail_queries(vehicle):
+    """Independent queries behind the vehicle detail page, keyed by name."""
     rentals = vehicle.rentals.all().order_by('-date_out')
     expenses = vehicle.expenses.all().order_by('-date')
+    summaries = summaries_for(vehicle_ids=[vehicle.pk])
+    return {
+        'rentals': lambda: list(rentals),
+        'expenses': lambda: list(expenses),
+        'total_revenue': lambda: (rentals.aggregate(Sum('total_amount_received'))['total_amount_received__sum'] or 0) + archived_total(summaries, 'income'),
+        'total_expense': lambda: (expenses.aggregate(Sum('amount'))['amount__sum'] or 0) + archived_total(summaries, 'expense'),
+        'rentals_by_month': lambda: combine_monthly(rentals.annotate(month=TruncMonth('date_out')).values('month').annotate(income=Sum('total_amount_received')).order_by('month'), archived_by_month(summaries, 'income'), 'income'),
+        'expenses_by_month': lambda: combine_monthly(expenses.annotate(month=TruncMonth('date')).values('month').annotate(expense=Sum('amount')).order_by('month'), archived_by_month(summaries, 'expense'), 'expense'),
+        'expense_categories': lambda: category_breakdown(vehicle.expenses.all(), archived_expenses_for(vehicle_ids=[vehicle.pk])),
+        'outstanding': lambda: vehicle.rentals.outstanding_total() + ArchivedRental.objects.filter(vehicle=vehicle).outstanding_total(),
+        'emi_status': lambda: vehicle_emi_status(vehicle),
+        'emi_payments': lambda: list(EMIPayment.objects.filter(vehicle=vehicle).order_by('-date')),
+        'utilization': lambda: _vehicle_utilization(vehicle),
+        'mileage': lambda: mileage_summary(vehicle.pk),
+        'mileage_by_month': lambda: monthly_mileage(vehicle.pk),
+        'mileage_anomalies': lambda: mileage_anomalies(vehicle.pk),
+        'partner_choices': lambda: partner_choices(vehicle),
+        'forecast': lambda: forecast_series(vehicle_ids=[vehicle.pk]),
+    }
 
-    total_revenue = rentals.aggregate(Sum('total_amount_received'))['total_amount_received__sum'] or 0
-    total_expense = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
-    profit = total_revenue - total_expense
 
-    rentals_by_month = rentals.annotate(month=TruncMonth('date_out')).values('month').annotate(income=Sum('total_amount_received')).order_by('month')
-    expenses_by_month = expenses.annotate(month=TruncMonth('date')).values('month').annotate(expense=Sum('amount')).order_by('month')
+def vehicle_detail_context(vehicle, results):
+    rentals_by_month = results['rentals_by_month']
+    expenses_by_month = results['expenses_by_month']
 
     min_month = None
     max_month = None
@@ -163,69 +220,115 @@ def vehicle_detail(request, pk):
             'profit': profit_val
         })
 
+    emi_status = results['emi_status']
+    utilization = results['utilization']
+
+    return {
+        'vehicle': vehicle,
+        'rentals': results['rentals'],
+        'expenses': results['expenses'],
+        'emi_payments': results['emi_payments'],
+        'total_revenue': results['total_revenue'],
+        'total_expense': results['total_expense'],
+        'profit': results['total_revenue'] - results['total_expense'],
+        'outstanding': results['outstanding'],
+        'monthly_data': monthly_data,
+        'forecast_data': _forecast_data(results['forecast']),
+        'granularities': list(GRANULARITIES),
+        'all_months': months,
+        'expense_categories': results['expense_categories'],
+        'emi_warning': emi_status['emi_warning'],
+        'emi_due_date': emi_status['emi_due_date'],
+        'emi_is_paid': emi_status['emi_is_paid'],
+        'emi_config': emi_status['emi_config'],
+        'days_until_emi': emi_status['days_until_emi'],
+        'utilization': utilization,
+        'utilization_summary': summarize_utilization(utilization),
+        'mileage': results['mileage'],
+        'mileage_by_month': results['mileage_by_month'],
+        'mileage_anomalies': results['mileage_anomalies'],
+        'partner_choices': results['partner_choices'],
+    }
+
+
+@login_required
+def vehicle_detail(request, pk):
+    vehicle = get_object_or_404(Vehicle, pk=pk)
+
+    # Check permission
+    if not request.access.can_view_vehicle(vehicle):
+        messages.error(request, "You do not have permission to view this vehicle.")
+        return redirect('vehicle_list')
+
+    results = run_queries(vehicle_detail_queries(vehicle))
+    return render(request, 'vehicle_detail.html', vehicle_detail_context(vehicle, results))
 
-    emi_warning = False
-    emi_due_date = None
-    emi_is_paid = False
-    days_until_emi = None
 
+@login_required
+def vehicle_series(request, pk):
+    """Income and expense of a vehicle per week, month, quarter or year between two dates, as JSON arrays"""
+    vehicle = get_object_or_404(Vehicle, pk=pk)
+    if not request.access.can_view_vehicle(vehicle):
+        return JsonResponse({'error': 'You do not have permission to view this vehicle.'}, status=403)
+
+    granularity = request.GET.get('granularity', 'month')
     try:
-        emi_config = vehicle.emi
-        if emi_config.is_active:
-            today = date.today()
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+        series = income_expense_series([vehicle.pk], granularity, start, end)
+    except ValueError as e:
+        message = str(e) if isinstance(e, SeriesError) else 'Dates must be in YYYY-MM-DD format.'
+        return JsonResponse({'error': message}, status=400)
+
+    if granularity == 'month':
+        forecast = forecast_series(vehicle_ids=[vehicle.pk])
+        series['forecast'] = {
+            'periods': [row['month'] for row in forecast],
+            'income': [row['income'] for row in forecast],
+            'expense': [row['expense'] for row in forecast],
+        }
+    return JsonResponse(series)
 
 
-            try:
-                due_date = date(today.year, today.month, emi_config.due_day)
-            except ValueError:
-                import calendar
-                last_day = calendar.monthrange(today.year, today.month)[1]
-                due_date = date(today.year, today.month, last_day)
+@login_required
+def fleet_utilization(request):
+    """Compare utilization of every vehicle for a year"""
+    vehicles = request.access.vehicles()
+    vehicles = list(vehicles.order_by('name'))
 
-            emi_due_date = due_date
+    current_year = datetime.now().year
+    first_rental = Rental.objects.filter(vehicle__in=vehicles).order_by('date_out').values_list('date_out', flat=True).first()
+    first_year = first_rental.year if first_rental else current_year
+    try:
+        selected_year = int(request.GET.get('year', current_year))
+    except ValueError:
+        selected_year = current_year
+    # Only years the page offers; out-of-range years can't be built into dates
+    selected_year = min(max(selected_year, first_year), current_year)
 
+    monthly = monthly_utilization([v.pk for v in vehicles], date(selected_year, 1, 1), date(selected_year, 12, 1))
 
-            from .models import EMIPayment
-            emi_is_paid = EMIPayment.objects.filter(
-                vehicle=vehicle,
-                date__year=today.year,
-                date__month=today.month
-            ).exists()
-
-            if not emi_is_paid:
-                days_until_emi = (due_date - today).days
-                if days_until_emi <= emi_config.warning_days:
-                    emi_warning = True
-    except Exception:
-        emi_config = None
-
-    # Get EMI history
-    from .models import EMIPayment
-    emi_payments = EMIPayment.objects.filter(vehicle=vehicle).order_by('-date')
+    rows = []
+    for vehicle in vehicles:
+        summary = summarize_utilization(monthly[vehicle.pk])
+        summary['vehicle'] = vehicle
+        summary['months'] = monthly[vehicle.pk]
+        rows.append(summary)
+    rows.sort(key=lambda row: row['occupancy'], reverse=True)
 
     context = {
-        'vehicle': vehicle,
-        'rentals': rentals,
-        'expenses': expenses,
-        'emi_payments': emi_payments,
-        'total_revenue': total_revenue,
-        'total_expense': total_expense,
-        'profit': profit,
-        'monthly_data': monthly_data,
-        'all_months': months,
-        'emi_warning': emi_warning,
-        'emi_due_date': emi_due_date,
-        'emi_is_paid': emi_is_paid,
-        'emi_config': emi_config,
-        'days_until_emi': days_until_emi,
+        'rows': rows,
+        'fleet_summary': summarize_utilization([m for row in rows for m in row['months']]),
+        'selected_year': selected_year,
+        'available_years': list(range(current_year, first_year - 1, -1)),
     }
-    return render(request, 'vehicle_detail.html', context)
+    return render(request, 'fleet_utilization.html', context)
 
 
 @login_required
 def vehicle_create(request):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_vehicles)):
+    if not request.access.can_manage_vehicles:
         messages.error(request, "You do not have permission to create vehicles.")
         return redirect('vehicle_list')
 
@@ -246,14 +349,13 @@ def vehicle_create(request):
     else:
         form = VehicleForm()
 
-    partners = User.objects.filter(is_active=True).order_by('username')
-    return render(request, 'form.html', {'form': form, 'title': 'Add Vehicle', 'partners': partners})
+    return render(request, 'form.html', {'form': form, 'title': 'Add Vehicle', 'partners': active_partners()})
 
 
 @login_required
 def vehicle_edit(request, pk):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_vehicles)):
+    if not request.access.can_manage_vehicles:
         messages.error(request, "You do not have permission to edit vehicles.")
         return redirect('vehicle_list')
 
@@ -275,13 +377,11 @@ def vehicle_edit(request, pk):
     else:
         form = VehicleForm(instance=vehicle)
 
-    partners = User.objects.filter(is_active=True).order_by('username')
-    selected_partners = vehicle.partners.all()
     return render(request, 'form.html', {
         'form': form,
         'title': 'Edit Vehicle',
-        'partners': partners,
-        'selected_partners': selected_partners,
+        'partners': active_partners(),
+        'selected_partners': vehicle_partners(vehicle),
         'vehicle': vehicle
     })
 
@@ -289,7 +389,7 @@ def vehicle_edit(request, pk):
 @login_required
 def vehicle_delete(request, pk):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_vehicles)):
+    if not request.access.can_manage_vehicles:
         messages.error(request, "You do not have permission to delete vehicles.")
         return redirect('vehicle_list')
 
@@ -301,15 +401,349 @@ def vehicle_delete(request, pk):
     return render(request, 'confirm_delete.html', {'object': vehicle})
 
 
+# Availability
+def _booking_conflict_message(conflicts):
+    clash = conflicts[0]
+    until = clash['end'].strftime('%d %b %Y %H:%M') if clash['end'] else 'not returned yet'
+    return (
+        f"Vehicle is already booked by {clash['customer_name']} "
+        f"from {clash['start'].strftime('%d %b %Y %H:%M')} to {until}."
+    )
+
+
+def _parse_window_bound(value, default):
+    if not value:
+        return default
+    try:
+        bound = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Rentals store naive local dates and times, so compare in local time
+    if timezone.is_aware(bound):
+        bound = timezone.make_naive(bound)
+    return bound
+
+
+@login_required
+def availability(request):
+    """Free/busy status of the fleet for a time window"""
+    vehicles = request.access.vehicles()
+    vehicles = vehicles.order_by('name')
+
+    now = datetime.now().replace(second=0, microsecond=0)
+    start = _parse_window_bound(request.GET.get('start'), now)
+    end = _parse_window_bound(request.GET.get('end'), now + timedelta(days=1))
+    wants_json = request.GET.get('format') == 'json'
+
+    if start is None or end is None or end <= start:
+        error = 'Please provide a valid time window (start must be before end).'
+        if wants_json:
+            return JsonResponse({'error': error}, status=400)
+        messages.error(request, error)
+        return render(request, 'availability.html', {'results': [], 'start': start or now, 'end': end or now}, status=400)
+
+    results = fleet_availability(vehicles, start, end)
+
+    if wants_json:
+        return JsonResponse({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'vehicles': [
+                {
+                    'id': row['vehicle'].id,
+                    'name': row['vehicle'].name,
+                    'registration_number': row['vehicle'].registration_number,
+                    'available': row['available'],
+                    'busy': [
+                        {
+                            'rental_id': b['rental_id'],
+                            'customer_name': b['customer_name'],
+                            'start': b['start'].isoformat(),
+                            'end': b['end'].isoformat() if b['end'] else None,
+                        }
+                        for b in row['busy']
+                    ],
+                }
+                for row in results
+            ],
+        })
+
+    available_count = sum(1 for row in results if row['available'])
+    context = {
+        'results': results,
+        'start': start,
+        'end': end,
+        'available_count': available_count,
+        'busy_count': len(results) - available_count,
+    }
+    return render(request, 'availability.html', context)
+
+
+# Search
+@login_required
+def search(request):
+    """Search customers, destinations and expenses across the user's vehicles"""
+    query = request.GET.get('q', '').strip()
+    results = search_records(query, request.access.visible_vehicle_ids) if query else []
+
+    if request.GET.get('format') == 'json':
+        data = []
+        for kind, obj in results:
+            if kind == 'rental':
+                data.append({
+                    'type': 'rental',
+                    'id': obj.id,
+                    'vehicle_id': obj.vehicle_id,
+                    'vehicle': obj.vehicle.name,
+                    'date': obj.date_out.isoformat(),
+                    'customer_name': obj.customer_name,
+                    'contact_no': obj.contact_no,
+                    'customer_id': obj.customer_id,
+                    'care_of': obj.care_of,
+                    'destination': obj.destination,
+                })
+            else:
+                data.append({
+                    'type': 'expense',
+                    'id': obj.id,
+                    'vehicle_id': obj.vehicle_id,
+                    'vehicle': obj.vehicle.name,
+                    'date': obj.date.isoformat(),
+                    'particulars': obj.particulars,
+                    'place': obj.place,
+                    'care_of': obj.care_of,
+                    'amount': str(obj.amount),
+                })
+        return JsonResponse({'query': query, 'results': data})
+
+    return render(request, 'search.html', {'query': query, 'results': results})
+
+
+# Customers
+@login_required
+def customer_detail(request, key):
+    """Trip history and balance for one customer"""
+    vehicle_ids = request.access.visible_vehicle_ids
+    profile = customer_profile(key, vehicle_ids)
+    if not profile:
+        messages.error(request, "Customer not found.")
+        return redirect('search')
+
+    rentals = Rental.objects.filter(customer_key=key).select_related('vehicle')
+    archived = ArchivedRental.objects.filter(customer_key=key).select_related('vehicle')
+    if vehicle_ids is not None:
+        rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+        archived = archived.filter(vehicle_id__in=vehicle_ids)
+    rentals = with_archived(rentals, archived, 'date_out')[::-1]
+
+    return render(request, 'customer_detail.html', {'profile': profile, 'rentals': rentals})
+
+
+@login_required
+def customer_autocomplete(request):
+    """Known customers matching the typed name, phone or ID"""
+    query = request.GET.get('q', '').strip()
+    if len(query) < 2:
+        return JsonResponse({'customers': []})
+    return JsonResponse({'customers': customer_suggestions(query, request.access.visible_vehicle_ids)})
+
+
+# Receivables
+def _aging_basis(request):
+    basis = request.GET.get('basis', 'date_in')
+    return basis if basis in AGING_BASES else 'date_in'
+
+
+@login_required
+def receivables(request):
+    """Outstanding rental balances by age, per vehicle and per partner"""
+    report = aging_report(request.access.visible_vehicle_ids, basis=_aging_basis(request))
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'basis': report['basis'],
+            'today': report['today'].isoformat(),
+            'buckets': report['buckets'],
+            'vehicles': report['vehicles'],
+            'partners': report['partners'],
+            'totals': report['totals'],
+        })
+
+    return render(request, 'receivables.html', report)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, for streaming csv output."""
+
+    def write(self, value):
+        return value
+
+
+@login_required
+def receivables_csv(request):
+    """Every outstanding rental with its age bucket, streamed as CSV"""
+    basis = _aging_basis(request)
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow([
+            'Rental ID', 'Vehicle', 'Registration', 'Partner', 'Customer', 'Contact', 'Date Out', 'Date In',
+            'Days of Rent', 'Rent/Day', 'Discount', 'Received', 'Balance', 'Age (days)', 'Bucket',
+        ])
+        for rental, age, bucket in aging_rows(request.access.visible_vehicle_ids, basis=basis):
+            yield writer.writerow([
+                rental.id, rental.vehicle__name, rental.vehicle__registration_number, rental.user__username or '',
+                rental.customer_name, rental.contact_no or '', rental.date_out, rental.date_in or '',
+                rental.days_of_rent, rental.rent_per_day, rental.discounted_amount, rental.total_amount_received,
+                rental.balance_due, age, bucket,
+            ])
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="receivables_{date.today():%Y%m%d}.csv"'
+    return response
+
+
+# Sync
+@login_required
+def sync_changes(request):
+    """Rentals, expenses, taken amounts and EMI payments changed since a cursor, as JSON"""
+    vehicle_ids = request.access.visible_vehicle_ids
+    if request.GET.get('vehicle'):
+        # A client that just gained a vehicle pulls its full history on its own
+        try:
+            vehicle = int(request.GET['vehicle'])
+        except ValueError:
+            return JsonResponse({'error': 'Invalid vehicle.'}, status=400)
+        if vehicle_ids is not None and vehicle not in vehicle_ids:
+            return JsonResponse({'error': 'You do not have permission to view this vehicle.'}, status=403)
+        vehicle_ids = [vehicle]
+
+    try:
+        limit = max(1, min(int(request.GET.get('limit', FEED_LIMIT)), MAX_FEED_LIMIT))
+    except ValueError:
+        limit = FEED_LIMIT
+
+    try:
+        feed = change_feed(vehicle_ids, cursor=request.GET.get('cursor'), limit=limit)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Clients drop vehicles missing from this list and pull new ones in full
+    feed['vehicles'] = sorted(request.access.vehicles().values_list('pk', flat=True))
+    return JsonResponse(feed)
+
+
+# EMI
+@login_required
+def emi_board(request):
+    """Overdue and upcoming EMI instalments across the user's vehicles"""
+    today = date.today()
+    try:
+        months = max(1, min(int(request.GET.get('months', 12)), 120))
+    except ValueError:
+        months = 12
+    first_month = add_months(today.replace(day=1), 1 - months)
+
+    schedule = emi_schedule(request.access.visible_vehicle_ids, today=today, first_month=first_month)
+    pending = sorted(
+        (row for row in schedule if row['status'] in ('overdue', 'due')),
+        key=lambda row: (row['due_date'], row['vehicle'].name),
+    )
+    overdue = [row for row in pending if row['status'] == 'overdue']
+    due = [row for row in pending if row['status'] == 'due']
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'today': today.isoformat(),
+            'instalments': [
+                {
+                    'vehicle_id': row['vehicle'].id,
+                    'vehicle': row['vehicle'].name,
+                    'month': row['month'].isoformat(),
+                    'due_date': row['due_date'].isoformat(),
+                    'amount': str(row['amount']),
+                    'status': row['status'],
+                    'days_until': row['days_until'],
+                }
+                for row in pending
+            ],
+        })
+
+    context = {
+        'overdue': overdue,
+        'due': due,
+        'overdue_amount': sum(row['amount'] for row in overdue),
+        'due_amount': sum(row['amount'] for row in due),
+        'paid_count': sum(1 for row in schedule if row['status'] == 'paid'),
+        'months': months,
+    }
+    return render(request, 'emi_board.html', context)
+
+
+@login_required
+@require_POST
+def vehicle_bulk_action(request, pk):
+    """Delete, reassign, move or date-shift the selected rentals or expenses of a vehicle"""
+    vehicle = get_object_or_404(Vehicle, pk=pk)
+    if not request.access.can_manage_vehicles or not request.access.can_view_vehicle(vehicle):
+        messages.error(request, "You do not have permission to edit this vehicle's records.")
+        return redirect('vehicle_detail', pk=pk)
+
+    kind = request.POST.get('kind')
+    action = request.POST.get('action')
+    ids = [value for value in request.POST.getlist('ids') if value.isdigit()]
+    if kind not in BULK_MODELS or action not in BULK_ACTIONS:
+        messages.error(request, "Choose an action.")
+        return redirect('vehicle_detail', pk=pk)
+    if not ids:
+        messages.error(request, f"Select at least one {kind}.")
+        return redirect('vehicle_detail', pk=pk)
+
+    options = {}
+    if action == 'reassign':
+        user_id = request.POST.get('user')
+        options['user'] = User.objects.filter(pk=user_id, is_active=True).first() if user_id else None
+        if user_id and options['user'] is None:
+            messages.error(request, "Choose an active partner.")
+            return redirect('vehicle_detail', pk=pk)
+    elif action == 'move':
+        target = Vehicle.objects.filter(pk=request.POST.get('target_vehicle') or None).first()
+        if target is None or not request.access.can_view_vehicle(target):
+            messages.error(request, "Choose a vehicle to move to.")
+            return redirect('vehicle_detail', pk=pk)
+        options['target_vehicle'] = target
+    elif action == 'shift':
+        try:
+            options['days'] = int(request.POST.get('days', ''))
+        except ValueError:
+            options['days'] = 0
+
+    try:
+        count = bulk_action(kind, vehicle, ids, action, **options)
+    except BulkActionError as e:
+        messages.error(request, str(e))
+        return redirect('vehicle_detail', pk=pk)
+
+    done = {'delete': 'deleted', 'reassign': 'reassigned', 'move': 'moved', 'shift': 'shifted'}[action]
+    messages.success(request, f"{count} {kind}{'s' if count != 1 else ''} {done}.")
+    return redirect('vehicle_detail', pk=pk)
+
+
 # Rental Views
 @login_required
 def rental_create(request, vehicle_id):
     vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
     if request.method == 'POST':
-        form = RentalForm(request.POST)
+        form = RentalForm(request.POST, vehicle=vehicle)
         if form.is_valid():
             rental = form.save(commit=False)
             rental.vehicle = vehicle
+
+            conflicts = find_conflicting_rentals(rental)
+            if conflicts:
+                form.add_error('date_out', _booking_conflict_message(conflicts))
+                return render(request, 'form.html', {'form': form, 'title': f'Add Rental for {vehicle.name}'})
+
             rental.save()
 
             # Send email notification to partners
@@ -326,7 +760,7 @@ def rental_create(request, vehicle_id):
             return redirect('vehicle_detail', pk=vehicle_id)
     else:
         initial_data = {'rent_per_day': vehicle.price_per_day}
-        form = RentalForm(initial=initial_data)
+        form = RentalForm(initial=initial_data, vehicle=vehicle)
     return render(request, 'form.html', {'form': form, 'title': f'Add Rental for {vehicle.name}'})
 
 
@@ -336,6 +770,11 @@ def rental_edit(request, pk):
     if request.method == 'POST':
         form = RentalForm(request.POST, instance=rental)
         if form.is_valid():
+            conflicts = find_conflicting_rentals(form.instance)
+            if conflicts:
+                form.add_error('date_out', _booking_conflict_message(conflicts))
+                return render(request, 'form.html', {'form': form, 'title': 'Edit Rental'})
+
             form.save()
             messages.success(request, 'Rental updated successfully.')
             return redirect('vehicle_detail', pk=rental.vehicle.id)
@@ -360,7 +799,7 @@ def rental_delete(request, pk):
 def expense_create(request, vehicle_id):
     vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
     if request.method == 'POST':
-        form = ExpenseForm(request.POST)
+        form = ExpenseForm(request.POST, vehicle=vehicle)
         if form.is_valid():
             expense = form.save(commit=False)
             expense.vehicle = vehicle
@@ -378,7 +817,7 @@ def expense_create(request, vehicle_id):
             messages.success(request, 'Expense added successfully.')
             return redirect('vehicle_detail', pk=vehicle_id)
     else:
-        form = ExpenseForm()
+        form = ExpenseForm(vehicle=vehicle)
     return render(request, 'form.html', {'form': form, 'title': f'Add Expense for {vehicle.name}'})
 
 
@@ -411,289 +850,248 @@ def expense_delete(request, pk):
 @login_required
 def import_data(request):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_import_data)):
+    if not request.access.can_import_data:
         messages.error(request, "You do not have permission to import data.")
         return redirect('dashboard')
 
     vehicles = Vehicle.objects.all()
     import_errors = []
     selected_vehicle_id = None
+    multi_sheet = False
+
+    def render_import(**extra):
+        context = {'vehicles': vehicles, 'import_errors': import_errors, 'selected_vehicle_id': selected_vehicle_id,
+                   'multi_sheet': multi_sheet}
+        return render(request, 'import.html', dict(context, **extra))
 
     if request.method == 'POST' and request.FILES.get('excel_file'):
         excel_file = request.FILES['excel_file']
         vehicle_id = request.POST.get('vehicle_id')
         selected_vehicle_id = vehicle_id
+        multi_sheet = bool(request.POST.get('multi_sheet'))
+
+        if multi_sheet:
+            try:
+                sheet_summary = import_workbook(excel_file, vehicles)
+            except UNREADABLE_ERRORS as e:
+                import_errors.append(str(e))
+                messages.error(request, f'Error importing file: {str(e)}')
+                return render_import()
+
+            rental_count = sum(row['rentals'] for row in sheet_summary)
+            expense_count = sum(row['expenses'] for row in sheet_summary)
+            matched = sum(1 for row in sheet_summary if row['vehicle'])
+            if rental_count or expense_count:
+                messages.success(request, f"Imported {rental_count} rentals and {expense_count} expenses from {matched} of {len(sheet_summary)} sheets.")
+            else:
+                messages.warning(request, 'No records were imported. Check that sheet names match vehicle registration numbers.')
+            return render_import(sheet_summary=sheet_summary)
 
         if not vehicle_id:
             messages.error(request, 'Please select a vehicle.')
-            return render(request, 'import.html', {'vehicles': vehicles, 'import_errors': import_errors, 'selected_vehicle_id': selected_vehicle_id})
+            return render_import()
 
         vehicle = get_object_or_404(Vehicle, pk=vehicle_id)
 
         try:
-            # Try to read the Excel file from the beginning each time
-            # For seekability, use InMemoryUploadedFile, so read into BytesIO if needed
-            from io import BytesIO
-            excel_data = excel_file.read()
-            # Reset pointer for every read_excel
-            def get_excel_stream():
-                return BytesIO(excel_data)
-
-            header_row_index = 0
-            found_header = False
-
-            # Step 1: Find the header row
-            df_temp = pd.read_excel(get_excel_stream(), header=None, nrows=20)
-            for i, row in df_temp.iterrows():
-                row_values = [str(val).strip().upper() for val in row.values]
-                if 'DATE OUT' in row_values and 'CUSTOMER' in row_values:
-                    header_row_index = i
-                    found_header = True
-                    break
-
-            if not found_header:
-                messages.warning(request, "Could not find 'DATE OUT' header row. Please check file format.")
-                return render(request, 'import.html', {'vehicles': vehicles, 'import_errors': ['Header row not found (DATE OUT, CUSTOMER)'], 'selected_vehicle_id': selected_vehicle_id})
-
-            # Step 2: Read the full file with the correct header
-            df = pd.read_excel(get_excel_stream(), header=header_row_index)
-
-            # Normalize column names
-            df.columns = [str(col).strip().upper() for col in df.columns]
-
-            rental_success_count = 0
-            expense_success_count = 0
-
-            for index, row in df.iterrows():
-                # --- Process Rental ---
-                try:
-                    date_out_raw = row.get('DATE OUT')
-                    customer_raw = row.get('CUSTOMER')
-
-                    if pd.notna(date_out_raw) and pd.notna(customer_raw):
-                        # Parse Date Out
-                        date_out = None
-                        try:
-                            if isinstance(date_out_raw, str):
-                                date_out = pd.to_datetime(date_out_raw, dayfirst=True, errors='coerce').date()
-                            elif hasattr(date_out_raw, 'date'):
-                                date_out = date_out_raw.date()
-                            elif isinstance(date_out_raw, pd.Timestamp):
-                                date_out = date_out_raw.date()
-                        except Exception as e:
-                            date_out = None
-
-                        if date_out:
-                            rental = Rental(
-                                vehicle=vehicle,
-                                date_out=date_out,
-                                customer_name=str(customer_raw).strip(),
-                                destination=row.get('DESTINATION'),
-                                customer_id=row.get('CUSTOMER ID')
-                            )
-                            # Contact No (sometimes ; at end)
-                            rental.contact_no = row.get('CONTACT NO;') or row.get('CONTACT NO')
-                            rental.care_of = row.get('C/O')
-
-                            # Time Out
-                            time_out_raw = row.get('TIME OUT')
-                            rental.time_out = None
-                            if pd.notna(time_out_raw):
-                                try:
-                                    if hasattr(time_out_raw, 'time'):
-                                        rental.time_out = time_out_raw
-                                    elif isinstance(time_out_raw, str):
-                                        parsed_time = pd.to_datetime(time_out_raw, errors='coerce')
-                                        if not pd.isna(parsed_time):
-                                            rental.time_out = parsed_time.time()
-                                except: pass
-
-                            # Date In
-                            date_in_raw = row.get('DATE IN')
-                            rental.date_in = None
-                            if pd.notna(date_in_raw):
-                                try:
-                                    if hasattr(date_in_raw, 'date'):
-                                        rental.date_in = date_in_raw.date()
-                                    elif isinstance(date_in_raw, str):
-                                        rental.date_in = pd.to_datetime(date_in_raw, dayfirst=True, errors='coerce').date()
-                                except: pass
-
-                            # Time In
-                            time_in_raw = row.get('TIME IN')
-                            rental.time_in = None
-                            if pd.notna(time_in_raw):
-                                try:
-                                    if hasattr(time_in_raw, 'time'):
-                                        rental.time_in = time_in_raw
-                                    elif isinstance(time_in_raw, str):
-                                        parsed_time = pd.to_datetime(time_in_raw, errors='coerce')
-                                        if not pd.isna(parsed_time):
-                                            rental.time_in = parsed_time.time()
-                                except: pass
-
-                            # Numeric fields
-                            rental.days_of_rent = pd.to_numeric(row.get('DAYS OF RENT'), errors='coerce')
-                            if pd.isna(rental.days_of_rent): rental.days_of_rent = 0
-                            rental.rent_per_day = pd.to_numeric(row.get('RENT/DAY'), errors='coerce')
-                            if pd.isna(rental.rent_per_day): rental.rent_per_day = 0
-                            adv_amt = None
-                            if 'ADV; AMOUNT' in df.columns:
-                                adv_amt = row.get('ADV; AMOUNT')
-                            if adv_amt is None and 'ADV AMOUNT' in df.columns:
-                                adv_amt = row.get('ADV AMOUNT')
-                            rental.advance_amount = pd.to_numeric(adv_amt, errors='coerce')
-                            if pd.isna(rental.advance_amount): rental.advance_amount = 0
-
-                            rental.starting_km = pd.to_numeric(row.get('STARTING KM'), errors='coerce')
-                            if pd.isna(rental.starting_km): rental.starting_km = None
-                            rental.ending_km = pd.to_numeric(row.get('ENDING KM'), errors='coerce')
-                            if pd.isna(rental.ending_km): rental.ending_km = None
-                            rental.total_amount_received = pd.to_numeric(row.get('TOTAL AMOUNT RECEIVED'), errors='coerce')
-                            if pd.isna(rental.total_amount_received): rental.total_amount_received = 0
-
-                            rental.save()
-                            rental_success_count += 1
-
-                except Exception as e:
-                    import_errors.append(f"Rental Row {index+1}: {e}")
-
-                # --- Process Expense ---
-                try:
-                    particulars = row.get('PARTICULARS')
-                    amount = row.get('AMOUNT')
-
-                    if pd.notna(particulars) and pd.notna(amount):
-                        # Expense Date
-                        date_val_raw = row.get('DATE')
-                        expense_date = timezone.now().date()
-                        if pd.notna(date_val_raw):
-                            try:
-                                if hasattr(date_val_raw, 'date'):
-                                    expense_date = date_val_raw.date()
-                                elif isinstance(date_val_raw, str):
-                                    date_parsed = pd.to_datetime(date_val_raw, dayfirst=True, errors='coerce')
-                                    if not pd.isna(date_parsed):
-                                        expense_date = date_parsed.date()
-                            except: pass
-
-                        # Handle C/O for expense rows (C/O.1 or fallback if no CUSTOMER)
-                        care_of_expense = None
-                        if 'C/O.1' in df.columns:
-                            care_of_expense = row.get('C/O.1')
-                        if not care_of_expense and 'C/O' in df.columns and pd.isna(row.get('CUSTOMER')):
-                            care_of_expense = row.get('C/O')
-
-                        expense_amount = pd.to_numeric(amount, errors='coerce')
-                        if pd.isna(expense_amount): expense_amount = 0
-
-                        expense = Expense(
-                            vehicle=vehicle,
-                            date=expense_date,
-                            particulars=particulars,
-                            place=row.get('PLACE'),
-                            care_of=care_of_expense,
-                            amount=expense_amount
-                        )
-                        expense.save()
-                        expense_success_count += 1
-
-                except Exception as e:
-                    import_errors.append(f"Expense Row {index+1}: {e}")
-
-            msg = []
-            if rental_success_count > 0:
-                msg.append(f'{rental_success_count} rentals')
-            if expense_success_count > 0:
-                msg.append(f'{expense_success_count} expenses')
-            if msg:
-                messages.success(request, f"Successfully imported: {', '.join(msg)}.")
-            else:
-                if not found_header:
-                    messages.warning(request, "Could not find 'DATE OUT' header row. Please check file format.")
-                else:
-                    messages.warning(request, 'No records were imported. Please check the file format and ensure data exists.')
-            if import_errors:
-                messages.error(request, f"Some rows were skipped due to errors. See details below.")
-                return render(request, 'import.html', {'vehicles': vehicles, 'import_errors': import_errors, 'selected_vehicle_id': selected_vehicle_id})
-        except Exception as e:
+            writer = import_sheet(excel_file, vehicle)
+        except HeaderNotFound as e:
+            messages.warning(request, "Could not find 'DATE OUT' header row. Please check file format.")
+            return render_import(import_errors=[str(e)])
+        except UNREADABLE_ERRORS as e:
             import_errors.append(str(e))
             messages.error(request, f'Error importing file: {str(e)}')
-            return render(request, 'import.html', {'vehicles': vehicles, 'import_errors': import_errors, 'selected_vehicle_id': selected_vehicle_id})
+            return render_import()
+
+        import_errors.extend(writer.errors)
+        msg = []
+        if writer.rentals > 0:
+            msg.append(f'{writer.rentals} rentals')
+        if writer.expenses > 0:
+            msg.append(f'{writer.expenses} expenses')
+        if msg:
+            messages.success(request, f"Successfully imported: {', '.join(msg)}.")
+        else:
+            messages.warning(request, 'No records were imported. Please check the file format and ensure data exists.')
+        if import_errors:
+            messages.error(request, f"Some rows were skipped due to errors. See details below.")
+            return render_import()
 
         return redirect('vehicle_detail', pk=vehicle_id)
 
     if request.method == 'GET':
         selected_vehicle_id = request.GET.get('vehicle_id')
 
-    return render(request, 'import.html', {'vehicles': vehicles, 'import_errors': import_errors, 'selected_vehicle_id': selected_vehicle_id})
+    return render_import()
 
 
 # User Management Views
+USERS_PER_PAGE = 25
+
+
+def _total(queryset, group, field, **filters):
+    """Correlated SUM of ``field`` over ``queryset`` as a float, zero when there are no rows."""
+    rows = queryset.filter(**filters).order_by().values(group).annotate(total=Sum(field)).values('total')
+    # Cast so SQLite doesn't fall back to integer division
+    return Coalesce(Cast(Subquery(rows), output_field=FloatField()), 0.0)
+
+
+def _latest(queryset, field, **filters):
+    return Subquery(queryset.filter(**filters).order_by().values(field).order_by(f'-{field}')[:1])
+
+
+def with_partner_stats(users):
+    """
+    Annotate users with their vehicle count, taken amount, current balance
+    and latest activity, as correlated subqueries of a single query.
+
+    Shares are worked out per partnership exactly as on the user detail
+    page: the vehicle's all-time profit (archive included) split by its
+    partner count, less what the user took from that vehicle.
+    """
+    partnerships = Vehicle.partners.through.objects.all()
+    vehicle = OuterRef('vehicle_id')
+    profit = (
+        _total(Rental.objects.all(), 'vehicle_id', 'total_amount_received', vehicle_id=vehicle)
+        + _total(MonthlySummary.objects.all(), 'vehicle_id', 'income', vehicle_id=vehicle)
+        - _total(Expense.objects.all(), 'vehicle_id', 'amount', vehicle_id=vehicle)
+        - _total(MonthlySummary.objects.all(), 'vehicle_id', 'expense', vehicle_id=vehicle)
+    )
+    partner_count = Subquery(
+        partnerships.filter(vehicle_id=vehicle).order_by().values('vehicle_id').annotate(count=Count('*')).values('count')
+    )
+    taken = _total(TakenAmount.objects.all(), 'vehicle_id', 'amount', vehicle_id=vehicle, user_id=OuterRef('user_id'))
+
+    user_partnerships = partnerships.filter(user_id=OuterRef('pk')).order_by().values('user_id')
+    return users.annotate(
+        vehicle_count=Coalesce(Subquery(user_partnerships.annotate(count=Count('*')).values('count')), 0),
+        profit_share=Coalesce(Subquery(user_partnerships.annotate(total=Sum(profit / partner_count)).values('total')), 0, output_field=FloatField()),
+        taken_total=Coalesce(Subquery(user_partnerships.annotate(total=Sum(taken)).values('total')), 0, output_field=FloatField()),
+        balance=F('profit_share') - F('taken_total'),
+        last_rental=_latest(Rental.objects.all(), 'updated_at', user_id=OuterRef('pk')),
+        last_expense=_latest(Expense.objects.all(), 'updated_at', user_id=OuterRef('pk')),
+        last_taken=_latest(TakenAmount.objects.all(), 'updated_at', user_id=OuterRef('pk')),
+    )
+
+
 @login_required
 def user_list(request):
     """Display list of users. Admin sees all, partners see themselves and their partners."""
-    if request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_users):
+    if request.access.can_manage_users:
         # Admin or users with manage permission see all users
-        users = User.objects.all().order_by('-date_joined')
+        users = User.objects.order_by('-date_joined')
     else:
         # Regular users only see themselves and their partners
-        # Get all vehicles where the current user is a partner
-        user_vehicles = Vehicle.objects.filter(partners=request.user)
-        # Get all partners from these vehicles, including the user themselves
-        users = User.objects.filter(vehicles__in=user_vehicles).distinct().order_by('username')
+        partner_ids = Vehicle.partners.through.objects.filter(vehicle_id__in=request.access.vehicle_ids).values('user_id')
+        users = User.objects.filter(Q(pk__in=partner_ids) | Q(pk=request.user.pk)).order_by('username')
 
-        # If user has no vehicles, at least show themselves
-        if not users.exists():
-            users = User.objects.filter(pk=request.user.pk)
+    counts = users.aggregate(total=Count('id'), active=Count('id', filter=Q(is_active=True)))
+
+    query = request.GET.get('q', '').strip()
+    if query:
+        users = users.filter(
+            Q(username__icontains=query) | Q(first_name__icontains=query)
+            | Q(last_name__icontains=query) | Q(email__icontains=query)
+        )
 
-    active_count = users.filter(is_active=True).count()
-    inactive_count = users.filter(is_active=False).count()
+    page = Paginator(with_partner_stats(users), USERS_PER_PAGE).get_page(request.GET.get('page'))
+    for user in page:
+        activity = [d for d in (user.last_login, user.last_rental, user.last_expense, user.last_taken) if d]
+        user.last_activity = max(activity) if activity else None
 
     context = {
-        'users': users,
-        'active_count': active_count,
-        'inactive_count': inactive_count,
+        'users': page,
+        'page_obj': page,
+        'query': query,
+        'total_count': counts['total'],
+        'active_count': counts['active'],
+        'inactive_count': counts['total'] - counts['active'],
     }
     return render(request, 'user_list.html', context)
 
 
+def _ledger_filters(request):
+    """Date range and partner chosen on the fleet ledger; year 'all' means every month."""
+    year = request.GET.get('year', str(datetime.now().year))
+    if year == 'all':
+        start = end = None
+    else:
+        try:
+            start, end = date(int(year), 1, 1), date(int(year) + 1, 1, 1)
+        except ValueError:
+            year = str(datetime.now().year)
+            start, end = date(int(year), 1, 1), date(int(year) + 1, 1, 1)
+    try:
+        partner_id = int(request.GET['partner']) if request.GET.get('partner') else None
+    except ValueError:
+        partner_id = None
+    return year, start, end, partner_id
+
+
 @login_required
-def user_detail(request, pk):
-    user = get_object_or_404(User, pk=pk)
+def fleet_ledger(request):
+    """Every partner's monthly share of every vehicle with running balances (superusers only)"""
+    if not request.access.is_superuser:
+        messages.error(request, "You do not have permission to view the fleet ledger.")
+        return redirect('dashboard')
 
-    # Permission check
-    if not request.user.is_superuser and request.user != user:
-        # Check if they share any vehicle
-        shared_vehicles = Vehicle.objects.filter(partners=request.user).filter(partners=user)
-        if not shared_vehicles.exists():
-            messages.error(request, "You do not have permission to view this user.")
-            return redirect('user_list')
+    year, start, end, partner_id = _ledger_filters(request)
+    rows = list(partner_ledger(start, end, user_id=partner_id))
 
     current_year = datetime.now().year
-    selected_year = request.GET.get('year', current_year)
-    try:
-        selected_year = int(selected_year)
-    except ValueError:
-        selected_year = current_year
+    first_dates = [d for d in (
+        Rental.objects.aggregate(first=Min('date_out'))['first'],
+        MonthlySummary.objects.aggregate(first=Min('month'))['first'],
+    ) if d]
+    first_year = min(first_dates).year if first_dates else current_year
 
-    rentals = Rental.objects.filter(user=user, date_out__year=selected_year).order_by('-date_out')
-    expenses = Expense.objects.filter(user=user, date__year=selected_year).order_by('-date')
+    context = {
+        'rows': rows,
+        'totals': {key: sum(row[key] for row in rows) for key in ('income', 'expense', 'profit', 'taken')},
+        'partners': User.objects.filter(vehicles__isnull=False).distinct().order_by('username'),
+        'selected_year': year,
+        'selected_partner': partner_id,
+        'available_years': [str(y) for y in range(current_year, first_year - 1, -1)],
+    }
+    return render(request, 'fleet_ledger.html', context)
 
-    total_income = 0
-    total_expense = 0
-    profit = 0
 
-    monthly_shares = {}
-    monthly_taken = {}
-    vehicles = user.vehicles.all()
+@login_required
+def fleet_ledger_csv(request):
+    """The fleet ledger streamed as CSV"""
+    if not request.access.is_superuser:
+        messages.error(request, "You do not have permission to view the fleet ledger.")
+        return redirect('dashboard')
 
-    for vehicle in vehicles:
+    year, start, end, partner_id = _ledger_filters(request)
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow([
+            'Partner', 'Vehicle', 'Month', 'Partners', 'Income Share', 'Expense Share', 'Profit Share',
+            'Taken', 'Vehicle Balance', 'Running Balance',
+        ])
+        for row in partner_ledger(start, end, user_id=partner_id):
+            yield writer.writerow([
+                row['username'], row['vehicle_name'], row['month'].strftime('%Y-%m'), row['num_partners'],
+                f"{row['income']:.2f}", f"{row['expense']:.2f}", f"{row['profit']:.2f}", f"{row['taken']:.2f}",
+                f"{row['vehicle_balance']:.2f}", f"{row['balance']:.2f}",
+            ])
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="fleet_ledger_{year}.csv"'
+    return response
+
+
+def _user_monthly_shares(user, selected_year, since):
+    monthly_shares = {}
+    for vehicle in user.vehicles.all():
         num_partners = vehicle.partners.count()
         if num_partners > 0:
             # Get monthly stats for this vehicle for the selected year
-            v_rentals = vehicle.rentals.filter(date_out__year=selected_year).annotate(month=TruncMonth('date_out')).values('month').annotate(income=Sum('total_amount_received'))
-            v_expenses = vehicle.expenses.filter(date__year=selected_year).annotate(month=TruncMonth('date')).values('month').annotate(expense=Sum('amount'))
+            v_summaries = summaries_for(vehicle_ids=[vehicle.pk]).filter(month__year=selected_year, month__gte=since)
+            v_rentals = combine_monthly(vehicle.rentals.filter(date_out__year=selected_year, date_out__gte=since).annotate(month=TruncMonth('date_out')).values('month').annotate(income=Sum('total_amount_received')), archived_by_month(v_summaries, 'income'), 'income')
+            v_expenses = combine_monthly(vehicle.expenses.filter(date__year=selected_year, date__gte=since).annotate(month=TruncMonth('date')).values('month').annotate(expense=Sum('amount')), archived_by_month(v_summaries, 'expense'), 'expense')
 
             for r in v_rentals:
                 m_idx = r['month'].month
@@ -706,50 +1104,16 @@ def user_detail(request, pk):
                 if m_idx not in monthly_shares:
                     monthly_shares[m_idx] = {'income': 0, 'expense': 0}
                 monthly_shares[m_idx]['expense'] += float(e['expense']) / num_partners
+    return monthly_shares
 
-    taken_amounts = TakenAmount.objects.filter(user=user, date__year=selected_year).order_by('-date')
-    taken_by_month = taken_amounts.annotate(month=TruncMonth('date')).values('month').annotate(amount=Sum('amount')).order_by('month')
-
-    for t in taken_by_month:
-        m_idx = t['month'].month
-        monthly_taken[m_idx] = float(t['amount'])
-
-    final_monthly_data = []
-
-    import calendar
-
-    for m_idx in range(1, 13):
-        month_name = calendar.month_name[m_idx]
-        data = {
-            'month': month_name,
-            'income': 0,
-            'expense': 0,
-            'profit': 0,
-            'taken': 0
-        }
-
-        # Add share data
-        if m_idx in monthly_shares:
-            data['income'] = monthly_shares[m_idx]['income']
-            data['expense'] = monthly_shares[m_idx]['expense']
-            data['profit'] = data['income'] - data['expense']
-
-        # Add taken data
-        if m_idx in monthly_taken:
-            data['taken'] = monthly_taken[m_idx]
-
-        # Only add if there's data
-        if data['income'] != 0 or data['expense'] != 0 or data['taken'] != 0:
-            final_monthly_data.append(data)
 
+def _user_vehicle_data(user):
     vehicle_data = []
-    total_profit_share = Decimal('0')
-    total_taken = Decimal('0')
-
-    for vehicle in vehicles:
+    for vehicle in user.vehicles.all():
         # Get total profit for the vehicle (All time)
-        v_rentals_total = vehicle.rentals.aggregate(Sum('total_amount_received'))['total_amount_received__sum'] or 0
-        v_expenses_total = vehicle.expenses.aggregate(Sum('amount'))['amount__sum'] or 0
+        v_summaries = summaries_for(vehicle_ids=[vehicle.pk])
+        v_rentals_total = (vehicle.rentals.aggregate(Sum('total_amount_received'))['total_amount_received__sum'] or 0) + archived_total(v_summaries, 'income')
+        v_expenses_total = (vehicle.expenses.aggregate(Sum('amount'))['amount__sum'] or 0) + archived_total(v_summaries, 'expense')
         v_profit = Decimal(str(v_rentals_total)) - Decimal(str(v_expenses_total))
 
         # Calculate share based on number of partners
@@ -775,38 +1139,126 @@ def user_detail(request, pk):
             'taken_amount': vehicle_taken,
             'balance': vehicle_balance
         })
+    return vehicle_data
+
+
+def _closed_month_statements(user, selected_year):
+    """
+    {month number: stored PartnerStatement} for the closed months of the
+    year, from the first month with anything recorded on the user's vehicles.
+    """
+    vehicle_ids = user.vehicles.values('pk')
+    firsts = [
+        Rental.objects.filter(vehicle__in=vehicle_ids).aggregate(first=Min('date_out'))['first'],
+        Expense.objects.filter(vehicle__in=vehicle_ids).aggregate(first=Min('date'))['first'],
+        MonthlySummary.objects.filter(vehicle__in=vehicle_ids).aggregate(first=Min('month'))['first'],
+        TakenAmount.objects.filter(user=user).aggregate(first=Min('date'))['first'],
+    ]
+    firsts = [d for d in firsts if d]
+    if not firsts:
+        return {}
+    first_month = min(firsts).replace(day=1)
+    months = [date(selected_year, m_idx, 1) for m_idx in range(1, 13)]
+    return {month.month: get_statement(user, month) for month in months if first_month <= month and is_closed(month)}
+
+
+# user_detail_queries entries that may write: statements renders and
+# stores the closed months that have none yet
+USER_DETAIL_WRITES = ('statements',)
+
+
+def user_detail_queries(user, selected_year):
+    """
+    Independent queries behind the user detail page, keyed by name.
+
+    Closed months come from the stored partner statements; only the open
+    months are computed from the live tables.
+    """
+    this_month = date.today().replace(day=1)
+    taken_amounts = TakenAmount.objects.filter(user=user, date__year=selected_year, date__gte=this_month)
+    return {
+        'rentals': lambda: list(Rental.objects.filter(user=user, date_out__year=selected_year).order_by('-date_out')),
+        'expenses': lambda: list(Expense.objects.filter(user=user, date__year=selected_year).order_by('-date')),
+        'statements': lambda: _closed_month_statements(user, selected_year),
+        'monthly_shares': lambda: _user_monthly_shares(user, selected_year, since=this_month),
+        'taken_by_month': lambda: list(taken_amounts.annotate(month=TruncMonth('date')).values('month').annotate(amount=Sum('amount')).order_by('month')),
+        'vehicle_data': lambda: _user_vehicle_data(user),
+        'rental_years': lambda: list(Rental.objects.filter(user=user).dates('date_out', 'year')),
+        'expense_years': lambda: list(Expense.objects.filter(user=user).dates('date', 'year')),
+        'taken_years': lambda: list(TakenAmount.objects.filter(user=user).dates('date', 'year')),
+        # Also check vehicle rentals where user is partner
+        'vehicle_rental_years': lambda: list(Rental.objects.filter(vehicle__partners=user).dates('date_out', 'year')),
+        'archived_years': lambda: list(MonthlySummary.objects.filter(vehicle__partners=user).dates('month', 'year')),
+    }
+
+
+def user_detail_context(user, selected_year, results):
+    import calendar
+
+    current_year = datetime.now().year
+    this_month = date.today().replace(day=1)
+    monthly_shares = results['monthly_shares']
+    monthly_taken = {t['month'].month: float(t['amount']) for t in results['taken_by_month']}
+
+    final_monthly_data = []
+
+    for m_idx in range(1, 13):
+        month_name = calendar.month_name[m_idx]
+        data = {
+            'month': month_name,
+            'month_number': m_idx,
+            'is_closed': date(selected_year, m_idx, 1) < this_month,
+            'income': 0,
+            'expense': 0,
+            'profit': 0,
+            'taken': 0
+        }
+
+        statement = results['statements'].get(m_idx)
+        if statement is not None:
+            data['income'] = float(statement.income)
+            data['expense'] = float(statement.expense)
+            data['profit'] = data['income'] - data['expense']
+            data['taken'] = float(statement.taken)
+
+        # Add share data
+        if m_idx in monthly_shares:
+            data['income'] = monthly_shares[m_idx]['income']
+            data['expense'] = monthly_shares[m_idx]['expense']
+            data['profit'] = data['income'] - data['expense']
 
-        total_profit_share += user_share
-        total_taken += Decimal(str(vehicle_taken))
+        # Add taken data
+        if m_idx in monthly_taken:
+            data['taken'] = monthly_taken[m_idx]
 
+        # Only add if there's data
+        if data['income'] != 0 or data['expense'] != 0 or data['taken'] != 0:
+            final_monthly_data.append(data)
+
+    vehicle_data = results['vehicle_data']
+    total_profit_share = sum((row['user_share'] for row in vehicle_data), Decimal('0'))
+    total_taken = sum((Decimal(str(row['taken_amount'])) for row in vehicle_data), Decimal('0'))
     remaining_balance = total_profit_share - total_taken
 
     # Calculate totals from final_monthly_data (for the selected year)
-    for data in final_monthly_data:
-        total_income += data['income']
-        total_expense += data['expense']
-
+    total_income = sum(data['income'] for data in final_monthly_data)
+    total_expense = sum(data['expense'] for data in final_monthly_data)
     profit = total_income - total_expense
 
     # Get available years for filter
-    rental_years = Rental.objects.filter(user=user).dates('date_out', 'year')
-    expense_years = Expense.objects.filter(user=user).dates('date', 'year')
-    taken_years = TakenAmount.objects.filter(user=user).dates('date', 'year')
-    # Also check vehicle rentals where user is partner
-    vehicle_rental_years = Rental.objects.filter(vehicle__partners=user).dates('date_out', 'year')
-
     available_years = sorted(list(set(
-        [d.year for d in rental_years] +
-        [d.year for d in expense_years] +
-        [d.year for d in taken_years] +
-        [d.year for d in vehicle_rental_years] +
+        [d.year for d in results['rental_years']] +
+        [d.year for d in results['expense_years']] +
+        [d.year for d in results['taken_years']] +
+        [d.year for d in results['vehicle_rental_years']] +
+        [d.year for d in results['archived_years']] +
         [current_year]
     )), reverse=True)
 
-    context = {
+    return {
         'user_obj': user,
-        'rentals': rentals,
-        'expenses': expenses,
+        'rentals': results['rentals'],
+        'expenses': results['expenses'],
         'total_income': total_income,
         'total_expense': total_expense,
         'profit': profit,
@@ -817,12 +1269,58 @@ def user_detail(request, pk):
         'available_years': available_years,
         'vehicle_data': vehicle_data,
     }
-    return render(request, 'user_detail.html', context)
+
+
+def get_selected_year(request):
+    current_year = datetime.now().year
+    try:
+        selected_year = int(request.GET.get('year', current_year))
+    except ValueError:
+        return current_year
+    # Months of the year are built into dates
+    return min(max(selected_year, MINYEAR), MAXYEAR)
+
+
+@login_required
+def user_detail(request, pk):
+    user = get_object_or_404(User, pk=pk)
+
+    # Admin, the user themselves, or someone sharing a vehicle with them
+    if not request.access.can_view_user(user):
+        messages.error(request, "You do not have permission to view this user.")
+        return redirect('user_list')
+
+    selected_year = get_selected_year(request)
+    results = run_queries(user_detail_queries(user, selected_year))
+    return render(request, 'user_detail.html', user_detail_context(user, selected_year, results))
+
+@login_required
+def partner_statement(request, pk, year, month):
+    """Stored statement of a closed month, as HTML or ?format=xlsx"""
+    user = get_object_or_404(User, pk=pk)
+    if not request.access.can_view_user(user):
+        messages.error(request, "You do not have permission to view this user.")
+        return redirect('user_list')
+
+    try:
+        statement_month = date(year, month, 1)
+    except ValueError:
+        raise Http404("Invalid month.")
+    if not is_closed(statement_month):
+        messages.error(request, "Statements are only available for closed months.")
+        return redirect('user_detail', pk=pk)
+
+    statement = get_statement(user, statement_month)
+    if request.GET.get('format') == 'xlsx':
+        filename = f"{user.username}_statement_{statement_month.strftime('%Y_%m')}.xlsx"
+        return FileResponse(open_statement(statement, 'xlsx'), as_attachment=True, filename=filename)
+    return FileResponse(open_statement(statement, 'html'), content_type='text/html; charset=utf-8')
+
 
 @login_required
 def user_create(request):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_users)):
+    if not request.access.can_manage_users:
         messages.error(request, "You do not have permission to create users.")
         return redirect('user_list')
 
@@ -840,7 +1338,7 @@ def user_create(request):
 @login_required
 def user_edit(request, pk):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_users)):
+    if not request.access.can_manage_users:
         messages.error(request, "You do not have permission to edit users.")
         return redirect('user_list')
 
@@ -859,7 +1357,7 @@ def user_edit(request, pk):
 @login_required
 def user_delete(request, pk):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_users)):
+    if not request.access.can_manage_users:
         messages.error(request, "You do not have permission to delete users.")
         return redirect('user_list')
 
@@ -876,7 +1374,7 @@ def user_delete(request, pk):
 @require_POST
 def update_taken_amount(request, pk):
     # Check permission
-    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.can_manage_users)):
+    if not request.access.can_manage_users:
         messages.error(request, "You do not have permission to update taken amounts.")
         return redirect('user_list')
 
@@ -913,19 +1411,15 @@ def update_taken_amount(request, pk):
 
 
 # Vehicle Partners API
-from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 
 @require_http_methods(["GET"])
 def vehicle_partners_get(request, pk):
     """Get all partners and selected partners for a vehicle"""
     vehicle = get_object_or_404(Vehicle, pk=pk)
-    all_partners = User.objects.filter(is_active=True).order_by('username')
-    selected_partners = vehicle.partners.all()
-
     return JsonResponse({
-        'all_partners': [{'id': p.id, 'username': p.username} for p in all_partners],
-        'selected_partners': [p.id for p in selected_partners]
+        'all_partners': [{'id': p.pk, 'username': p.username} for p in active_partners()],
+        'selected_partners': [p.pk for p in vehicle_partners(vehicle)]
     })
 
 @require_POST
@@ -1066,6 +1560,8 @@ def vehicle_export_excel(request, pk):
     if month == 'all':
         rentals = vehicle.rentals.all().order_by('date_out')
         expenses = vehicle.expenses.all().order_by('date')
+        archived_rentals = vehicle.archived_rentals.all()
+        archived_expenses = vehicle.archived_expenses.all()
         filename = f"{vehicle.name}_{year}_All_Data.xlsx"
         period_text = f"All Data - {year}"
     else:
@@ -1077,10 +1573,16 @@ def vehicle_export_excel(request, pk):
             date__year=year,
             date__month=month
         ).order_by('date')
+        archived_rentals = vehicle.archived_rentals.filter(date_out__year=year, date_out__month=month)
+        archived_expenses = vehicle.archived_expenses.filter(date__year=year, date__month=month)
         month_name = datetime(int(year), int(month), 1).strftime('%B')
         filename = f"{vehicle.name}_{month_name}_{year}.xlsx"
         period_text = f"{month_name} {year}"
 
+    # Archived periods are exported from the archive tables
+    rentals = with_archived(rentals, archived_rentals, 'date_out')
+    expenses = with_archived(expenses, archived_expenses, 'date')
+
     # Styles
     title_font = Font(bold=True, size=14, color="FF0000")  # Red
     header_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")  # Yellow
@@ -46,6 +46,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'rentals.middleware.AccessContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -101,6 +102,7 @@ USE_I18N = True
 USE_TZ = True
 
 import os
+import tempfile
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 STATIC_URL = '/static/'
@@ -129,3 +131,30 @@ DEFAULT_FROM_EMAIL = 'Vehicle Manager <your-email@gmail.com>'
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
+
+# Keep sessions in a signed cookie so logins and page views don't write to
+# django_session. Sessions only hold the login and flash messages, which fit
+# comfortably in a cookie; they are signed with SECRET_KEY, so rotating it
+# logs everyone out. Set SESSION_ENGINE to
+# django.contrib.sessions.backends.cache (with a shared CACHES backend) or
+# .db to keep them on the server instead.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.signed_cookies')
+SESSION_COOKIE_HTTPONLY = True
+
+# Partner lists, EMI status and expense category rules are cached and
+# invalidated by signals in whichever process made the change, so every
+# worker must read the same cache. The file cache is shared by all
+# processes on one host; point CACHE_BACKEND and CACHE_LOCATION at Redis or
+# Memcached when running on several hosts. The rentals app refuses a
+# per-process LocMemCache (check rentals.E001).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'vehicle_manager_cache')),
+    }
+}
+
+# Serve the dashboard, vehicle detail and user detail pages with their async
+# variants, which run independent queries concurrently. Only worth enabling
+# when running under ASGI (vehicle_manager/asgi.py).
+RENTALS_ASYNC_VIEWS = os.environ.get('RENTALS_ASYNC_VIEWS', '') == '1'